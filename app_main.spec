@@ -6,6 +6,7 @@ block_cipher = None
 added_files = [
     ( 'perfi.schema.sql', '.' ),
     ( 'cache.schema.sql', '.' ),
+    ( 'migrations', 'migrations' ),
     ( 'README.md', '.' ),
     ( 'frontend', 'frontend' ),
 ]
@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Times the perfi pipeline against a deterministic synthetic dataset in a scratch database"
+    )
+    parser.add_argument("--entities", type=int, default=2, help="number of entities")
+    parser.add_argument("--wallets", type=int, default=2, help="wallets per entity")
+    parser.add_argument("--txs", type=int, default=200, help="tx_chain rows per wallet")
+    parser.add_argument(
+        "--fills", type=int, default=200, help="exchange CSV fills per entity"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=1, help="random seed for the generator"
+    )
+    parser.add_argument(
+        "--api_requests",
+        type=int,
+        default=10,
+        help="requests per API endpoint per entity",
+    )
+    parser.add_argument(
+        "--workdir",
+        help="where to put the scratch db, CSVs and 8949s (default: a temp dir)",
+    )
+    parser.add_argument(
+        "--output", help="results JSON path (default: data/generated_files/benchmarks/)"
+    )
+    parser.add_argument("--compare", help="a previous results JSON to compare against")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="perfi-benchmark-")
+    db_path = f"{workdir}/perfi.db"
+    if os.path.exists(db_path):
+        print(
+            f"ERROR: {db_path} already exists. Benchmarks need an empty scratch database."
+        )
+        sys.exit(1)
+
+    # perfi opens its database at import time, so point it at the scratch db before importing anything
+    os.makedirs(workdir, exist_ok=True)
+    os.environ["PERFI_DB_PATH"] = db_path
+
+    from perfi.benchmark import BenchmarkConfig, run_benchmark, compare_results
+    from perfi.constants.paths import GENERATED_FILES_DIR
+    from perfi.db import db
+
+    config = BenchmarkConfig(
+        entities=args.entities,
+        wallets=args.wallets,
+        txs=args.txs,
+        fills=args.fills,
+        seed=args.seed,
+        api_requests=args.api_requests,
+    )
+    results = run_benchmark(db, config, workdir)
+
+    output = args.output
+    if not output:
+        os.makedirs(f"{GENERATED_FILES_DIR}/benchmarks", exist_ok=True)
+        output = f"{GENERATED_FILES_DIR}/benchmarks/benchmark-{int(time.time())}.json"
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print()
+    print(f"{'stage':36} {'seconds':>10} {'items':>8}")
+    for name, stage in results["stages"].items():
+        print(f"{name:36} {stage['seconds']:10.3f} {stage['items']:8}")
+    print(f"Saved results to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        print(f"{'stage':36} {'baseline':>10} {'current':>10} {'change':>8}")
+        for c in compare_results(baseline, results):
+            baseline_seconds = (
+                f"{c['baseline_seconds']:10.3f}"
+                if c["baseline_seconds"] is not None
+                else f"{'-':>10}"
+            )
+            change = f"{c['change']:+8.1%}" if c["change"] is not None else f"{'-':>8}"
+            print(f"{c['stage']:36} {baseline_seconds} {c['seconds']:10.3f} {change}")
+
+
+if __name__ == "__main__":
+    main()
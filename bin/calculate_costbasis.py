@@ -1,5 +1,7 @@
 from perfi import costbasis
+from perfi.costbasis_compare import compare_lot_algorithms
 from perfi.constants.paths import LOG_DIR
+from perfi.metrics import print_metrics_summary
 
 import argparse
 import logging
@@ -22,6 +24,18 @@ def main():
         "--resumefrom", help="Skip tx_logicals until after the id specified"
     )
     parser.add_argument("--debugtx", help="Look for tx_ledger.id and debug")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Replay independent groups of assets in this many processes",
+    )
+    parser.add_argument(
+        "--compare",
+        nargs="*",
+        choices=costbasis.LOT_ALGORITHMS,
+        help="Instead of regenerating, replay once per lot algorithm (all if none given) and summarize gains",
+    )
     global args
     args = parser.parse_args()
 
@@ -32,7 +46,21 @@ def main():
         filename=f"{LOG_DIR}/costbasis-{entity}.log",
     )
 
-    costbasis.regenerate_costbasis_lots(entity, args=args)
+    if args.compare is not None:
+        summary = compare_lot_algorithms(
+            entity, algorithms=args.compare or costbasis.LOT_ALGORITHMS
+        )
+        print(
+            f"{'year':<6}{'algorithm':<11}{'short term':>16}{'long term':>16}{'total':>16}"
+        )
+        for row in summary:
+            print(
+                f"{row['year']:<6}{row['algorithm']:<11}{row['short_term_usd']:>16,.2f}"
+                f"{row['long_term_usd']:>16,.2f}{row['total_usd']:>16,.2f}"
+            )
+    else:
+        costbasis.regenerate_costbasis_lots(entity, args=args, workers=args.workers)
+    print_metrics_summary()
 
 
 if __name__ == "__main__":
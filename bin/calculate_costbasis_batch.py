@@ -0,0 +1,63 @@
+from perfi.costbasis_batch import get_entity_names, run_batch, write_run_summary
+
+import argparse
+import os
+import time
+
+import tabulate
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("entities", nargs="+", help='names of entities, or "all"')
+    parser.add_argument("--year", help="Generates cost basis for a specific year")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count(),
+        help="Run this many entities at once (defaults to the number of CPUs)",
+    )
+    args = parser.parse_args()
+
+    entities = get_entity_names(args.entities)
+
+    start = time.perf_counter()
+    summaries = run_batch(entities, processes=args.processes, year=args.year)
+    path = write_run_summary(summaries, time.perf_counter() - start)
+
+    rows = [
+        [
+            s.entity,
+            "ok" if s.ok else "FAILED",
+            f"{s.seconds:.1f}",
+            s.lots,
+            s.disposals,
+            s.income,
+            s.flags,
+            s.errors_logged,
+        ]
+        for s in summaries
+    ]
+    print(
+        tabulate.tabulate(
+            rows,
+            headers=[
+                "Entity",
+                "Status",
+                "Seconds",
+                "Lots",
+                "Disposals",
+                "Income",
+                "Flags",
+                "Errors",
+            ],
+        )
+    )
+    for s in summaries:
+        if s.error:
+            print(f"{s.entity}: {s.error}")
+    print(f"Run summary written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,16 @@
 # This is a single-command parser for perfi actions that we want users to be able to do
 from dataclasses import dataclass, replace
+from datetime import datetime, timezone
 from decimal import Decimal
 from enum import Enum
 import json
 import logging
+from typing import List, Optional
 
 import coinaddrvalidator
 from devtools import debug
 from rich.console import Console
+from rich.table import Table
 import sys
 import time
 import typer
@@ -21,6 +24,11 @@ from perfi.constants.paths import (
     DB_SCHEMA_PATH,
     CACHEDB_SCHEMA_PATH,
 )
+from perfi.balance.history import (
+    compact_balance_history_json,
+    downsample_balance_history,
+)
+from perfi.balance.updating import backfill_balance_symbols
 from perfi.costbasis import regenerate_costbasis_lots
 from perfi.events import EVENT_ACTION, EventStore
 from perfi.models import (
@@ -37,6 +45,13 @@ from perfi.models import (
     RecordNotFoundException,
 )
 from perfi.db import db
+from perfi.price_bundle import (
+    PriceBundleError,
+    entity_coin_ids,
+    export_price_bundle,
+    import_price_bundle,
+)
+from perfi.query_profiler import load_profiles, profile_paths
 
 from perfi.transaction.ledger_to_logical import TransactionLogicalGrouper
 
@@ -335,10 +350,127 @@ def ledger_move_tx_ledger(
         _refresh_state(entity_name, event.action)
 
 
+# Balances
+# ---------------------------------------------
+balance_app = typer.Typer()
+
+
+@balance_app.command("compact_history")
+def balance_compact_history():
+    converted = compact_balance_history_json(db)
+    print(f"Moved JSON for {converted} balance_history rows into balance_json")
+    deleted = downsample_balance_history(db, full=True)
+    print(f"Done. Downsampling removed {deleted} balance_history rows")
+
+
+@balance_app.command("backfill_symbols")
+def balance_backfill_symbols():
+    backfill_balance_symbols()
+    print("Done. Applied balance_symbol_map to existing balance rows")
+
+
+# DB
+# ---------------------------------------------
+db_app = typer.Typer()
+
+
+@db_app.command("top_queries")
+def db_top_queries(
+    n: int = typer.Option(20, help="Number of statements to show"),
+    db_name: str = typer.Option(
+        os.path.basename(DB_PATH), help="DB file name the profile was recorded for"
+    ),
+    clear: bool = typer.Option(
+        False, help="Delete the profiles afterwards so the next run starts fresh"
+    ),
+):
+    """Show the statements with the most total time across every PERFI_PROFILE_SQL=1 process's profile"""
+    paths = profile_paths(db_name)
+    if not paths:
+        print(
+            f"No SQL profiles for {db_name}. Run a perfi script with PERFI_PROFILE_SQL=1 first."
+        )
+        raise typer.Exit(1)
+
+    statements = sorted(load_profiles(paths), key=lambda s: s.total_ms, reverse=True)
+    table = Table("total ms", "calls", "avg ms", "max ms", "slow", "full scans", "sql")
+    for s in statements[:n]:
+        table.add_row(
+            f"{s.total_ms:.1f}",
+            str(s.calls),
+            f"{s.avg_ms:.2f}",
+            f"{s.max_ms:.1f}",
+            str(s.slow_calls),
+            ", ".join(s.full_scans),
+            s.sql,
+        )
+    console.print(table)
+
+    if clear:
+        for path in paths:
+            os.remove(path)
+
+
+# Prices
+# ---------------------------------------------
+prices_app = typer.Typer()
+
+
+def _utc_epoch(day: Optional[str], end_of_day=False):
+    if day is None:
+        return None
+    epoch = int(
+        datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
+    )
+    return epoch + 86399 if end_of_day else epoch
+
+
+@prices_app.command("export")
+def prices_export(
+    path: str,
+    asset: List[str] = typer.Option([], help="asset_price_id to include (repeatable)"),
+    entity: Optional[str] = typer.Option(
+        None, help="Include every asset this entity's cost basis is priced with"
+    ),
+    start: Optional[str] = typer.Option(None, help="First day (YYYY-MM-DD, UTC)"),
+    end: Optional[str] = typer.Option(None, help="Last day (YYYY-MM-DD, UTC)"),
+):
+    """Write prices and fx rates to a compressed bundle for `prices import` on another machine"""
+    coin_ids = list(asset)
+    if entity:
+        coin_ids += entity_coin_ids(db, entity)
+    counts = export_price_bundle(
+        db,
+        path,
+        coin_ids=coin_ids or None,
+        start=_utc_epoch(start),
+        end=_utc_epoch(end, end_of_day=True),
+    )
+    print(
+        f"Exported {counts['prices']} prices and {counts['fx_rates']} fx rates to {path}"
+    )
+
+
+@prices_app.command("import")
+def prices_import(path: str):
+    """Load a bundle from `prices export`. Run with PERFI_OFFLINE_PRICES=1 afterwards to only use local prices"""
+    try:
+        counts = import_price_bundle(db, path)
+    except PriceBundleError as err:
+        print(err)
+        raise typer.Exit(1)
+    print(
+        f"Imported {counts['prices']} prices and {counts['fx_rates']} fx rates from {path}"
+    )
+
+
 app = typer.Typer(add_completion=False)
 app.add_typer(entity_app, name="entity")
 app.add_typer(ledger_app, name="ledger")
 app.add_typer(setting_app, name="setting")
+app.add_typer(balance_app, name="balance")
+app.add_typer(db_app, name="db")
+app.add_typer(prices_app, name="prices")
 
 
 # Perfi Setup
@@ -16,7 +16,9 @@ if sys.stdout.isatty():
 args = None
 
 
-def close_year(entity_name: str, year: int = None, output_path: str = None):
+def close_year(
+    entity_name: str, year: int = None, output_path: str = None, reopen=False
+):
     entity = entity_name
     logging.basicConfig(
         level=logging.WARN,
@@ -25,7 +27,14 @@ def close_year(entity_name: str, year: int = None, output_path: str = None):
     )
 
     f = costbasis.CostbasisYearCloser(entity, year, output_path)
-    f.lock_costbasis_lots()
+    if reopen:
+        f.reopen()
+        print(f"Reopened {year} (and any later closed years) for {entity}")
+        return
+
+    # Regenerates and locks the year, then later regenerations start from this snapshot instead of recomputing it
+    lots = f.snapshot_closing_lots()
+    print(f"Stored {lots} closing lots for {entity} {year}")
     f.export_closing_values()
 
 
@@ -38,9 +47,14 @@ def main():
     parser.add_argument(
         "--output", help="Path for closed cost basis values export file"
     )
+    parser.add_argument(
+        "--reopen",
+        action="store_true",
+        help="Drop the closing snapshot for this year and later years so they are regenerated again",
+    )
     global args
     args = parser.parse_args()
-    close_year(args.entity, args.year, args.output)
+    close_year(args.entity, args.year, args.output, args.reopen)
 
 
 if __name__ == "__main__":
@@ -5,6 +5,7 @@ from devtools import debug
 
 from perfi import costbasis
 from perfi.constants.paths import LOG_DIR
+from perfi.metrics import metrics, print_metrics_summary
 import sys
 
 if sys.stdout.isatty():
@@ -16,6 +17,7 @@ if sys.stdout.isatty():
 args = None
 
 
+@metrics.timed_stage("8949")
 def generate_file(entity_name: str, year: int = None, output_path: str = None):
     if year:
         year = int(year)
@@ -45,6 +47,7 @@ def main():
     global args
     args = parser.parse_args()
     generate_file(args.entity, args.year, args.output)
+    print_metrics_summary()
 
 
 if __name__ == "__main__":
@@ -6,9 +6,11 @@ import time
 
 from perfi.db import db
 from perfi.events import EventStore
+from perfi.metrics import print_metrics_summary
 from perfi.models import TxLedger, TxLogical
 from perfi.transaction.chain_to_ledger import update_entity_transactions
 from perfi.transaction.ledger_to_logical import TransactionLogicalGrouper
+from perfi.tx_stream import refresh_entity_tx_stream
 
 
 logger = logging.getLogger(__name__)
@@ -72,6 +74,8 @@ def main():
     # re-apply any manual events
     event_store = EventStore(db, TxLogical, TxLedger)
     event_store.apply_events(source="manual")
+    refresh_entity_tx_stream()
+    print_metrics_summary()
 
 
 if __name__ == "__main__":
@@ -4,6 +4,7 @@ import sys
 
 from perfi.constants.paths import LOG_DIR
 from perfi.ingest.chain import scrape_entity_transactions
+from perfi.metrics import print_metrics_summary
 
 ### Control DEBUG output/flow
 logger = logging.getLogger(__name__)
@@ -23,6 +24,11 @@ def main():
         help="Force re-indexing vs pulling cached chain values",
         action="store_true",
     )
+    parser.add_argument(
+        "--incremental",
+        help="Only fetch history since the newest stored tx for each address (plus a small overlap)",
+        action="store_true",
+    )
     args = parser.parse_args()
 
     entity = args.entity
@@ -40,7 +46,8 @@ def main():
         filename=f"{LOG_DIR}/import_chain_txs-{entity}.log",
     )
 
-    scrape_entity_transactions(entity)
+    scrape_entity_transactions(entity, incremental=args.incremental)
+    print_metrics_summary()
 
 
 if __name__ == "__main__":
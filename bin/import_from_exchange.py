@@ -4,6 +4,7 @@ import sys
 
 
 from perfi.db import db
+from perfi.metrics import metrics, print_metrics_summary
 from perfi.ingest.exchange import (
     BitcoinTaxImporter,
     CoinbaseImporter,
@@ -11,6 +12,8 @@ from perfi.ingest.exchange import (
     GeminiImporter,
     KrakenImporter,
     CoinbaseTransactionHistoryImporter,
+    ImportCheckpoint,
+    IMPORT_CHUNK_SIZE,
 )
 
 logger = logging.getLogger(__name__)
@@ -35,6 +38,22 @@ def main():
         help='some sort of ID to associate with the records in FILE (e.g. "peepo_coinbase_1")',
         required=True,
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="save in chunks while reading FILE (for exports too big to import in memory); resumes if interrupted",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=IMPORT_CHUNK_SIZE,
+        help="txs to save at a time with --stream",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="with --stream, ignore any interrupted import of FILE and start from the top",
+    )
 
     args = parser.parse_args()
 
@@ -53,10 +72,28 @@ def main():
     except:
         raise Exception(f"Entity name {args.entity_name} not found in database!")
 
-    do_import(entity_id, args.exchange, args.exchange_account_id, args.file)
-
-
-def do_import(entity_id: int, exchange: str, exchange_account_id: str, file):
+    do_import(
+        entity_id,
+        args.exchange,
+        args.exchange_account_id,
+        args.file,
+        stream=args.stream,
+        chunk_size=args.chunk_size,
+        restart=args.restart,
+    )
+    print_metrics_summary()
+
+
+@metrics.timed_stage("ingest_exchange")
+def do_import(
+    entity_id: int,
+    exchange: str,
+    exchange_account_id: str,
+    file,
+    stream=False,
+    chunk_size=IMPORT_CHUNK_SIZE,
+    restart=False,
+):
     # See if our entity_address we want to use exists yet. If not, create it.
     entity_address_for_imports = f"{exchange}.{exchange_account_id}"
     sql = """SELECT a.address from address a where a.address = ?"""
@@ -98,12 +135,25 @@ def do_import(entity_id: int, exchange: str, exchange_account_id: str, file):
     importer = importer_class()
     filemode = "rb" if exchange == "gemini" else "r"
 
-    with open(file, filemode) as file:
-        importer.do_import(
-            file,
-            entity_address_for_imports=entity_address_for_imports,
-            exchange_account_id=exchange_account_id,
-        )
+    if stream:
+        checkpoint = ImportCheckpoint(exchange, exchange_account_id, file)
+        if restart:
+            checkpoint.clear()
+        with open(file, filemode) as file:
+            importer.do_stream_import(
+                file,
+                entity_address_for_imports=entity_address_for_imports,
+                exchange_account_id=exchange_account_id,
+                chunk_size=chunk_size,
+                checkpoint=checkpoint,
+            )
+    else:
+        with open(file, filemode) as file:
+            importer.do_import(
+                file,
+                entity_address_for_imports=entity_address_for_imports,
+                exchange_account_id=exchange_account_id,
+            )
 
     logger.debug("Done.")
 
@@ -1,6 +1,7 @@
 import json
 from perfi.cache import cache
 from perfi.db import db
+from perfi.metrics import print_metrics_summary
 from perfi.settings import setting
 from pprint import pprint
 import sys
@@ -14,6 +15,7 @@ def main():
     else:
         entity = 'peepo'
     update_entity_balances(entity)
+    print_metrics_summary()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,22 @@
+import argparse
+
+from perfi.db import db
+from perfi.fx import update_fx_rates
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Append the latest ECB fiat reference rates to the fx_rates table. Run daily (e.g. from cron)."
+    )
+    parser.add_argument(
+        "--file",
+        help="Load from an already downloaded eurofxref-hist.zip (or .csv) instead of fetching it",
+    )
+    args = parser.parse_args()
+
+    added = update_fx_rates(db, ecb_file=args.file)
+    print(f"Added {added} fx rates")
+
+
+if __name__ == "__main__":
+    main()
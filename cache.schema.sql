@@ -5,3 +5,11 @@ CREATE TABLE IF NOT EXISTS "cache" (
 	"expire"	INTEGER,
 	PRIMARY KEY("key")
 );
+CREATE TABLE IF NOT EXISTS "rpc_tx" (
+	"chain"	TEXT NOT NULL,
+	"hash"	TEXT NOT NULL,
+	"tx_json"	TEXT,
+	"receipt_json"	TEXT,
+	"saved"	INTEGER,
+	PRIMARY KEY("chain","hash")
+);
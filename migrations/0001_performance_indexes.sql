@@ -0,0 +1,30 @@
+-- Indexes for the predicates the ledger, grouping, costbasis and balance code filter on
+CREATE INDEX IF NOT EXISTS "idx_tx_ledger_address" ON "tx_ledger" (
+	"address"
+);
+CREATE INDEX IF NOT EXISTS "idx_tx_logical_address_timestamp" ON "tx_logical" (
+	"address",
+	"timestamp"
+);
+CREATE INDEX IF NOT EXISTS "idx_tx_chain_address_timestamp" ON "tx_chain" (
+	"address",
+	"timestamp"
+);
+CREATE INDEX IF NOT EXISTS "idx_costbasis_lot_entity" ON "costbasis_lot" (
+	"entity"
+);
+CREATE INDEX IF NOT EXISTS "idx_costbasis_disposal_entity_timestamp" ON "costbasis_disposal" (
+	"entity",
+	"timestamp"
+);
+CREATE INDEX IF NOT EXISTS "idx_event_action_timestamp" ON "event" (
+	"action",
+	"timestamp"
+);
+CREATE INDEX IF NOT EXISTS "idx_balance_current_address_type" ON "balance_current" (
+	"address",
+	"type"
+);
+CREATE INDEX IF NOT EXISTS "idx_asset_tx_asset_price_id" ON "asset_tx" (
+	"asset_price_id"
+);
@@ -0,0 +1,47 @@
+"""
+Rewrite costbasis_lot.history from jsonpickled TxLedger copies to [[tx_ledger_id, amount], ...] references and stop
+duplicating flags in costbasis_lot.flags (they're read from the flag table).
+"""
+import json
+
+import jsonpickle
+
+
+class LegacyTxLedger:
+    """Stands in for the pickled TxLedger classes so we don't need to import perfi.models while perfi.db loads"""
+
+    def __setstate__(self, state):
+        # pydantic models pickle their fields under __dict__
+        self.__dict__.update(state.get("__dict__", state))
+
+
+LEGACY_CLASSES = {
+    "perfi.models.TxLedger": LegacyTxLedger,
+    "perfi.models.TxLedgerRow": LegacyTxLedger,
+}
+
+
+def is_reference_history(history):
+    try:
+        return all(isinstance(h, list) for h in json.loads(history))
+    except ValueError:
+        return False
+
+
+def upgrade(db):
+    rows = db.cur.execute(
+        "SELECT tx_ledger_id, history FROM costbasis_lot WHERE history IS NOT NULL"
+    ).fetchall()
+
+    params = []
+    for tx_ledger_id, history in rows:
+        if is_reference_history(history):
+            continue
+        decoded = jsonpickle.decode(history, classes=LEGACY_CLASSES)
+        refs = [[t.id, str(t.amount)] for t in decoded]
+        params.append([json.dumps(refs, separators=(",", ":")), tx_ledger_id])
+
+    db.cur.executemany(
+        "UPDATE costbasis_lot SET history = ? WHERE tx_ledger_id = ?", params
+    )
+    db.cur.execute("UPDATE costbasis_lot SET flags = NULL")
@@ -0,0 +1,78 @@
+-- Full-text search over tx_logicals. Each tx_logical_fts row is keyed by its tx_logical's rowid and holds the
+-- logical's own text plus the symbols, counterparty names and hashes of its ledgers.
+--
+-- Triggers on every table that feeds it only note which tx_logical rowids changed in tx_logical_fts_pending, so
+-- grouping and events stay cheap; TxLogicalStore.search rebuilds the pending rows in one pass before it queries.
+CREATE VIEW IF NOT EXISTS "tx_logical_search_doc" AS
+SELECT
+	log.rowid AS "doc_rowid",
+	log.id AS "id",
+	log.description AS "description",
+	log.note AS "note",
+	(SELECT group_concat(DISTINCT led.symbol)
+	 FROM tx_rel_ledger_logical rel JOIN tx_ledger led ON led.id = rel.tx_ledger_id
+	 WHERE rel.tx_logical_id = log.id) AS "symbols",
+	(SELECT group_concat(DISTINCT coalesce(led.from_address_name, '') || ' ' || coalesce(led.to_address_name, ''))
+	 FROM tx_rel_ledger_logical rel JOIN tx_ledger led ON led.id = rel.tx_ledger_id
+	 WHERE rel.tx_logical_id = log.id) AS "counterparties",
+	(SELECT group_concat(DISTINCT led.hash)
+	 FROM tx_rel_ledger_logical rel JOIN tx_ledger led ON led.id = rel.tx_ledger_id
+	 WHERE rel.tx_logical_id = log.id) AS "hashes"
+FROM tx_logical log;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS "tx_logical_fts" USING fts5(
+	description,
+	note,
+	symbols,
+	counterparties,
+	hashes
+);
+
+CREATE TABLE IF NOT EXISTS "tx_logical_fts_pending" (
+	"doc_rowid" INTEGER PRIMARY KEY
+);
+
+INSERT INTO tx_logical_fts_pending (doc_rowid) SELECT rowid FROM tx_logical;
+
+-- A REPLACE INTO gives the tx_logical a new rowid; the old one is marked pending by the delete trigger
+CREATE TRIGGER IF NOT EXISTS "tx_logical_fts_insert" AFTER INSERT ON tx_logical BEGIN
+	INSERT OR IGNORE INTO tx_logical_fts_pending (doc_rowid) VALUES (new.rowid);
+END;
+
+CREATE TRIGGER IF NOT EXISTS "tx_logical_fts_update" AFTER UPDATE OF id, description, note ON tx_logical BEGIN
+	INSERT OR IGNORE INTO tx_logical_fts_pending (doc_rowid) VALUES (new.rowid);
+END;
+
+CREATE TRIGGER IF NOT EXISTS "tx_logical_fts_delete" AFTER DELETE ON tx_logical BEGIN
+	INSERT OR IGNORE INTO tx_logical_fts_pending (doc_rowid) VALUES (old.rowid);
+END;
+
+CREATE TRIGGER IF NOT EXISTS "tx_rel_ledger_logical_fts_insert" AFTER INSERT ON tx_rel_ledger_logical BEGIN
+	INSERT OR IGNORE INTO tx_logical_fts_pending (doc_rowid)
+	SELECT rowid FROM tx_logical WHERE id = new.tx_logical_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS "tx_rel_ledger_logical_fts_update" AFTER UPDATE ON tx_rel_ledger_logical BEGIN
+	INSERT OR IGNORE INTO tx_logical_fts_pending (doc_rowid)
+	SELECT rowid FROM tx_logical WHERE id IN (old.tx_logical_id, new.tx_logical_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS "tx_rel_ledger_logical_fts_delete" AFTER DELETE ON tx_rel_ledger_logical BEGIN
+	INSERT OR IGNORE INTO tx_logical_fts_pending (doc_rowid)
+	SELECT rowid FROM tx_logical WHERE id = old.tx_logical_id;
+END;
+
+-- TxLedgerStore.save is a REPLACE INTO, so inserts count too
+CREATE TRIGGER IF NOT EXISTS "tx_ledger_fts_insert" AFTER INSERT ON tx_ledger BEGIN
+	INSERT OR IGNORE INTO tx_logical_fts_pending (doc_rowid)
+	SELECT log.rowid
+	FROM tx_rel_ledger_logical rel JOIN tx_logical log ON log.id = rel.tx_logical_id
+	WHERE rel.tx_ledger_id = new.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS "tx_ledger_fts_update" AFTER UPDATE OF symbol, hash, from_address_name, to_address_name ON tx_ledger BEGIN
+	INSERT OR IGNORE INTO tx_logical_fts_pending (doc_rowid)
+	SELECT log.rowid
+	FROM tx_rel_ledger_logical rel JOIN tx_logical log ON log.id = rel.tx_logical_id
+	WHERE rel.tx_ledger_id = new.id;
+END;
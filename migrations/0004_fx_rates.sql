@@ -0,0 +1,8 @@
+-- ECB reference rates as units of currency per EUR, one row per currency per business day. Filled and appended to
+-- by perfi.fx.update_fx_rates (bin/update_fx_rates.py); rates are Decimal strings so conversions stay exact.
+CREATE TABLE IF NOT EXISTS "fx_rates" (
+	"currency" TEXT NOT NULL,
+	"day" TEXT NOT NULL,
+	"rate" TEXT NOT NULL,
+	PRIMARY KEY("currency", "day")
+) WITHOUT ROWID;
@@ -0,0 +1,24 @@
+-- Disposals from perfi.costbasis_compare, one set per lot matching algorithm. Same columns as costbasis_disposal;
+-- these never feed the 8949, they are only for comparing algorithms.
+CREATE TABLE IF NOT EXISTS "costbasis_disposal_scenario" (
+	"id" INTEGER,
+	"algorithm" TEXT NOT NULL,
+	"entity" TEXT,
+	"address" TEXT,
+	"asset_price_id" TEXT,
+	"symbol" TEXT,
+	"amount" DECIMAL,
+	"timestamp" INTEGER,
+	"duration_held" INTEGER,
+	"basis_timestamp" INTEGER,
+	"basis_tx_ledger_id" TEXT,
+	"basis_usd" DECIMAL,
+	"total_usd" DECIMAL,
+	"tx_ledger_id" INTEGER,
+	"price_source" TEXT,
+	PRIMARY KEY("id" AUTOINCREMENT)
+);
+CREATE INDEX IF NOT EXISTS "idx_costbasis_disposal_scenario_entity_algorithm" ON "costbasis_disposal_scenario" (
+	"entity",
+	"algorithm"
+);
@@ -0,0 +1,32 @@
+-- Closing lot books (see CostbasisYearCloser.snapshot_closing_lots). costbasis_year_snapshot records which years are
+-- closed per entity, costbasis_lot_snapshot holds the entity's lots as of the end of that year, with the lot's perfi
+-- flags as JSON [name, description, source, created_at] lists in "flags".
+CREATE TABLE IF NOT EXISTS "costbasis_year_snapshot" (
+	"entity" TEXT NOT NULL,
+	"year" INTEGER NOT NULL,
+	"lots" INTEGER,
+	"created_at" INTEGER,
+	PRIMARY KEY("entity", "year")
+);
+
+CREATE TABLE IF NOT EXISTS "costbasis_lot_snapshot" (
+	"entity" TEXT NOT NULL,
+	"year" INTEGER NOT NULL,
+	"tx_ledger_id" TEXT NOT NULL,
+	"address" TEXT,
+	"asset_price_id" TEXT,
+	"symbol" TEXT,
+	"chain" TEXT,
+	"asset_tx_id" TEXT,
+	"original_amount" DECIMAL,
+	"current_amount" DECIMAL,
+	"price_usd" DECIMAL,
+	"basis_usd" DECIMAL,
+	"timestamp" INTEGER,
+	"history" TEXT,
+	"flags" TEXT,
+	"receipt" INTEGER,
+	"price_source" TEXT,
+	"locked_for_year" INTEGER,
+	PRIMARY KEY("entity", "year", "tx_ledger_id")
+);
@@ -0,0 +1,121 @@
+-- One row per tx_ledger per entity that owns its tx_logical's address: the tx_logical ⨝ tx_rel_ledger_logical ⨝
+-- tx_ledger ⨝ flag join that costbasis, the 8949 and the API each rebuild, stored in (entity, timestamp) order so an
+-- entity's history is one indexed range scan. "flags" is a TX_LOGICAL_FLAG bitmask (see perfi.tx_stream) and
+-- mapped_asset_price_id/mapped_symbol are PriceFeed.map_asset's like-kind asset for the ledger.
+--
+-- Like tx_logical_fts, the triggers below only note which tx_logicals changed in entity_tx_stream_pending;
+-- refresh_entity_tx_stream rebuilds those tx_logicals' rows after grouping and before anything reads the stream.
+CREATE TABLE IF NOT EXISTS "entity_tx_stream" (
+	"entity" TEXT NOT NULL,
+	"timestamp" INTEGER NOT NULL,
+	"tx_logical_id" TEXT NOT NULL,
+	"ledger_timestamp" INTEGER NOT NULL,
+	"tx_ledger_id" TEXT NOT NULL,
+	"address" TEXT NOT NULL,
+	"tx_logical_type" TEXT,
+	"flags" INTEGER NOT NULL DEFAULT 0,
+	"chain" TEXT,
+	"hash" TEXT,
+	"from_address" TEXT,
+	"to_address" TEXT,
+	"asset_tx_id" TEXT,
+	"isfee" INTEGER,
+	"amount" DECIMAL,
+	"direction" TEXT,
+	"tx_ledger_type" TEXT,
+	"asset_price_id" TEXT,
+	"symbol" TEXT,
+	"price_usd" DECIMAL,
+	"mapped_asset_price_id" TEXT,
+	"mapped_symbol" TEXT,
+	PRIMARY KEY("entity", "timestamp", "tx_logical_id", "ledger_timestamp", "tx_ledger_id")
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS "idx_entity_tx_stream_tx_logical_id" ON "entity_tx_stream" (
+	"tx_logical_id"
+);
+CREATE INDEX IF NOT EXISTS "idx_entity_tx_stream_asset_tx" ON "entity_tx_stream" (
+	"chain",
+	"asset_tx_id"
+);
+
+CREATE TABLE IF NOT EXISTS "entity_tx_stream_pending" (
+	"tx_logical_id" TEXT PRIMARY KEY
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO entity_tx_stream_pending (tx_logical_id) SELECT id FROM tx_logical;
+
+CREATE TRIGGER IF NOT EXISTS "tx_logical_stream_insert" AFTER INSERT ON tx_logical BEGIN
+	INSERT OR IGNORE INTO entity_tx_stream_pending (tx_logical_id) VALUES (new.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS "tx_logical_stream_update" AFTER UPDATE OF id, address, count, timestamp, tx_logical_type ON tx_logical BEGIN
+	INSERT OR IGNORE INTO entity_tx_stream_pending (tx_logical_id) VALUES (old.id), (new.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS "tx_logical_stream_delete" AFTER DELETE ON tx_logical BEGIN
+	INSERT OR IGNORE INTO entity_tx_stream_pending (tx_logical_id) VALUES (old.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS "tx_rel_ledger_logical_stream_insert" AFTER INSERT ON tx_rel_ledger_logical BEGIN
+	INSERT OR IGNORE INTO entity_tx_stream_pending (tx_logical_id) VALUES (new.tx_logical_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS "tx_rel_ledger_logical_stream_update" AFTER UPDATE ON tx_rel_ledger_logical BEGIN
+	INSERT OR IGNORE INTO entity_tx_stream_pending (tx_logical_id) VALUES (old.tx_logical_id), (new.tx_logical_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS "tx_rel_ledger_logical_stream_delete" AFTER DELETE ON tx_rel_ledger_logical BEGIN
+	INSERT OR IGNORE INTO entity_tx_stream_pending (tx_logical_id) VALUES (old.tx_logical_id);
+END;
+
+-- TxLedgerStore.save is a REPLACE INTO, so inserts count too
+CREATE TRIGGER IF NOT EXISTS "tx_ledger_stream_insert" AFTER INSERT ON tx_ledger BEGIN
+	INSERT OR IGNORE INTO entity_tx_stream_pending (tx_logical_id)
+	SELECT tx_logical_id FROM tx_rel_ledger_logical WHERE tx_ledger_id = new.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS "tx_ledger_stream_update" AFTER UPDATE ON tx_ledger BEGIN
+	INSERT OR IGNORE INTO entity_tx_stream_pending (tx_logical_id)
+	SELECT tx_logical_id FROM tx_rel_ledger_logical WHERE tx_ledger_id = new.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS "tx_ledger_stream_delete" AFTER DELETE ON tx_ledger BEGIN
+	INSERT OR IGNORE INTO entity_tx_stream_pending (tx_logical_id)
+	SELECT tx_logical_id FROM tx_rel_ledger_logical WHERE tx_ledger_id = old.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS "flag_stream_insert" AFTER INSERT ON flag WHEN new.target_type = 'TxLogical' BEGIN
+	INSERT OR IGNORE INTO entity_tx_stream_pending (tx_logical_id) VALUES (new.target_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS "flag_stream_delete" AFTER DELETE ON flag WHEN old.target_type = 'TxLogical' BEGIN
+	INSERT OR IGNORE INTO entity_tx_stream_pending (tx_logical_id) VALUES (old.target_id);
+END;
+
+-- Which entity an address belongs to
+CREATE TRIGGER IF NOT EXISTS "address_stream_insert" AFTER INSERT ON address BEGIN
+	INSERT OR IGNORE INTO entity_tx_stream_pending (tx_logical_id)
+	SELECT id FROM tx_logical WHERE address = new.address;
+END;
+
+CREATE TRIGGER IF NOT EXISTS "address_stream_update" AFTER UPDATE OF address, entity_id ON address BEGIN
+	INSERT OR IGNORE INTO entity_tx_stream_pending (tx_logical_id)
+	SELECT id FROM tx_logical WHERE address IN (old.address, new.address);
+END;
+
+CREATE TRIGGER IF NOT EXISTS "address_stream_delete" AFTER DELETE ON address BEGIN
+	INSERT OR IGNORE INTO entity_tx_stream_pending (tx_logical_id)
+	SELECT id FROM tx_logical WHERE address = old.address;
+END;
+
+-- The mapped asset comes from asset_tx (map_assets REPLACEs rows, so inserts count too)
+CREATE TRIGGER IF NOT EXISTS "asset_tx_stream_insert" AFTER INSERT ON asset_tx BEGIN
+	INSERT OR IGNORE INTO entity_tx_stream_pending (tx_logical_id)
+	SELECT tx_logical_id FROM entity_tx_stream WHERE chain = new.chain AND asset_tx_id = new.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS "asset_tx_stream_update" AFTER UPDATE OF asset_price_id, symbol ON asset_tx BEGIN
+	INSERT OR IGNORE INTO entity_tx_stream_pending (tx_logical_id)
+	SELECT tx_logical_id FROM entity_tx_stream WHERE chain = new.chain AND asset_tx_id = new.id;
+END;
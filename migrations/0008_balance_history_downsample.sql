@@ -0,0 +1,14 @@
+-- How far back each balance_history downsampling tier (keyed by its bucket size in seconds) has been compacted, so
+-- downsample_balance_history only looks at the window that aged into the tier since the last refresh. The indexes
+-- keep those windows, and the balance_json keys their deleted rows referenced, to range scans and lookups.
+CREATE TABLE IF NOT EXISTS "balance_history_downsample" (
+	"bucket" INTEGER PRIMARY KEY,
+	"compacted_through" INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS "idx_balance_history_source_updated" ON "balance_history" (
+	"source",
+	"updated"
+);
+CREATE INDEX IF NOT EXISTS "idx_balance_history_extra" ON "balance_history" ("extra") WHERE "extra" IS NOT NULL;
+CREATE INDEX IF NOT EXISTS "idx_balance_history_proxy" ON "balance_history" ("proxy") WHERE "proxy" IS NOT NULL;
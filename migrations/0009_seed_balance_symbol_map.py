@@ -0,0 +1,14 @@
+"""
+Seed balance_symbol_map with the default symbol fixes, exposure symbols and stablecoins, so reading it never has to
+write. Rows already there (including any edited by hand) are kept.
+"""
+from perfi.constants.balance_symbols import default_balance_symbol_map
+
+
+def upgrade(db):
+    sql = """INSERT OR IGNORE INTO balance_symbol_map
+             (symbol, fixed_symbol, exposure_symbol, stable)
+             VALUES
+             (?, ?, ?, ?)
+          """
+    db.cur.executemany(sql, default_balance_symbol_map())
@@ -0,0 +1,9 @@
+-- entity_tx_stream's mapped_asset_price_id/mapped_symbol were never read (costbasis and the 8949 map assets
+-- themselves) and the asset_tx triggers meant to keep them current matched on chain, which imported ledgers
+-- ("import.coinbase", ...) never share with their asset_tx rows ("import"). Drop the columns, their triggers and the
+-- index only those triggers used.
+DROP TRIGGER IF EXISTS "asset_tx_stream_insert";
+DROP TRIGGER IF EXISTS "asset_tx_stream_update";
+DROP INDEX IF EXISTS "idx_entity_tx_stream_asset_tx";
+ALTER TABLE "entity_tx_stream" DROP COLUMN "mapped_asset_price_id";
+ALTER TABLE "entity_tx_stream" DROP COLUMN "mapped_symbol";
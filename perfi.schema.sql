@@ -88,6 +88,25 @@ CREATE TABLE IF NOT EXISTS "balance_history" (
      PRIMARY KEY("id" AUTOINCREMENT)
 );
 
+CREATE INDEX IF NOT EXISTS "idx_balance_history_address_updated" ON "balance_history" (
+	"address",
+	"updated"
+);
+
+CREATE TABLE IF NOT EXISTS "balance_json" (
+	"key"	TEXT,
+	"data"	TEXT,
+	PRIMARY KEY("key")
+);
+
+CREATE TABLE IF NOT EXISTS "balance_symbol_map" (
+	"symbol"	TEXT,
+	"fixed_symbol"	TEXT,
+	"exposure_symbol"	TEXT,
+	"stable"	INTEGER,
+	PRIMARY KEY("symbol")
+);
+
 CREATE TABLE IF NOT EXISTS "cache" (
 	"key"	TEXT,
 	"value"	BLOB,
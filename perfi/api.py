@@ -8,7 +8,11 @@ import time
 from pathlib import Path
 from tempfile import NamedTemporaryFile
 
-from perfi.balance.updating import update_entity_balances
+from perfi.balance.updating import (
+    load_balance_symbol_map,
+    normalize_balance_symbol,
+    update_entity_balances,
+)
 from perfi.constants.paths import DATA_DIR, IS_PYINSTALLER
 from perfi import costbasis
 from perfi.constants.paths import DATA_DIR
@@ -51,10 +55,14 @@ from fastapi import (
     Depends,
     FastAPI,
     Request,
+    Response,
     HTTPException,
+    Query,
     UploadFile,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from starlette.middleware.sessions import SessionMiddleware
@@ -78,6 +86,7 @@ from perfi.constants.paths import DATA_DIR, SOURCE_ROOT
 from perfi.costbasis import regenerate_costbasis_lots
 from perfi.db import DB
 from perfi.events import EventStore
+from perfi.metrics import metrics
 from perfi.ingest.chain import scrape_entity_transactions
 from perfi.models import (
     TxLogical,
@@ -92,6 +101,8 @@ from perfi.models import (
     TX_LOGICAL_TYPE,
     TxLedgerStore,
     TX_LOGICAL_FLAG,
+    Flag,
+    InvalidCursor,
 )
 from perfi.transaction.chain_to_ledger import (
     update_entity_transactions as do_chain_to_ledger,
@@ -170,7 +181,7 @@ class TxLogicalOut(BaseModel):
     timestamp: int = -1
     address: str = ""
     tx_logical_type: Optional[str] = ""  # replace with enum?
-    flags: List[Dict[str, str]] = []
+    flags: List[Flag] = []
     ins: List[TxLedger] = []
     outs: List[TxLedger] = []
     fee: Optional[TxLedger] = None
@@ -237,6 +248,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.add_middleware(
@@ -244,6 +256,16 @@ app.add_middleware(
     secret_key="change_me",  # pragma: allowlist secret
 )
 
+
+@app.middleware("http")
+async def refresh_search_index_after_writes(request: Request, call_next):
+    # Writes only mark tx_logicals pending in the search index, rebuild them here so searching stays read-only
+    response = await call_next(request)
+    if request.method not in ("GET", "HEAD", "OPTIONS"):
+        TxLogicalStore(db()).refresh_search_index()
+    return response
+
+
 GENERATED_FILES_PATH = f"{DATA_DIR}/generated_files"
 app.mount(
     "/static",
@@ -316,6 +338,24 @@ def refresh_balances(
     return stores.asset_balance_current.all_for_entity_id(entity.id)
 
 
+@app.get("/entities/{id}/balances/history")
+def get_balance_history(
+    id: int,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    resolution: int = Query(3600, gt=0),
+    stores: Stores = Depends(stores),
+    entity: Entity = Depends(EnsureRecord("entity")),
+):
+    if end is None:
+        end = int(time.time())
+    if start is None:
+        start = end - 30 * 24 * 60 * 60
+    return stores.asset_balance_history.value_series_for_entity_id(
+        entity.id, start, end, resolution
+    )
+
+
 @app.get("/entities/{id}/exposure")
 def get_exposure(
     id: int,
@@ -370,6 +410,15 @@ def get_address_manual_balances(
     return stores.asset_balance_current.find(source="manual")
 
 
+def normalize_manual_balance(asset_balance: AssetBalance, database: DB) -> AssetBalance:
+    """Same symbol, exposure_symbol and stable fixes as ingested balances get (see normalize_balance_symbol)"""
+    row = asset_balance.dict()
+    normalize_balance_symbol(load_balance_symbol_map(database), row)
+    return asset_balance.copy(
+        update={k: row[k] for k in ["symbol", "exposure_symbol", "stable"]}
+    )
+
+
 @app.post("/addresses/{id}/manual_balances")
 def create_address_manual_balance(
     asset_balance: AssetBalance,
@@ -385,6 +434,7 @@ def create_address_manual_balance(
             "protocol": "wallet",
         }
     )
+    new_record = normalize_manual_balance(new_record, stores.asset_balance_current.db)
 
     # Stuck this new record in both the current and history stores
     stores.asset_balance_current.update_or_create(new_record)
@@ -405,6 +455,9 @@ def update_address_manual_balance(
             "updated": int(time.time()),
         }
     )
+    updated_record = normalize_manual_balance(
+        updated_record, stores.asset_balance_current.db
+    )
     stores.asset_balance_current.save(updated_record)
 
     # Stick a copy of it in the history store
@@ -479,22 +532,98 @@ def get_reporting_timezones_help():
 # Get list of settings used by the app
 @app.get("/settings/_help/keys")
 def get_settings_keys_used_list():
-    return ["COINGECKO_KEY", "REPORTING_TIMEZONE", "ETHERSCAN_KEY", "COVALENT_KEY"]
+    return [
+        "COINGECKO_KEY",
+        "REPORTING_TIMEZONE",
+        "ETHERSCAN_KEY",
+        "COVALENT_KEY",
+        "FARM_HELPER_APY",
+        "FARM_HELPER_CLAIM_FEES",
+    ]
 
 
 # TX LOGICALS =================================================================================
 
 
+class TxLogicalFilters:
+    def __init__(
+        self,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        tx_logical_type: Optional[str] = None,
+        chain: Optional[str] = None,
+        flag: Optional[str] = None,
+        symbol: Optional[str] = None,
+    ):
+        self.start = start
+        self.end = end
+        self.tx_logical_type = tx_logical_type
+        self.chain = chain
+        self.flag = flag
+        self.symbol = symbol
+
+
 @app.get("/entities/{id}/tx_logicals/", response_model=List[TxLogicalOut])
 def list_tx_logicals(
+    response: Response,
     page: Optional[int] = 0,
     limit: Optional[int] = 100,
+    cursor: Optional[str] = None,
+    filters: TxLogicalFilters = Depends(),
     stores: Stores = Depends(stores),
     entity: Entity = Depends(EnsureRecord("entity")),
 ):
-    return stores.tx_logical.paginated_list(
-        entity.name, items_per_page=limit, page_num=page
+    # page is the old offset paging, kept for clients that don't send the X-Next-Cursor back as cursor yet
+    if page and not cursor:
+        return stores.tx_logical.paginated_list(
+            entity.name, items_per_page=limit, page_num=page, **vars(filters)
+        )
+
+    try:
+        tx_logicals, next_cursor = stores.tx_logical.keyset_page(
+            entity.name, limit, cursor, **vars(filters)
+        )
+    except InvalidCursor as err:
+        raise HTTPException(status_code=400, detail=str(err))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return tx_logicals
+
+
+class TxLogicalSearchOut(BaseModel):
+    results: List[TxLogicalOut]
+    total: int
+    facets: Dict[str, Dict[str, int]]
+
+
+@app.get("/entities/{id}/tx_logicals/search", response_model=TxLogicalSearchOut)
+def search_tx_logicals(
+    q: Optional[str] = "",
+    limit: Optional[int] = 100,
+    filters: TxLogicalFilters = Depends(),
+    stores: Stores = Depends(stores),
+    entity: Entity = Depends(EnsureRecord("entity")),
+):
+    results, total, facets = stores.tx_logical.search(
+        entity.name, q, limit, **vars(filters)
     )
+    return dict(results=results, total=total, facets=facets)
+
+
+@app.get("/entities/{id}/tx_logicals.ndjson")
+def export_tx_logicals(
+    filters: TxLogicalFilters = Depends(),
+    stores: Stores = Depends(stores),
+    entity: Entity = Depends(EnsureRecord("entity")),
+):
+    """The entity's whole tx_logical history, oldest first, one JSON object per line"""
+
+    def lines():
+        for tx_logical in stores.tx_logical.iter_entity(entity.name, **vars(filters)):
+            out = TxLogicalOut(**tx_logical.dict())
+            yield json.dumps(jsonable_encoder(out)) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 @app.get("/tx_logicals/{entity_name}", response_model=List[TxLogicalOut])
@@ -704,6 +833,13 @@ def lock_costbasis_lots(entity: str, year: int):
     return {"ok": year}
 
 
+# Metrics
+# ============================================================
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return metrics.prometheus_text()
+
+
 # Server class via https://stackoverflow.com/questions/61577643/python-how-to-use-fastapi-and-uvicorn-run-without-blocking-the-thread
 class Server(uvicorn.Server):
     def install_signal_handlers(self):
@@ -0,0 +1,246 @@
+import hashlib
+import time
+from typing import Optional, Dict, List, Any
+
+from perfi.db import DB
+
+# Retention tiers for balance_history: every snapshot is kept for a week, then the
+# last snapshot per hour until 90 days, then the last snapshot per day forever
+HOUR = 60 * 60
+DAY = 24 * HOUR
+RAW_RETENTION = 7 * DAY
+HOURLY_RETENTION = 90 * DAY
+
+HISTORY_COLUMNS = [
+    "source",
+    "address",
+    "chain",
+    "symbol",
+    "exposure_symbol",
+    "protocol",
+    "label",
+    "price",
+    "amount",
+    "usd_value",
+    "updated",
+    "type",
+    "locked",
+    "proxy",
+    "extra",
+    "stable",
+]
+
+
+def compact_number(value) -> Optional[float]:
+    # History is for charting so we store REAL instead of the Decimal text blobs
+    if value is None:
+        return None
+    return float(value)
+
+
+def store_balance_json(db: DB, data: Optional[str]) -> Optional[str]:
+    """Store a JSON payload once in balance_json and return the key that references it"""
+    if data is None:
+        return None
+    key = hashlib.sha1(data.encode("utf-8")).hexdigest()
+    sql = """INSERT OR IGNORE INTO balance_json (key, data) VALUES (?, ?)"""
+    db.execute(sql, [key, data])
+    return key
+
+
+def get_balance_json(db: DB, key: str) -> Optional[str]:
+    sql = """SELECT data FROM balance_json WHERE key = ?"""
+    results = db.query(sql, key)
+    if len(results) == 0:
+        return None
+    return results[0]["data"]
+
+
+def insert_balance_history(db: DB, row: Dict[str, Any]):
+    params = []
+    for column in HISTORY_COLUMNS:
+        value = row.get(column)
+        if column in ["price", "amount", "usd_value"]:
+            value = compact_number(value)
+        elif column in ["proxy", "extra"]:
+            value = store_balance_json(db, value)
+        params.append(value)
+
+    sql = f"""INSERT INTO balance_history
+              ({", ".join(HISTORY_COLUMNS)})
+              VALUES
+              ({", ".join("?" * len(HISTORY_COLUMNS))})
+           """
+    db.execute(sql, params)
+
+
+def downsample_balance_history(db: DB, now: Optional[int] = None, full: bool = False):
+    """Collapse DeBank snapshots older than the raw window into hourly and then daily snapshots
+
+    We keep the whole last snapshot of each bucket per address rather than averaging rows so that
+    every remaining `updated` value is still a complete picture of the wallet.
+
+    Each tier remembers how far it has been compacted (balance_history_downsample), so a refresh only
+    looks at what aged into it since the last one. full=True redoes everything, e.g. after backfilling
+    historic snapshots into windows that were already compacted.
+    """
+    now = now or int(time.time())
+    tiers = [
+        # (bucket size, start, end)
+        (
+            HOUR,
+            (now - HOURLY_RETENTION) // DAY * DAY,
+            (now - RAW_RETENTION) // HOUR * HOUR,
+        ),
+        (DAY, 0, (now - HOURLY_RETENTION) // DAY * DAY),
+    ]
+    compacted_through = (
+        {}
+        if full
+        else {
+            r["bucket"]: r["compacted_through"]
+            for r in db.query(
+                """SELECT bucket, compacted_through FROM balance_history_downsample"""
+            )
+        }
+    )
+
+    deleted = 0
+    json_keys = set()
+    for bucket, start, end in tiers:
+        start = max(start, compacted_through.get(bucket, start))
+        if start < end:
+            sql = """SELECT id, extra, proxy
+                     FROM balance_history
+                     WHERE source = 'debank'
+                     AND updated >= :start AND updated < :end
+                     AND (address, updated) NOT IN (
+                         SELECT address, MAX(updated)
+                         FROM balance_history
+                         WHERE source = 'debank'
+                         AND updated >= :start AND updated < :end
+                         GROUP BY address, updated / :bucket
+                     )
+                  """
+            rows = db.query(sql, dict(start=start, end=end, bucket=bucket))
+            if rows:
+                sql = """DELETE FROM balance_history WHERE id = ?"""
+                db.execute_many(sql, [[r["id"]] for r in rows])
+                deleted += len(rows)
+                json_keys.update(r[c] for r in rows for c in ["extra", "proxy"])
+        sql = """REPLACE INTO balance_history_downsample (bucket, compacted_through) VALUES (?, ?)"""
+        db.execute(sql, [bucket, max(end, compacted_through.get(bucket, end))])
+
+    # Only the JSON the deleted rows pointed at can have become unreferenced
+    json_keys.discard(None)
+    if json_keys:
+        sql = """DELETE FROM balance_json
+                 WHERE key = :key
+                 AND NOT EXISTS (SELECT 1 FROM balance_history WHERE extra = :key)
+                 AND NOT EXISTS (SELECT 1 FROM balance_history WHERE proxy = :key)
+              """
+        db.execute_many(sql, [dict(key=key) for key in json_keys])
+
+    return deleted
+
+
+def compact_balance_history_json(db: DB, batch_size: int = 1000):
+    """One-time conversion of rows written before balance_json existed (full JSON inline)"""
+    converted = 0
+    last_id = 0
+    while True:
+        sql = """SELECT id, price, amount, usd_value, proxy, extra
+                 FROM balance_history
+                 WHERE id > ?
+                 AND (length(extra) > 40 OR length(proxy) > 40)
+                 ORDER BY id
+                 LIMIT ?
+              """
+        rows = db.query(sql, [last_id, batch_size])
+        if len(rows) == 0:
+            break
+        last_id = rows[-1]["id"]
+
+        params = []
+        for r in rows:
+            params.append(
+                [
+                    compact_number(r["price"]),
+                    compact_number(r["amount"]),
+                    compact_number(r["usd_value"]),
+                    r["proxy"]
+                    if r["proxy"] is None or len(r["proxy"]) == 40
+                    else store_balance_json(db, r["proxy"]),
+                    r["extra"]
+                    if r["extra"] is None or len(r["extra"]) == 40
+                    else store_balance_json(db, r["extra"]),
+                    r["id"],
+                ]
+            )
+        sql = """UPDATE balance_history
+                 SET price = ?, amount = ?, usd_value = ?, proxy = ?, extra = ?
+                 WHERE id = ?
+              """
+        db.execute_many(sql, params)
+        converted += len(rows)
+
+    return converted
+
+
+def entity_value_series(
+    db: DB, entity_id: int, start: int, end: int, resolution: int = HOUR
+) -> List[Dict[str, Any]]:
+    """Total USD value of an entity per `resolution` bucket between start and end
+
+    DeBank rows are whole-address snapshots, manual rows are per-symbol updates, so the latest
+    value of each is carried forward into later buckets, starting from the latest one before start.
+    """
+    rows_sql = """SELECT address, source, CASE WHEN source = 'manual' THEN symbol END AS manual_symbol,
+                         updated, usd_value
+                  FROM balance_history
+                  WHERE address IN (SELECT address FROM address WHERE entity_id = ?)
+               """
+    # Positions that didn't change inside the window still count from its first bucket
+    sql = f"""WITH h AS ({rows_sql}),
+              last AS (
+                  SELECT address, source, manual_symbol, MAX(updated) AS updated
+                  FROM h
+                  WHERE updated < ?
+                  GROUP BY address, source, manual_symbol
+              )
+              SELECT h.address, h.source, h.manual_symbol, SUM(CAST(h.usd_value AS REAL)) AS usd_value
+              FROM h
+              JOIN last ON last.address = h.address
+                       AND last.source = h.source
+                       AND last.manual_symbol IS h.manual_symbol
+                       AND last.updated = h.updated
+              GROUP BY h.address, h.source, h.manual_symbol
+           """
+    latest: Dict[tuple, float] = {
+        (r["address"], r["source"], r["manual_symbol"]): r["usd_value"] or 0.0
+        for r in db.query(sql, [entity_id, start])
+    }
+    series = []
+    if latest:
+        series.append(
+            dict(
+                timestamp=start // resolution * resolution,
+                usd_value=sum(latest.values()),
+            )
+        )
+
+    sql = f"""SELECT address, source, manual_symbol, updated, SUM(CAST(usd_value AS REAL)) AS usd_value
+              FROM ({rows_sql})
+              WHERE updated >= ? AND updated <= ?
+              GROUP BY address, source, manual_symbol, updated
+              ORDER BY updated
+           """
+    for r in db.query(sql, [entity_id, start, end]):
+        bucket = r["updated"] // resolution * resolution
+        latest[(r["address"], r["source"], r["manual_symbol"])] = r["usd_value"] or 0.0
+        point = dict(timestamp=bucket, usd_value=sum(latest.values()))
+        if series and series[-1]["timestamp"] == bucket:
+            series[-1] = point
+        else:
+            series.append(point)
+    return series
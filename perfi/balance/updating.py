@@ -5,8 +5,10 @@ from typing import Optional, List, Dict, Any, Iterable, Union
 
 from devtools import debug
 
+from perfi.balance.history import insert_balance_history, downsample_balance_history
 from perfi.cache import cache
 from perfi.db import db
+from perfi.metrics import metrics
 from perfi.settings import setting
 from pprint import pprint
 import sys
@@ -47,6 +49,7 @@ def get_addresses(entity_name):
 
 
 
+@metrics.timed_stage("balances")
 def update_entity_balances(entity_name, historic_timestamp: Optional[int] = None):
     print(f'Entity: {entity_name}')
 
@@ -54,30 +57,41 @@ def update_entity_balances(entity_name, historic_timestamp: Optional[int] = None
         address = address_rec["address"]
         update_wallet_balances(address, historic_timestamp)
 
-    # TODO: move debank data fixups into lookup tables and set values at record insertion time instead of re-updating all every time
-    debank_data_fixups()
+    downsample_balance_history(db)
+
+
+def insert_balance(table: str, row: Dict[str, Any]):
+    if table == 'balance_history':
+        insert_balance_history(db, row)
+        return
+
+    columns = list(row.keys())
+    sql = f"""INSERT INTO {table}
+         ({', '.join(columns)})
+         VALUES
+         ({', '.join('?' * len(columns))})
+      """
+    db.execute(sql, [row[c] for c in columns])
 
 
 def ingest_debank_token_list(address: str, debank_token_list: Union[List, Iterable], ingestion_timestamp: int, tables: List[str]):
     updated = ingestion_timestamp
+    symbol_map = load_balance_symbol_map()
 
     for token in list(debank_token_list):
-        for table in tables:
-            sql = f"""INSERT INTO {table}
-                 (source, address, chain, symbol, exposure_symbol, protocol, price, amount, usd_value, updated, extra)
-                 VALUES
-                 (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-              """
-            source = 'debank'
-            protocol = 'wallet'
-            usd_value = token['price'] * token['amount']
-            extra = json.dumps(token)
-            if(token['symbol'].strip() == ''):
-                token['symbol'] = token['name'].replace(' ', '_')
-            params = [source, address, token['chain'], token['symbol'], token['symbol'], protocol, token['price'],
-                      token['amount'], usd_value, updated, extra]
+        source = 'debank'
+        protocol = 'wallet'
+        usd_value = token['price'] * token['amount']
+        extra = json.dumps(token)
+        if(token['symbol'].strip() == ''):
+            token['symbol'] = token['name'].replace(' ', '_')
+        row = dict(source=source, address=address, chain=token['chain'], symbol=token['symbol'],
+                   exposure_symbol=token['symbol'], protocol=protocol, price=token['price'],
+                   amount=token['amount'], usd_value=usd_value, updated=updated, extra=extra)
+        normalize_balance_symbol(symbol_map, row)
 
-            db.execute(sql, params)
+        for table in tables:
+            insert_balance(table, row)
 
         ###
         # TODO: we could update the 'price' table w/ debank price if we want...
@@ -103,6 +117,7 @@ def ingest_debank_complex_protocol_list(address: str, debank_protocol_list: List
 
     '''
     updated = ingestion_timestamp
+    symbol_map = load_balance_symbol_map()
 
     for protocol in debank_protocol_list:
         # print(f'    * {protocol["id"]}')
@@ -113,54 +128,53 @@ def ingest_debank_complex_protocol_list(address: str, debank_protocol_list: List
                 # These are token lists
                 if detail in ['token_list', 'supply_token_list', 'borrow_token_list', 'reward_token_list']:
                     for token in portfolio_item['detail'][detail]:
+                        # depends on type...
+                        if detail == 'token_list':
+                            type = 'deposit'
+                        elif detail == 'supply_token_list':
+                            type = 'deposit'
+                        elif detail == 'borrow_token_list':
+                            type = 'loan'
+                            token['amount'] *= -1
+                        elif detail == 'reward_token_list':
+                            type = 'reward'
+
+                        if portfolio_item['detail_types'][0] == 'reward':
+                            type = 'reward'
+
+                        if detail == 'supply_token_list' and portfolio_item['detail_types'][0] == 'common' and len(
+                                portfolio_item['detail'][detail]) > 1:
+                            type = 'lp'
+
+                        # print(f'      {detail}: {type}')
+
+                        # parameters...
+                        source = 'debank'
+                        if 'description' in portfolio_item['detail']:
+                            label = portfolio_item['detail']['description']
+                        else:
+                            label = type
+                        usd_value = token['price'] * token['amount']
+                        if 'unlock_at' in portfolio_item['detail']:
+                            locked = portfolio_item['detail']['unlock_at']
+                        else:
+                            locked = None
+                        if 'proxy_detail' in portfolio_item and portfolio_item['proxy_detail']:
+                            proxy = json.dumps(portfolio_item['proxy_detail'])
+                        else:
+                            proxy = None
+                        extra = json.dumps(portfolio_item)
+
+                        row = dict(source=source, address=address, chain=token['chain'],
+                                   symbol=token['optimized_symbol'], exposure_symbol=token['optimized_symbol'],
+                                   protocol=protocol['id'], label=label, price=token['price'], amount=token['amount'],
+                                   usd_value=usd_value, updated=updated, type=type, locked=locked, proxy=proxy,
+                                   extra=extra)
+                        normalize_balance_symbol(symbol_map, row)
+
+                        # Build the row once per token so a loan is only negated once even with multiple tables
                         for table in tables:
-                            sql = f"""INSERT INTO {table}
-                                     (source, address, chain, symbol, exposure_symbol, protocol, label, price, amount, usd_value, updated, type, locked, proxy, extra)
-                                     VALUES
-                                    (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                                  """
-                            # depends on type...
-                            if detail == 'token_list':
-                                type = 'deposit'
-                            elif detail == 'supply_token_list':
-                                type = 'deposit'
-                            elif detail == 'borrow_token_list':
-                                type = 'loan'
-                                token['amount'] *= -1
-                            elif detail == 'reward_token_list':
-                                type = 'reward'
-
-                            if portfolio_item['detail_types'][0] == 'reward':
-                                type = 'reward'
-
-                            if detail == 'supply_token_list' and portfolio_item['detail_types'][0] == 'common' and len(
-                                    portfolio_item['detail'][detail]) > 1:
-                                type = 'lp'
-
-                            # print(f'      {detail}: {type}')
-
-                            # parameters...
-                            source = 'debank'
-                            if 'description' in portfolio_item['detail']:
-                                label = portfolio_item['detail']['description']
-                            else:
-                                label = type
-                            usd_value = token['price'] * token['amount']
-                            if 'unlock_at' in portfolio_item['detail']:
-                                locked = portfolio_item['detail']['unlock_at']
-                            else:
-                                locked = None
-                            if 'proxy_detail' in portfolio_item and portfolio_item['proxy_detail']:
-                                proxy = json.dumps(portfolio_item['proxy_detail'])
-                            else:
-                                proxy = None
-                            extra = json.dumps(portfolio_item)
-
-                            params = [source, address, token['chain'], token['optimized_symbol'],
-                                      token['optimized_symbol'],
-                                      protocol['id'], label, token['price'], token['amount'], usd_value, updated, type,
-                                      locked, proxy, extra]
-                            db.execute(sql, params)
+                            insert_balance(table, row)
 
 
 def update_wallet_balances(address: str, historic_timestamp: Optional[int]):
@@ -224,90 +238,37 @@ def update_wallet_balances(address: str, historic_timestamp: Optional[int]):
     # sys.exit()
 
 
-def debank_data_fixups():
+def load_balance_symbol_map(database=None):
+    database = database or db
+    results = database.query('SELECT * FROM balance_symbol_map')
+    return {r['symbol']: r for r in results}
+
+
+def normalize_balance_symbol(symbol_map, row: Dict[str, Any]):
+    mapping = symbol_map.get(row['symbol'])
+    if mapping:
+        row['exposure_symbol'] = mapping['exposure_symbol'] or row['symbol']
+        row['stable'] = mapping['stable']
+        row['symbol'] = mapping['fixed_symbol'] or row['symbol']
+    else:
+        row['stable'] = None
+    return row
+
+
+def backfill_balance_symbols():
+    """One-time rewrite of rows ingested before balance_symbol_map was applied at insert time"""
+    load_balance_symbol_map()
     tables = ['balance_current', 'balance_history']
-    # Fix Symbols
-    fix = [
-        # If we have symbols to fix
-    ]
-    for f in fix:
-        for table in tables:
-            sql = f"""UPDATE {table}
-                     SET symbol = ?, exposure_symbol = ?
-                     WHERE symbol = ?
-                  """
-            db.execute(sql, f)
-
-    # Exposure
-    exposure = [
-        ['AAVE', 'stkAAVE'],
-        ['AVAX', 'WAVAX'],
-        ['AVAX', 'sAVAX'],
-        ['AVAX', 'yyAVAX'],
-        ['BTC', 'renBTC'],
-        ['BTC', 'WBTC'],
-        ['BTC', 'WBTC.e'],
-        ['CRV', 'aCRV'],
-        ['CRV', 'cvxCRV'],
-        ['CRV', 'uCRV'],
-        ['CRV', 'yveCRV-DAO'],
-        ['DAI', 'DAI.e'],
-        ['DAI', 'xDAI'],
-        ['ETH', 'AETH'],
-        ['ETH', 'avWETH'],
-        ['ETH', 'eCRV'],
-        ['ETH', 'stETH'],
-        ['ETH', 'WETH'],
-        ['ETH', 'WETH.e'],
-        ['FTM', 'WFTM'],
-        ['FTM', 'yvWFTM'],
-        ['FXS', 'cvxFXS'],
-        ['GMX', 'esGMX'],
-        ['MATIC', 'amWMATIC'],
-        ['MATIC', 'WMATIC'],
-        ['SPELL', 'sSPELL'],
-        ['USDC', 'USDC.e'],
-        ['USDT', 'USDT.e'],
-    ]
-    for e in exposure:
-        for table in tables:
-            sql = f"""UPDATE {table}
-                     SET exposure_symbol = ?
-                     WHERE exposure_symbol = ?
-                  """
-            db.execute(sql, e)
-
-    # Set stablecoins
-    stables = [
-        'agEUR',
-        'am3CRV',
-        'BUSD',
-        'DAI',
-        'FEI',
-        'FRAX',
-        'GHO',
-        'GUSD',
-        'LUSD',
-        'MIM',
-        'miMATIC',
-        'mUSD',
-        'RAI',
-        'sUSD',
-        'TUSD',
-        'USDC',
-        'USDD',
-        'USDP',
-        'USDN',
-        'USDT',
-        'VST',
-    ]
-    for s in stables:
-        for table in tables:
-            sql = f"""UPDATE {table}
-                 SET stable = 1
-                 WHERE exposure_symbol = ?
+    for table in tables:
+        sql = f"""UPDATE {table}
+                 SET symbol = COALESCE(m.fixed_symbol, {table}.symbol),
+                     exposure_symbol = COALESCE(m.exposure_symbol, {table}.symbol),
+                     stable = m.stable
+                 FROM balance_symbol_map m
+                 WHERE m.symbol = {table}.symbol
               """
-            db.execute(sql, s)
+        db.execute(sql)
+
 
 if __name__ == "__main__":
     if len(sys.argv) == 2:
@@ -0,0 +1,471 @@
+"""
+Synthetic data generator and timed pipeline stages for benchmarking perfi
+
+Everything here is deterministic for a given BenchmarkConfig (including the stubbed price source) so
+results from different runs or different versions of the code can be compared stage by stage.
+"""
+import csv
+import json
+import lzma
+import math
+import os
+import platform
+import random
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from .db import DB
+from .price import CoinPrice, PriceFeed
+
+BENCHMARK_CHAIN = "ethereum"
+BENCHMARK_START = int(datetime(2021, 1, 1, tzinfo=timezone.utc).timestamp())
+DAY = 24 * 60 * 60
+
+# symbol, asset_tx_id, asset_price_id, base price in USD
+BENCHMARK_TOKENS = [
+    ("ETH", "eth", "eth", 2000),
+    ("USDC", "0x00000000000000000000000000000000000b0001", "usd-coin", 1),
+    ("LINK", "0x00000000000000000000000000000000000b0002", "chainlink", 20),
+    ("UNI", "0x00000000000000000000000000000000000b0003", "uniswap", 10),
+]
+
+# Extra asset_price rows that COSTBASIS_LIKEKIND maps imported assets to
+BENCHMARK_ASSET_PRICES = [("ethereum", "ETH")]
+
+COINBASE_PRO_FILLS_FIELDS = [
+    "portfolio",
+    "trade id",
+    "product",
+    "side",
+    "created at",
+    "size",
+    "size unit",
+    "price",
+    "fee",
+    "total",
+    "price/fee/total unit",
+]
+
+
+@dataclass
+class BenchmarkConfig:
+    entities: int = 2
+    wallets: int = 2
+    txs: int = 200
+    fills: int = 200
+    seed: int = 1
+    api_requests: int = 10
+
+
+def synthetic_price(coin_id: str, epoch: int) -> Decimal:
+    base = {asset_price_id: base for _, _, asset_price_id, base in BENCHMARK_TOKENS}
+    base["ethereum"] = base["eth"]
+    day = int(epoch) // DAY
+    # A slow deterministic wave so lots are bought and sold at different prices
+    return Decimal(
+        str(round(base.get(coin_id, 1) * (1 + 0.25 * math.sin(day / 30)), 6))
+    )
+
+
+def stub_price_feed():
+    """Replace network price lookups with synthetic_price for the rest of this process"""
+
+    def get(self, coin_id, desired_epoch):
+        epoch = int(desired_epoch) // DAY * DAY
+        return CoinPrice("benchmark", coin_id, epoch, synthetic_price(coin_id, epoch))
+
+    PriceFeed.get = get
+
+
+class SyntheticDataGenerator:
+    def __init__(self, db: DB, config: BenchmarkConfig):
+        self.db = db
+        self.config = config
+        self.random = random.Random(config.seed)
+
+    def generate(self, csv_dir: str) -> List[Dict]:
+        self.setup_assets()
+        entities = []
+        for e in range(self.config.entities):
+            entity_name = f"benchmark_entity_{e}"
+            self.db.execute("INSERT INTO entity (name) VALUES (?)", entity_name)
+            entity_id = self.db.query(
+                "SELECT id FROM entity WHERE name = ?", entity_name
+            )[0][0]
+
+            addresses = []
+            for w in range(self.config.wallets):
+                address = "0x" + "".join(
+                    self.random.choice("0123456789abcdef") for _ in range(40)
+                )
+                sql = """INSERT INTO address (label, chain, address, entity_id, ord)
+                         VALUES (?, ?, ?, ?, ?)
+                      """
+                self.db.execute(
+                    sql, [f"wallet {w}", BENCHMARK_CHAIN, address, entity_id, w]
+                )
+                self.save_chain_txs(address)
+                addresses.append(address)
+
+            fills_csv = f"{csv_dir}/{entity_name}-coinbasepro-fills.csv"
+            self.write_coinbase_pro_fills(fills_csv, entity_name)
+
+            entities.append(
+                dict(
+                    id=entity_id,
+                    name=entity_name,
+                    addresses=addresses,
+                    fills_csv=fills_csv,
+                )
+            )
+        return entities
+
+    def setup_assets(self):
+        for symbol, asset_tx_id, asset_price_id, _ in BENCHMARK_TOKENS:
+            sql = """REPLACE INTO asset_price (id, source, symbol, name) VALUES (?, ?, ?, ?)"""
+            self.db.execute(sql, [asset_price_id, "benchmark", symbol, symbol])
+            sql = """REPLACE INTO asset_tx (chain, id, symbol, name, type, asset_price_id)
+                     VALUES (?, ?, ?, ?, ?, ?)
+                  """
+            type = "coin" if asset_tx_id == "eth" else "token"
+            self.db.execute(
+                sql,
+                [BENCHMARK_CHAIN, asset_tx_id, symbol, symbol, type, asset_price_id],
+            )
+        for asset_price_id, symbol in BENCHMARK_ASSET_PRICES:
+            sql = """REPLACE INTO asset_price (id, source, symbol, name) VALUES (?, ?, ?, ?)"""
+            self.db.execute(sql, [asset_price_id, "benchmark", symbol, symbol])
+
+    def token(self, symbol, amount, from_address, to_address):
+        _, asset_tx_id, _, _ = next(t for t in BENCHMARK_TOKENS if t[0] == symbol)
+        return dict(
+            from_addr=from_address,
+            to_addr=to_address,
+            amount=amount,
+            _token=dict(
+                id=asset_tx_id, chain=BENCHMARK_CHAIN, symbol=symbol, name=symbol
+            ),
+        )
+
+    def debank_payload(
+        self, address, hash, timestamp, name, receives, sends, counterparty
+    ):
+        from_address = counterparty if receives and not sends else address
+        to_address = address if receives and not sends else counterparty
+        fee = round(self.random.uniform(0.0005, 0.005), 6) if sends else 0
+        return dict(
+            chain=BENCHMARK_CHAIN,
+            address=address,
+            hash=hash,
+            timestamp=timestamp,
+            etherscan=dict(
+                from_address=from_address,
+                to_address=to_address,
+                from_address_name=None,
+                to_address_name=f"Counterparty {counterparty[-4:]}",
+                details=dict(fee=fee, gas_price=30, gas_used=150000),
+            ),
+            debank=dict(
+                tx=dict(
+                    name=name,
+                    from_addr=from_address,
+                    to_addr=to_address,
+                    eth_gas_fee=fee,
+                    usd_gas_fee=0,
+                ),
+                receives=receives,
+                sends=sends,
+                cate_id=None,
+            ),
+        )
+
+    def wallet_txs(self, address):
+        """Receive ETH first, then a mix of swaps, sends and receives that keeps every balance positive"""
+        balances = {symbol: 0.0 for symbol, _, _, _ in BENCHMARK_TOKENS}
+        timestamp = BENCHMARK_START
+        counterparties = [
+            "0x" + f"{self.random.getrandbits(160):040x}" for _ in range(20)
+        ]
+
+        for i in range(self.config.txs):
+            timestamp += self.random.randint(600, DAY)
+            hash = "0x" + f"{self.random.getrandbits(256):064x}"
+            counterparty = self.random.choice(counterparties)
+            held = [s for s, amount in balances.items() if amount > 0]
+            kind = (
+                "receive"
+                if i == 0 or not held
+                else self.random.choice(["receive", "swap", "swap", "send"])
+            )
+
+            if kind == "receive":
+                symbol = self.random.choice(list(balances.keys()))
+                amount = round(
+                    self.random.uniform(0.1, 10)
+                    * 2000
+                    / float(synthetic_price(self._price_id(symbol), timestamp)),
+                    6,
+                )
+                balances[symbol] += amount
+                receives = [self.token(symbol, amount, counterparty, address)]
+                yield self.debank_payload(
+                    address, hash, timestamp, "receive", receives, [], counterparty
+                )
+            elif kind == "send":
+                symbol = self.random.choice(held)
+                amount = round(balances[symbol] * self.random.uniform(0.05, 0.5), 6)
+                balances[symbol] -= amount
+                sends = [self.token(symbol, amount, address, counterparty)]
+                yield self.debank_payload(
+                    address, hash, timestamp, "send", [], sends, counterparty
+                )
+            else:
+                sell = self.random.choice(held)
+                buy = self.random.choice([s for s in balances if s != sell])
+                sell_amount = round(balances[sell] * self.random.uniform(0.1, 0.9), 6)
+                value = sell_amount * float(
+                    synthetic_price(self._price_id(sell), timestamp)
+                )
+                buy_amount = round(
+                    value / float(synthetic_price(self._price_id(buy), timestamp)), 6
+                )
+                balances[sell] -= sell_amount
+                balances[buy] += buy_amount
+                sends = [self.token(sell, sell_amount, address, counterparty)]
+                receives = [self.token(buy, buy_amount, counterparty, address)]
+                yield self.debank_payload(
+                    address, hash, timestamp, "swap", receives, sends, counterparty
+                )
+
+    def save_chain_txs(self, address):
+        params = []
+        for tx in self.wallet_txs(address):
+            raw_data_json = json.dumps(tx, sort_keys=True).encode("utf8")
+            params.append(
+                [
+                    tx["chain"],
+                    tx["address"],
+                    tx["hash"],
+                    tx["timestamp"],
+                    lzma.compress(raw_data_json),
+                ]
+            )
+        sql = """REPLACE INTO tx_chain
+                 (chain, address, hash, timestamp, raw_data_lzma)
+                 VALUES
+                 (?, ?, ?, ?, ?)
+              """
+        self.db.execute_many(sql, params)
+
+    def write_coinbase_pro_fills(self, path, entity_name):
+        timestamp = BENCHMARK_START
+        held = 0.0
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=COINBASE_PRO_FILLS_FIELDS)
+            writer.writeheader()
+            for i in range(self.config.fills):
+                timestamp += self.random.randint(600, DAY)
+                side = "BUY" if held < 0.5 or self.random.random() < 0.6 else "SELL"
+                size = round(
+                    self.random.uniform(0.05, 1)
+                    if side == "BUY"
+                    else held * self.random.uniform(0.1, 0.9),
+                    6,
+                )
+                held += size if side == "BUY" else -size
+                price = synthetic_price("ethereum", timestamp)
+                total = price * Decimal(str(size))
+                writer.writerow(
+                    {
+                        "portfolio": entity_name,
+                        "trade id": i,
+                        "product": "ETH-USD",
+                        "side": side,
+                        "created at": datetime.fromtimestamp(
+                            timestamp, timezone.utc
+                        ).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                        "size": size,
+                        "size unit": "ETH",
+                        "price": price,
+                        "fee": round(total * Decimal("0.005"), 2),
+                        "total": -total if side == "BUY" else total,
+                        "price/fee/total unit": "USD",
+                    }
+                )
+
+    def _price_id(self, symbol):
+        return next(t[2] for t in BENCHMARK_TOKENS if t[0] == symbol)
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name, items: Optional[int] = None):
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        stage = self.stages.setdefault(name, dict(seconds=0.0, calls=0, items=0))
+        stage["seconds"] += seconds
+        stage["calls"] += 1
+        stage["items"] += items or 0
+
+
+def count(db: DB, table: str) -> int:
+    return db.query(f"SELECT COUNT(*) FROM {table}")[0][0]
+
+
+def run_benchmark(db: DB, config: BenchmarkConfig, workdir: str) -> Dict:
+    """Generate a synthetic dataset into `db` and time every pipeline stage against it
+
+    `db` must be the DB the perfi modules were imported with (see bin/benchmark.py), and should never be a
+    database with real data in it.
+    """
+    # Imported here so that callers can point perfi at a scratch database before these modules load
+    from bin.generate_8949 import generate_file
+    from bin.import_from_exchange import do_import
+    from perfi.costbasis import regenerate_costbasis_lots
+    from perfi.events import EventStore
+    from perfi.models import TxLogical, TxLedger
+    from perfi.transaction.chain_to_ledger import update_wallet_ledger_transactions
+    from perfi.transaction.ledger_to_logical import TransactionLogicalGrouper
+
+    stub_price_feed()
+    timer = StageTimer()
+    os.makedirs(workdir, exist_ok=True)
+
+    with timer.stage("generate"):
+        entities = SyntheticDataGenerator(db, config).generate(workdir)
+
+    for entity in entities:
+        with timer.stage("import_exchange_csv", items=config.fills):
+            do_import(entity["id"], "coinbasepro", entity["name"], entity["fills_csv"])
+
+    for entity in entities:
+        addresses = [
+            a["address"]
+            for a in db.query(
+                "SELECT address FROM address WHERE entity_id = ?", [entity["id"]]
+            )
+        ]
+        for address in addresses:
+            with timer.stage("update_wallet_ledger_transactions"):
+                update_wallet_ledger_transactions(address)
+    timer.stages["update_wallet_ledger_transactions"]["items"] = count(db, "tx_ledger")
+
+    event_store = EventStore(db, TxLogical, TxLedger)
+    for entity in entities:
+        with timer.stage("group_transactions"):
+            TransactionLogicalGrouper(
+                entity["name"], event_store
+            ).update_entity_transactions()
+    timer.stages["group_transactions"]["items"] = count(db, "tx_logical")
+
+    for entity in entities:
+        with timer.stage("regenerate_costbasis_lots"):
+            regenerate_costbasis_lots(entity["name"], quiet=True)
+    timer.stages["regenerate_costbasis_lots"]["items"] = count(db, "costbasis_disposal")
+
+    for entity in entities:
+        with timer.stage("form_8949"):
+            generate_file(
+                entity["name"], output_path=f"{workdir}/{entity['name']}-8949.xlsx"
+            )
+
+    timer.stages.update(run_api_benchmark(entities, config))
+    timer.stages.update(run_construction_benchmark(db))
+
+    return dict(
+        config=asdict(config),
+        created=int(time.time()),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        stages=timer.stages,
+        rows={
+            table: count(db, table)
+            for table in [
+                "tx_chain",
+                "tx_ledger",
+                "tx_logical",
+                "costbasis_lot",
+                "costbasis_disposal",
+            ]
+        },
+    )
+
+
+def run_api_benchmark(entities, config: BenchmarkConfig) -> Dict:
+    from starlette.testclient import TestClient
+    from perfi.api import app
+
+    timer = StageTimer()
+    client = TestClient(app)
+    endpoints = [
+        ("api_list_tx_logicals", "/entities/{id}/tx_logicals/?page=0&limit=100"),
+        (
+            "api_list_tx_logicals_deep_page",
+            "/entities/{id}/tx_logicals/?page=5&limit=100",
+        ),
+        ("api_get_balances", "/entities/{id}/balances"),
+    ]
+    for name, path in endpoints:
+        for entity in entities:
+            for _ in range(config.api_requests):
+                with timer.stage(name, items=1):
+                    response = client.get(path.format(id=entity["id"]))
+                    response.raise_for_status()
+    return timer.stages
+
+
+# Row construction is quick per row, so build every row this many times to get a measurable stage
+CONSTRUCTION_ROUNDS = 10
+
+
+def run_construction_benchmark(db: DB) -> Dict:
+    """Time building the pydantic models (by name) vs the row types (positionally, as the pipeline loops do)"""
+    from perfi.models import (
+        TxLedger,
+        TxLedgerRow,
+        TX_LEDGER_ROW_COLUMNS,
+        CostbasisLot,
+        CostbasisLotRow,
+        COSTBASIS_LOT_ROW_COLUMNS,
+    )
+
+    timer = StageTimer()
+    ledgers = db.query(f"SELECT {TX_LEDGER_ROW_COLUMNS} FROM tx_ledger")
+    lots = db.query(f"SELECT {COSTBASIS_LOT_ROW_COLUMNS} FROM costbasis_lot")
+    for name, build, rows in [
+        ("construct_tx_ledger_model", lambda r: TxLedger(**r), ledgers),
+        ("construct_tx_ledger_row", lambda r: TxLedgerRow(*r), ledgers),
+        ("construct_costbasis_lot_model", lambda r: CostbasisLot(**r), lots),
+        ("construct_costbasis_lot_row", lambda r: CostbasisLotRow(*r), lots),
+    ]:
+        with timer.stage(name, items=len(rows) * CONSTRUCTION_ROUNDS):
+            for _ in range(CONSTRUCTION_ROUNDS):
+                for r in rows:
+                    build(r)
+    return timer.stages
+
+
+def compare_results(baseline: Dict, current: Dict) -> List[Dict]:
+    comparison = []
+    for name, stage in current["stages"].items():
+        before = baseline["stages"].get(name)
+        change = None
+        if before and before["seconds"] > 0:
+            change = (stage["seconds"] - before["seconds"]) / before["seconds"]
+        comparison.append(
+            dict(
+                stage=name,
+                baseline_seconds=before["seconds"] if before else None,
+                seconds=stage["seconds"],
+                change=change,
+            )
+        )
+    return comparison
@@ -1,13 +1,10 @@
-from typing import Callable, Any
-
 from devtools import debug
-from web3.types import RPCEndpoint, RPCResponse
 
 from .db import DB
 from .constants.paths import CACHEDB_PATH, CACHEDB_SCHEMA_PATH
+from .metrics import metrics
 
 
-from web3 import Web3
 from collections import defaultdict
 import httpx
 import lzma
@@ -18,62 +15,7 @@ import hashlib
 import collections
 from collections.abc import Generator
 import time
-import pickle
-
-from eth_utils import (
-    is_boolean,
-    is_bytes,
-    is_dict,
-    is_list_like,
-    is_null,
-    is_number,
-    is_text,
-    to_bytes,
-)
-
-
-def generate_cache_key(value: Any) -> str:
-    """
-    Generates a cache key for the *args and **kwargs
-    """
-    if is_bytes(value):
-        return hashlib.md5(value).hexdigest()
-    elif is_text(value):
-        return generate_cache_key(to_bytes(text=value))
-    elif is_boolean(value) or is_null(value) or is_number(value):
-        return generate_cache_key(repr(value))
-    elif is_dict(value):
-        return generate_cache_key(((key, value[key]) for key in sorted(value.keys())))
-    elif is_list_like(value) or isinstance(value, collections.abc.Generator):
-        return generate_cache_key("".join((generate_cache_key(item) for item in value)))
-    else:
-        raise TypeError(
-            f"Cannot generate cache key for value {value} of type {type(value)}"
-        )
-
-
-def web3_db_cache_middleware(
-    make_request: Callable[[RPCEndpoint, Any], RPCResponse], w3: "Web3"
-) -> Callable[[RPCEndpoint, Any], RPCResponse]:
-    rpc_whitelist = ["eth_getTransactionReceipt"]
-
-    def middleware(method: RPCEndpoint, params: Any) -> RPCResponse:
-        if method in rpc_whitelist:
-            cache_key = generate_cache_key((method, params))
-            r = cache._get_val(cache_key)
-            if not r:
-                print(f"Web3 cache key {cache_key} not in our cache.")
-                t = int(time.time())
-                response = make_request(method, params)
-                cache._set_val(cache_key, pickle.dumps(response), t)
-                return response
-            print(f"Web3 cache key {cache_key} IS IN our cache.")
-            return pickle.loads(r["value"])
-        else:
-            print(f"Web3 NOT CACHING {method}")
-            return make_request(method, params)
-
-    return middleware
+import threading
 
 
 class CacheGet404Exception(Exception):
@@ -86,10 +28,8 @@ class Cache:
     def __init__(self, noproxy=False, use_mem=True):
         self.db = DB(CACHEDB_PATH, same_thread=False)
 
-        # If a new cache db we'll load the cache schema
-        cache_is_empty = len(self.db.query("select * from sqlite_master")) == 0
-        if cache_is_empty:
-            self.db.create_db(CACHEDB_SCHEMA_PATH)
+        # Every statement in the schema is IF NOT EXISTS so existing cache dbs pick up new tables too
+        self.db.create_db(CACHEDB_SCHEMA_PATH)
 
         self.proxy = None
         self.hostname_cookies_map = defaultdict(dict)
@@ -105,23 +45,27 @@ class Cache:
             self.db.use_mem()
 
         self.client = None
+        # Explorer fetchers call get() from several threads; the connection is shared so DB access takes turns
+        self.db_lock = threading.Lock()
 
     def _client(self):
         if self.client:
             return self.client
         else:
+            event_hooks = {"request": [metrics.count_http_request]}
             if self.proxy:
                 proxies = {"http://": self.proxy, "https://": self.proxy}
-                self.client = httpx.Client(proxies=proxies)
+                self.client = httpx.Client(proxies=proxies, event_hooks=event_hooks)
             else:
-                self.client = httpx.Client()
+                self.client = httpx.Client(event_hooks=event_hooks)
             return self.client
 
     def _get_val(self, key, refresh_if=None):
-        r = self.db.query(
-            "SELECT key, value_lzma, saved, expire FROM cache WHERE key = ? ORDER BY saved DESC LIMIT 1",
-            key,
-        )
+        with self.db_lock:
+            r = self.db.query(
+                "SELECT key, value_lzma, saved, expire FROM cache WHERE key = ? ORDER BY saved DESC LIMIT 1",
+                key,
+            )
         if len(r):
             if refresh_if and time.time() - r[0]["saved"] > refresh_if:
                 return None
@@ -150,7 +94,8 @@ class Cache:
          VALUES
          (?, ?, ?)"""
         params = (key, value_lzma, timestamp)
-        self.db.execute(sql, params)
+        with self.db_lock:
+            self.db.execute(sql, params)
 
     def set_cookies_for_requests(self, hostname, cookies):
         for k, v in cookies.items():
@@ -169,10 +114,13 @@ class Cache:
 
         if r and not refresh:
             # print(f'CACHED: {url}')
+            metrics.inc("perfi_cache_hits_total", kind="http")
+            metrics.inc("perfi_cache_bytes_total", len(r["value"]), kind="http")
             return r
         else:
-            # Get
-            headers.update(self.headers)
+            metrics.inc("perfi_cache_misses_total", kind="http")
+            # Get (on a copy, the default headers dict is shared between calls and threads)
+            headers = {**headers, **self.headers}
             headers["Referer"] = f"https://{urlparse(url).hostname}/"
             retry_count = 1
             got_response = False
@@ -272,7 +220,10 @@ class Cache:
             value_lzma = r[0][1]
             lzmad = lzma.LZMADecompressor()
             result["value"] = lzmad.decompress(value_lzma)
+            metrics.inc("perfi_cache_hits_total", kind="http")
+            metrics.inc("perfi_cache_bytes_total", len(result["value"]), kind="http")
         else:
+            metrics.inc("perfi_cache_misses_total", kind="http")
             # Get
             client.headers["Referer"] = f"https://{urlparse(url).hostname}/"
             if headers:
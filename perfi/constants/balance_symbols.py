@@ -0,0 +1,82 @@
+"""
+Default balance_symbol_map rows. Migrations seed them once (see migrations/0009_seed_balance_symbol_map.py), so
+adding a mapping here for existing DBs needs a migration that inserts it too. This module is imported while perfi.db
+runs migrations, so it must not import any other perfi module.
+"""
+
+SYMBOL_FIXES = [
+    # If we have symbols to fix: [symbol, exposure_symbol, original symbol]
+]
+
+EXPOSURE_SYMBOLS = [
+    ["AAVE", "stkAAVE"],
+    ["AVAX", "WAVAX"],
+    ["AVAX", "sAVAX"],
+    ["AVAX", "yyAVAX"],
+    ["BTC", "renBTC"],
+    ["BTC", "WBTC"],
+    ["BTC", "WBTC.e"],
+    ["CRV", "aCRV"],
+    ["CRV", "cvxCRV"],
+    ["CRV", "uCRV"],
+    ["CRV", "yveCRV-DAO"],
+    ["DAI", "DAI.e"],
+    ["DAI", "xDAI"],
+    ["ETH", "AETH"],
+    ["ETH", "avWETH"],
+    ["ETH", "eCRV"],
+    ["ETH", "stETH"],
+    ["ETH", "WETH"],
+    ["ETH", "WETH.e"],
+    ["FTM", "WFTM"],
+    ["FTM", "yvWFTM"],
+    ["FXS", "cvxFXS"],
+    ["GMX", "esGMX"],
+    ["MATIC", "amWMATIC"],
+    ["MATIC", "WMATIC"],
+    ["SPELL", "sSPELL"],
+    ["USDC", "USDC.e"],
+    ["USDT", "USDT.e"],
+]
+
+STABLES = [
+    "agEUR",
+    "am3CRV",
+    "BUSD",
+    "DAI",
+    "FEI",
+    "FRAX",
+    "GHO",
+    "GUSD",
+    "LUSD",
+    "MIM",
+    "miMATIC",
+    "mUSD",
+    "RAI",
+    "sUSD",
+    "TUSD",
+    "USDC",
+    "USDD",
+    "USDP",
+    "USDN",
+    "USDT",
+    "VST",
+]
+
+
+def default_balance_symbol_map():
+    exposures = {source: target for target, source in EXPOSURE_SYMBOLS}
+
+    def mapping(symbol, fixed_symbol, exposure_symbol):
+        exposure_symbol = exposures.get(exposure_symbol, exposure_symbol)
+        stable = 1 if exposure_symbol in STABLES else None
+        return [symbol, fixed_symbol, exposure_symbol, stable]
+
+    rows = {}
+    for stable in STABLES:
+        rows[stable] = mapping(stable, None, stable)
+    for target, source in EXPOSURE_SYMBOLS:
+        rows[source] = mapping(source, None, source)
+    for fixed_symbol, exposure_symbol, symbol in SYMBOL_FIXES:
+        rows[symbol] = mapping(symbol, fixed_symbol, exposure_symbol)
+    return list(rows.values())
@@ -78,12 +78,14 @@ for directory in [DATA_DIR, CACHE_DIR, LOG_DIR, GENERATED_FILES_DIR]:
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-DB_PATH = f"{DATA_DIR}/perfi.db"
+# PERFI_DB_PATH lets tools like bin/benchmark.py point perfi at a scratch database
+DB_PATH = os.environ.get("PERFI_DB_PATH", f"{DATA_DIR}/perfi.db")
 CACHEDB_PATH = f"{CACHE_DIR}/cache.db"
 
 SOURCE_ROOT = ROOT if not IS_PYINSTALLER else sys._MEIPASS  # noqa
 DB_SCHEMA_PATH = f"{SOURCE_ROOT}/perfi.schema.sql"
 CACHEDB_SCHEMA_PATH = f"{SOURCE_ROOT}/cache.schema.sql"
+MIGRATIONS_DIR = f"{SOURCE_ROOT}/migrations"
 
 logging.debug(f"DB_PATH: {DB_PATH}")
 logging.debug(f"CACHE_PATH: {DB_PATH}")
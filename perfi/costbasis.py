@@ -1,6 +1,9 @@
 import atexit
 import csv
+import json
 import logging
+import time
+from contextlib import contextmanager
 from copy import copy
 from datetime import date, datetime
 from decimal import Decimal, Context
@@ -15,18 +18,27 @@ from tqdm import tqdm
 
 from .constants import assets, paths
 from .db import db
+from .metrics import metrics
 from .models import (
     TxLogical,
     TxLedger,
     TX_LOGICAL_FLAG,
     CostbasisLot,
+    CostbasisLotRow,
+    COSTBASIS_LOT_ROW_COLUMNS,
     CostbasisDisposal,
+    encode_lot_history,
+    load_lot_histories,
     replace_flags,
     load_flags,
+    query_flags,
+    has_flag,
+    flag_index,
     Flag,
 )
 from .price import price_feed
 from .settings import setting
+from .tx_stream import entity_tx_stream, flag_names
 
 DECIMAL_QUANTIZE_PLACES = Decimal(10) ** -16
 DECIMAL_QUANTIZE_CONTEXT = Context(prec=100)
@@ -61,6 +73,10 @@ DEBUG_TXID = None
 # You should set PYTHONBREAKPOINT to ipdb.set_trace in your env
 DEBUG_BREAK = False
 
+# Lot matching order for drawdowns (see LotMatcher)
+LOT_ALGORITHMS = ["hifo", "low", "fifo", "lifo"]
+LOT_ALGORITHM = "hifo"
+
 ### Helper Functions
 
 # This is added for rounding errors...
@@ -88,68 +104,174 @@ def get_active_branch_name():
             return line[:10]
 
 
-def regenerate_costbasis_lots(entity, args=None, quiet=False):
-    if args and args.debugtx:
-        # TODO - it may be worth not tearing down CostbasisGenerator for perf reasons, then can assign this to generator
-        global DEBUG_TXID
-        DEBUG_TXID = args.debugtx
+ENTITY_ADDRESSES_SQL = """SELECT address
+                          FROM address, entity
+                          WHERE entity_id = entity.id
+                          AND entity.name = ?
+                       """
+
+
+def entity_flag_targets(entity):
+    """Everything regeneration reads flags for, to bulk load into flag_index"""
+    return [
+        (
+            TxLogical.__name__,
+            f"SELECT id FROM tx_logical WHERE address IN ({ENTITY_ADDRESSES_SQL})",
+            [entity],
+        ),
+        (
+            CostbasisLot.__name__,
+            "SELECT tx_ledger_id FROM costbasis_lot WHERE entity = ?",
+            [entity],
+        ),
+    ]
 
-    if quiet:
-        global DEBUG
-        DEBUG = False
 
-    if not args or not args.resumefrom:
-        # Theoretically
-        # costbasis_lot is idempotent to tx_ledger_id and we can generally leave it
-        # LATER in the future we want to be able to store and replay edits, maybe in costbasis_edits table?
-        sql = """DELETE FROM costbasis_lot WHERE entity = ?"""
-        db.execute(sql, entity)
+# entity -> last tx_logical_id started, for every regeneration that hasn't finished yet
+in_progress_tx_logical_ids = {}
 
-        # Clear out costbasis_disposal for each run - this uses an autoincrement ID, must be regenerated
-        sql = """DELETE FROM costbasis_disposal WHERE entity = ?"""
-        db.execute(sql, entity)
 
-        # Clear out costbasis_income for each run
-        sql = """DELETE FROM costbasis_income WHERE entity = ?"""
-        db.execute(sql, entity)
+@atexit.register
+def report_last_processed_id():
+    for entity, tx_logical_id in in_progress_tx_logical_ids.items():
+        print("-------------------------------------------------------------------")
+        print(
+            f"It looks like calculating costbasis for {entity} didn't finish cleanly..."
+        )
+        print(f"The last in-progress tx_logical_id was: {tx_logical_id}")
+        print("-------------------------------------------------------------------")
 
-        # Clear out Flags for costbasis lots
-        sql = """DELETE FROM flag WHERE target_type = ? and source != 'manual'"""
-        db.execute(sql, CostbasisLot.__name__)
 
-        # Clear out Flags for costbasis disposals
-        sql = """DELETE FROM flag WHERE target_type = ? and source != 'manual'"""
-        db.execute(sql, CostbasisDisposal.__name__)
+def clear_costbasis(entity, since=None):
+    """
+    Delete the entity's costbasis so it can be regenerated. With since (an epoch), disposals, income and TxLogical
+    flags from before then are kept; lots always go, restore_costbasis_snapshot puts back the book as of since.
+    """
+    # Theoretically
+    # costbasis_lot is idempotent to tx_ledger_id and we can generally leave it
+    # LATER in the future we want to be able to store and replay edits, maybe in costbasis_edits table?
+    # Flags are cleared for this entity only (and before its lots/disposals go) so other entities keep theirs
+    since_filter = "" if since is None else f"AND timestamp >= {int(since)}"
+
+    # Clear out Flags for costbasis lots
+    sql = """DELETE FROM flag
+             WHERE target_type = ? AND source != 'manual'
+             AND target_id IN (SELECT tx_ledger_id FROM costbasis_lot WHERE entity = ?)
+          """
+    db.execute(sql, [CostbasisLot.__name__, entity])
 
-        # Clear out Flags for TxLogicals (some flags get added during refresh_type, which is called from in here)
-        sql = """DELETE FROM flag WHERE target_type = ? and source != 'manual'"""
+    # Clear out Flags for costbasis disposals
+    sql = f"""DELETE FROM flag
+              WHERE target_type = ? AND source != 'manual'
+              AND target_id IN (SELECT CAST(id AS TEXT) FROM costbasis_disposal WHERE entity = ? {since_filter})
+           """
+    db.execute(sql, [CostbasisDisposal.__name__, entity])
 
-        db.execute(sql, TxLogical.__name__)
+    # Clear out Flags for TxLogicals (some flags get added during refresh_type, which is called from in here)
+    sql = f"""DELETE FROM flag
+              WHERE target_type = ? AND source != 'manual'
+              AND target_id IN (SELECT id FROM tx_logical WHERE address IN ({ENTITY_ADDRESSES_SQL}) {since_filter})
+           """
+    db.execute(sql, [TxLogical.__name__, entity])
 
-    # Get start and end range for year...
-    if args and args.year:  # type: ignore
-        start_year = int(args.year)  # type: ignore
-        end_year = start_year + 1
-        start = arrow.get(date(start_year, 1, 1), REPORTING_TIMEZONE)
-        end = arrow.get(date(end_year, 1, 1), REPORTING_TIMEZONE)
-        start = int(start.timestamp())
-        end = int(end.timestamp()) - 1
+    sql = """DELETE FROM costbasis_lot WHERE entity = ?"""
+    db.execute(sql, entity)
 
-        daterange_filter = f"AND timestamp >= {start} AND timestamp <= {end}"
+    # Clear out costbasis_disposal for each run - this uses an autoincrement ID, must be regenerated
+    sql = f"""DELETE FROM costbasis_disposal WHERE entity = ? {since_filter}"""
+    db.execute(sql, entity)
+
+    # Clear out costbasis_income for each run
+    sql = f"""DELETE FROM costbasis_income WHERE entity = ? {since_filter}"""
+    db.execute(sql, entity)
+
+
+class YearClosedError(Exception):
+    pass
+
+
+def year_range(year):
+    """First and last epoch of a year in REPORTING_TIMEZONE"""
+    start = arrow.get(date(int(year), 1, 1), REPORTING_TIMEZONE)
+    end = arrow.get(date(int(year) + 1, 1, 1), REPORTING_TIMEZONE)
+    return int(start.timestamp()), int(end.timestamp()) - 1
+
+
+def latest_snapshot_year(entity):
+    sql = """SELECT MAX(year) FROM costbasis_year_snapshot WHERE entity = ?"""
+    return db.query(sql, entity)[0][0]
+
+
+def restore_costbasis_snapshot(entity, year):
+    """Replace the entity's lots (and their flags) with the closing lot book of a closed year"""
+    sql = f"""INSERT INTO costbasis_lot ({", ".join(SNAPSHOT_LOT_COLUMNS)})
+              SELECT {", ".join(SNAPSHOT_LOT_COLUMNS)}
+              FROM costbasis_lot_snapshot
+              WHERE entity = ? AND year = ?
+           """
+    db.execute(sql, [entity, year])
+
+    sql = """SELECT tx_ledger_id, flags FROM costbasis_lot_snapshot WHERE entity = ? AND year = ? AND flags IS NOT NULL"""
+    params = [
+        [CostbasisLot.__name__, r["tx_ledger_id"], *flag]
+        for r in db.query(sql, [entity, year])
+        for flag in json.loads(r["flags"])
+    ]
+    if params:
+        sql = """INSERT INTO flag (target_type, target_id, name, description, source, created_at) VALUES (?, ?, ?, ?, ?, ?)"""
+        db.execute_many(sql, params)
+
+
+@contextmanager
+def lot_algorithm(algorithm):
+    """Match lots with algorithm instead of LOT_ALGORITHM for drawdowns inside the block"""
+    global LOT_ALGORITHM
+    previous = LOT_ALGORITHM
+    LOT_ALGORITHM = algorithm
+    try:
+        yield
+    finally:
+        LOT_ALGORITHM = previous
 
-        logger.debug("Regenerating costbasis lots for {args.year}.....")
-    else:
-        logger.debug("Regenerating costbasis lots.....")
-        daterange_filter = ""
+
+@metrics.timed_stage("costbasis")
+def regenerate_costbasis_lots(entity, args=None, quiet=False, workers=1, progress=True):
+    # TODO - it may be worth not tearing down CostbasisGenerator for perf reasons, then can assign this to generator
+    # Always (re)set so a --debugtx from an earlier entity in the same process doesn't carry over
+    global DEBUG_TXID
+    DEBUG_TXID = args.debugtx if args else None
+
+    if quiet:
+        global DEBUG
+        DEBUG = False
+
+    # Closed years are never recomputed: we start from the latest closing lot book and replay only what came after
+    # it, up to the end of the requested year (or everything)
+    snapshot_year = latest_snapshot_year(entity)
+    year = int(args.year) if args and args.year else None  # type: ignore
+    if year is not None and snapshot_year is not None and year <= snapshot_year:
+        raise YearClosedError(
+            f"Costbasis for {entity} is closed through {snapshot_year}, so {year} can't be regenerated"
+        )
+
+    since = None if snapshot_year is None else year_range(snapshot_year + 1)[0]
+    if not args or not args.resumefrom:
+        clear_costbasis(entity, since=since)
+        if snapshot_year is not None:
+            restore_costbasis_snapshot(entity, snapshot_year)
+
+    daterange_filter = ""
+    if since is not None:
+        daterange_filter += f"AND timestamp >= {since}"
+    if year is not None:
+        daterange_filter += f" AND timestamp <= {year_range(year)[1]}"
+    logger.debug(
+        f"Regenerating costbasis lots from {snapshot_year or 'the start'} through {year or 'the end'}....."
+    )
 
     # Get all Logical TX's for an entity's accounts
     sql = f"""SELECT id FROM tx_logical
-             WHERE address IN (
-                 SELECT address
-                 FROM address, entity
-                 WHERE entity_id = entity.id
-                 AND entity.name = ?
-             )
+             WHERE address IN ({ENTITY_ADDRESSES_SQL})
              {daterange_filter}
              ORDER BY timestamp ASC
            """
@@ -157,56 +279,85 @@ def regenerate_costbasis_lots(entity, args=None, quiet=False):
 
     logger.debug(f"Found {len(results)} TxLogicals to process...")
 
-    global last_tx_logical_id
-    global finished_cleanly
-
-    last_tx_logical_id = None
+    # Resuming and tx debugging rely on walking the whole timeline in order in this process
+    if workers > 1 and not (args and (args.resumefrom or args.debugtx)):
+        from .costbasis_parallel import regenerate_in_parallel
 
-    @atexit.register
-    def report_last_processed_id():
-        if not finished_cleanly:
-            print("-------------------------------------------------------------------")
-            print("It looks like calculating costbasis didn't finish cleanly...")
-            print(f"The last in-progress tx_logical_id was: {last_tx_logical_id}")
-            print("-------------------------------------------------------------------")
+        regenerate_in_parallel(entity, [r["id"] for r in results], workers)
+        logger.debug(f"Done regenerating costbasis lots for {entity}")
+        return
 
     stop_skipping = False
-    finished_cleanly = False
-    for r in tqdm(results, desc="Generating Costbasis", disable=None):
-        tx_logical: TxLogical = TxLogical.from_id(id=r["id"], entity_name=entity)
-        last_tx_logical_id = r["id"]
-
-        if TX_LOGICAL_FLAG.ignored_from_costbasis.value in [
-            f.name for f in tx_logical.flags
-        ]:
-            continue
-
-        if args and args.resumefrom and not stop_skipping:
-            if tx_logical.id == args.resumefrom:
-                stop_skipping = True
-                print(f"Resuming now on tx_logical_id {args.resumefrom} ")
-            else:
+    in_progress_tx_logical_ids[entity] = None
+    with flag_index.loaded(entity_flag_targets(entity)):
+        for r in tqdm(
+            results,
+            desc=f"Generating Costbasis ({entity})",
+            disable=None if progress else True,
+        ):
+            in_progress_tx_logical_ids[entity] = r["id"]
+
+            if has_flag(
+                TxLogical.__name__,
+                r["id"],
+                TX_LOGICAL_FLAG.ignored_from_costbasis.value,
+            ):
                 continue
 
-        # only process non-empty tx_logicals
-        if len(tx_logical.tx_ledgers) > 0:
-            try:
-                CostbasisGenerator(tx_logical).process()
-            except Exception as err:
-                logger.error("-----------------")
-                logger.error(
-                    "Encountered an unknown error when processing a tx_logical for costbasis:"
-                )
-                logger.error(err, exc_info=True)
-                logger.error("TxLogical:")
-                logger.error(pformat(tx_logical))
-                logger.error("-----------------")
+            if args and args.resumefrom and not stop_skipping:
+                if r["id"] == args.resumefrom:
+                    stop_skipping = True
+                    print(f"Resuming now on tx_logical_id {args.resumefrom} ")
+                else:
+                    continue
+
+            tx_logical: TxLogical = TxLogical.from_id(id=r["id"], entity_name=entity)
+
+            # only process non-empty tx_logicals
+            if len(tx_logical.tx_ledgers) > 0:
+                try:
+                    CostbasisGenerator(tx_logical).process()
+                except Exception as err:
+                    logger.error("-----------------")
+                    logger.error(
+                        "Encountered an unknown error when processing a tx_logical for costbasis:"
+                    )
+                    logger.error(err, exc_info=True)
+                    logger.error("TxLogical:")
+                    logger.error(pformat(tx_logical))
+                    logger.error("-----------------")
 
-    finished_cleanly = True
+    del in_progress_tx_logical_ids[entity]
 
     logger.debug(f"Done regenerating costbasis lots for {entity}")
 
 
+SNAPSHOT_LOT_COLUMNS = [
+    "tx_ledger_id",
+    "entity",
+    "address",
+    "asset_price_id",
+    "symbol",
+    "chain",
+    "asset_tx_id",
+    "original_amount",
+    "current_amount",
+    "price_usd",
+    "basis_usd",
+    "timestamp",
+    "history",
+    "receipt",
+    "price_source",
+    "locked_for_year",
+]
+SNAPSHOT_DECIMAL_COLUMNS = {
+    "original_amount",
+    "current_amount",
+    "price_usd",
+    "basis_usd",
+}
+
+
 # CostbasisLot
 def save_costbasis_lot(lot: CostbasisLot):
     # QUESTION: Do we want to do REPLACE INTO here? Since the ID comes from the tx_ledger_id, it should be safe to do so...
@@ -248,8 +399,8 @@ def save_costbasis_lot(lot: CostbasisLot):
         round_to_zero(lot.price_usd),
         round_to_zero(lot.basis_usd),
         lot.timestamp,
-        jsonpickle.encode(lot.history),
-        jsonpickle.encode(lot.flags),
+        encode_lot_history(lot.history),
+        None,  # Flags live in the flag table
         lot.receipt,
         lot.price_source,
         lot.chain,
@@ -367,7 +518,9 @@ class CostbasisGenerator:
         return addresses
 
     # This takes the self.tx_logical and creates the lots and disposals
-    def process(self):
+    # The parallel runner (costbasis_parallel) types logicals up front and may process the fee drawdown separately
+    # from the rest of the logical, since the fee asset's lots can be in a different partition
+    def process(self, retype=True, include_fee=True, fee_only=False):
         # Ensure clean state
         self.debug_print = False
         self.ins = []
@@ -385,7 +538,8 @@ class CostbasisGenerator:
         self.populate_sorted_tx_ledgers()
 
         # This is gonna do a lot of hairy stuff for typing tx_logical and tx_ledgers
-        self.type_transactions()
+        if retype:
+            self.type_transactions()
 
         # DEBUG: Use something like this below to turn on detailed lot/drawdown print debugging
         # for assets you want to trace
@@ -482,6 +636,10 @@ class CostbasisGenerator:
                 DEBUG_BREAK = True
                 breakpoint()
 
+        if fee_only:
+            self.drawdown_fee()
+            return
+
         ### Processing transaction types
         """
         We are calling specific functions for each type because they can have unique and complex interactions
@@ -600,6 +758,10 @@ class CostbasisGenerator:
             # raise Exception(f"Trying to create disposal for unknown type: {self.tx_logical.tx_logical_type} \n{pformat(self.tx_logical)}")
 
         # Finally, handle fees
+        if include_fee:
+            self.drawdown_fee()
+
+    def drawdown_fee(self):
         if self.fee:
             # Ignore fiat fees, since a disposal for fiat doesn't make any sense
             if not self.fee.asset_tx_id.startswith("FIAT:"):
@@ -664,7 +826,7 @@ class CostbasisGenerator:
 
             # We want to make sure that we are tracking the swap history for receipt assets
             # This is typically to track the original token for a deposit or withdrawal receipt
-            # our history is just going to be an array of tx_ledgers that gets jsonpickled
+            # our history is just going to be an array of tx_ledgers, stored as references (see encode_lot_history)
             lot_history = []
             if self.is_receipt:
                 # We store the other tx_ledgers (besides itself)
@@ -1432,14 +1594,6 @@ class CostbasisGenerator:
                     f"Drawdown from lot {lot.tx_ledger_id}. Removing {decimal_quantize(amount_to_subtract_from_lot)}.  Amount remaining: {decimal_quantize(amount_remaining)}"
                 )
 
-                # unused but putting it here in case we ever want the updated lot in memory, it should have the updated current_amount...
-                updated_current_amount = decimal_quantize(
-                    lot.current_amount
-                ) - decimal_quantize(amount_to_subtract_from_lot)
-                updated_lot = lot.copy(
-                    update={"current_amount": updated_current_amount}
-                )
-
                 amount_left_to_subtract -= decimal_quantize(amount)
 
                 # We're done and can stop looking at other lots
@@ -1707,7 +1861,9 @@ class CostbasisGenerator:
 
 
 class LotMatcher:
-    def get_lots(self, tx, algorithm="hifo"):
+    def get_lots(self, tx, algorithm=None):
+        if algorithm is None:
+            algorithm = LOT_ALGORITHM
         asset_price_id = tx.asset_price_id
         asset_tx_id = tx.asset_tx_id
         chain = tx.chain
@@ -1721,22 +1877,7 @@ class LotMatcher:
             # raise Exception(f'Cant get a lot without either an asset_tx_id {asset_tx_id} or asset_price_id {asset_price_id}')
             return []
         logger.debug(f"--- {algorithm} ---")
-        sql = f"""SELECT
-                     tx_ledger_id,
-                     entity,
-                     address,
-                     asset_price_id,
-                     symbol,
-                     asset_tx_id,
-                     original_amount,
-                     current_amount,
-                     price_usd,
-                     basis_usd,
-                     timestamp,
-                     history,
-                     receipt,
-                     price_source,
-                     chain
+        sql = f"""SELECT {COSTBASIS_LOT_ROW_COLUMNS}, history
                  FROM costbasis_lot
                  WHERE
                  address IN (
@@ -1774,13 +1915,16 @@ class LotMatcher:
         available_lots = []
 
         for r in results:
-            r = dict(**r)
-            r["history"] = jsonpickle.decode(r["history"])
             flags = load_flags(CostbasisLot.__name__, r["tx_ledger_id"])
-            lot = CostbasisLot(flags=flags, **r)
+            lot = CostbasisLotRow(*tuple(r)[:-1], history=r["history"], flags=flags)
             # We check the lot.current_amount > 0 here (and not in SQL) because we want to deal with Decimals not floats
             if lot.current_amount > CLOSE_TO_ZERO:
                 available_lots.append(lot)
+
+        # Only the lots we're keeping need their history tx_ledgers looked up
+        histories = load_lot_histories([lot.history for lot in available_lots])
+        for lot, history in zip(available_lots, histories):
+            lot.history = history
         return available_lots
 
 
@@ -1880,6 +2024,14 @@ class Form8949:
         txl = TxLogical.from_id(results[0]["id"], entity_name=self.entity)
         return txl.auto_description()
 
+    def write_tx_url(self, ws, row, col, url, format, tx_hash):
+        # get_url hands back the bare hash for chains without an explorer (e.g. exchange imports) and
+        # xlsxwriter refuses to write that as a link
+        if url == tx_hash:
+            ws.write(row, col, tx_hash, format)
+        else:
+            ws.write_url(row, col, url, format, tx_hash)
+
     def get_disposal(self):
         """
         One Gregorian calendar year, has 365.2425 days:
@@ -2134,6 +2286,12 @@ class Form8949:
               """
         params = [self.entity]
         results = db.query(sql, params)
+        histories = dict(
+            zip(
+                [r["tx_ledger_id"] for r in results],
+                load_lot_histories([r["history"] for r in results]),
+            )
+        )
 
         ws = self.wb.add_worksheet("Costbasis Lots")
 
@@ -2198,7 +2356,7 @@ class Form8949:
 
             asset_tx_id = r["asset_tx_id"]
 
-            history = jsonpickle.decode(r[10])
+            history = histories[r["tx_ledger_id"]]
             try:
                 history_s = "\n".join([h.hash for h in history])
             except:
@@ -2231,7 +2389,7 @@ class Form8949:
                 ws.write(i, 10, flags_s, self.default_format_grey)
                 ws.write(i, 11, receipt, self.default_format_grey)
                 ws.write(i, 12, chain, self.default_format_grey)
-                ws.write_url(i, 13, url, self.default_format_grey, tx_hash)
+                self.write_tx_url(ws, i, 13, url, self.default_format_grey, tx_hash)
                 ws.write(i, 14, price_source, self.default_format_grey)
                 ws.write(i, 15, chain, self.default_format_grey)
             else:
@@ -2248,7 +2406,7 @@ class Form8949:
                 ws.write(i, 10, flags_s, self.default_format)
                 ws.write(i, 11, receipt, self.default_format)
                 ws.write(i, 12, chain, self.default_format)
-                ws.write_url(i, 13, url, self.default_format, tx_hash)
+                self.write_tx_url(ws, i, 13, url, self.default_format, tx_hash)
                 ws.write(i, 14, price_source, self.default_format_grey)
                 ws.write(i, 15, chain, self.default_format_grey)
 
@@ -2273,27 +2431,15 @@ class Form8949:
                             target_row = self.lot_row[tx_hash] + 1
                             # https://stackoverflow.com/questions/50369352/creating-a-hyperlink-for-a-excel-sheet-xlsxwriter
                             url = f"internal:'Costbasis Lots'!{target_row}:{target_row}"
-                            ws.write_url(row, 8, url, self.default_format, tx_hash)
+                            self.write_tx_url(
+                                ws, row, 8, url, self.default_format, tx_hash
+                            )
                         except:
                             # Could be empty
                             pass
 
     def get_ledger(self):
-        sql = f"""SELECT id, tx_logical_type
-                  FROM tx_logical
-                  WHERE address IN (
-                      SELECT address
-                      FROM address, entity
-                      WHERE entity_id = entity.id
-                      AND entity.name = ?
-                  )
-                 AND count > 0
-                 AND timestamp  >= {self.start}
-                 AND timestamp < {self.end}
-                 ORDER BY timestamp ASC
-              """
-        params = [self.entity]
-        results = db.query(sql, params)
+        results = entity_tx_stream(self.entity, self.start, self.end)
 
         ws = self.wb.add_worksheet("Ledger TXs")
 
@@ -2337,62 +2483,41 @@ class Form8949:
         ws.set_column("Q:Q", 40)
 
         i = 1
-        for txlog in tqdm(results, desc="Logical TXs", disable=None):
-            tx_log_flags = load_flags(TxLogical.__name__, txlog["id"])
-            sql = """SELECT id,
-                            chain,
-                            address,
-                            hash,
-                            from_address,
-                            to_address,
-                            asset_tx_id,
-                            isfee,
-                            amount,
-                            timestamp,
-                            direction,
-                            tx_ledger_type,
-                            asset_price_id,
-                            symbol,
-                            price_usd
-                     FROM tx_ledger txle
-                     JOIN tx_rel_ledger_logical as rel ON txle.id = rel.tx_ledger_id
-                     WHERE rel.tx_logical_id = ?
-                     ORDER by timestamp ASC
-                  """
-            params = [txlog["id"]]
-            r_txle = db.query(sql, params)
-
-            for txle in r_txle:
-                d = arrow.get(txle["timestamp"])
-                d = d.to(REPORTING_TIMEZONE)
-                date = d.format()
-
-                url = get_url(txle["chain"], txle["hash"])
-
-                ws.write(i, 0, date, self.default_format)
-                ws.write(i, 1, txle["address"], self.default_format)
-                ws.write(i, 2, txlog["tx_logical_type"], self.default_format)
-                ws.write(i, 3, txle["tx_ledger_type"], self.default_format)
-                ws.write(i, 4, txle["direction"], self.default_format)
-                ws.write(i, 5, txle["isfee"], self.default_format)
-                ws.write(i, 6, txle["chain"], self.default_format)
-                ws.write(i, 7, txle["from_address"], self.default_format)
-                ws.write(i, 8, txle["to_address"], self.default_format)
-                ws.write(i, 9, txle["amount"], self.amount_format)
-                ws.write(i, 10, txle["price_usd"], self.currency_format)
-                ws.write(i, 11, txle["symbol"], self.default_format)
-                ws.write(i, 12, txle["asset_price_id"], self.default_format)
-                ws.write(i, 13, txle["asset_tx_id"], self.default_format)
-                ws.write_url(i, 14, url, self.default_format, txle["hash"])
-                ws.write(i, 15, txle["id"], self.default_format)
-                ws.write(
-                    i,
-                    16,
-                    ", ".join([f.name for f in tx_log_flags]),
-                    self.default_format,
-                )
-                i += 1
+        tx_logical_id = None
+        for txle in tqdm(results, desc="Ledger TXs", disable=None):
             # Extra space between logical groups
+            if tx_logical_id and txle["tx_logical_id"] != tx_logical_id:
+                i += 1
+            tx_logical_id = txle["tx_logical_id"]
+
+            d = arrow.get(txle["ledger_timestamp"])
+            d = d.to(REPORTING_TIMEZONE)
+            date = d.format()
+
+            url = get_url(txle["chain"], txle["hash"])
+
+            ws.write(i, 0, date, self.default_format)
+            ws.write(i, 1, txle["address"], self.default_format)
+            ws.write(i, 2, txle["tx_logical_type"], self.default_format)
+            ws.write(i, 3, txle["tx_ledger_type"], self.default_format)
+            ws.write(i, 4, txle["direction"], self.default_format)
+            ws.write(i, 5, txle["isfee"], self.default_format)
+            ws.write(i, 6, txle["chain"], self.default_format)
+            ws.write(i, 7, txle["from_address"], self.default_format)
+            ws.write(i, 8, txle["to_address"], self.default_format)
+            ws.write(i, 9, txle["amount"], self.amount_format)
+            ws.write(i, 10, txle["price_usd"], self.currency_format)
+            ws.write(i, 11, txle["symbol"], self.default_format)
+            ws.write(i, 12, txle["asset_price_id"], self.default_format)
+            ws.write(i, 13, txle["asset_tx_id"], self.default_format)
+            self.write_tx_url(ws, i, 14, url, self.default_format, txle["hash"])
+            ws.write(i, 15, txle["tx_ledger_id"], self.default_format)
+            ws.write(
+                i,
+                16,
+                ", ".join(flag_names(txle["flags"])),
+                self.default_format,
+            )
             i += 1
 
         # Freeze Header Row
@@ -2408,6 +2533,59 @@ class CostbasisYearCloser:
             or f"{self.entity}-costbaisis-closing-year-{self.year}-{get_active_branch_name().lower()}.csv"
         )
 
+    def snapshot_closing_lots(self):
+        """
+        Store the entity's lot book as of the end of the year in costbasis_lot_snapshot. Later regenerations start
+        from it instead of recomputing this year or anything before it.
+
+        The live tables are regenerated through the end of the year and locked first, so the year's disposals, income
+        and flags are the ones that go with the snapshot. Anything after the year is left for the next regeneration.
+        """
+        closed_through = latest_snapshot_year(self.entity)
+        if closed_through is not None and self.year <= closed_through:
+            raise YearClosedError(
+                f"Costbasis for {self.entity} is already closed through {closed_through}"
+            )
+
+        args = SimpleNamespace(year=self.year, resumefrom=None, debugtx=None)
+        regenerate_costbasis_lots(self.entity, args=args, quiet=True, progress=False)
+        self.lock_costbasis_lots()
+
+        columns = [
+            f"CAST({c} AS BLOB)" if c in SNAPSHOT_DECIMAL_COLUMNS else c
+            for c in SNAPSHOT_LOT_COLUMNS
+        ]
+        sql = f"""SELECT {", ".join(columns)}
+                  FROM costbasis_lot
+                  WHERE entity = ?
+                  ORDER BY timestamp, tx_ledger_id
+               """
+        lots = [list(r) for r in db.query(sql, self.entity)]
+        for lot in lots:
+            flags = [
+                [f.name, f.description, f.source, f.created_at]
+                for f in query_flags(CostbasisLot.__name__, lot[0])
+                if f.source != "manual"
+            ]
+            lot.append(json.dumps(flags) if flags else None)
+
+        sql = f"""INSERT INTO costbasis_lot_snapshot
+                  (year, {", ".join(SNAPSHOT_LOT_COLUMNS)}, flags)
+                  VALUES
+                  ({", ".join("?" * (len(SNAPSHOT_LOT_COLUMNS) + 2))})
+               """
+        if lots:
+            db.execute_many(sql, [[self.year, *lot] for lot in lots])
+        sql = """INSERT INTO costbasis_year_snapshot (entity, year, lots, created_at) VALUES (?, ?, ?, ?)"""
+        db.execute(sql, [self.entity, self.year, len(lots), int(time.time())])
+        return len(lots)
+
+    def reopen(self):
+        """Drop the closing snapshots for this year and any after it, so they get regenerated again"""
+        for table in ["costbasis_lot_snapshot", "costbasis_year_snapshot"]:
+            sql = f"""DELETE FROM {table} WHERE entity = ? AND year >= ?"""
+            db.execute(sql, [self.entity, self.year])
+
     def lock_costbasis_lots(self):
         # We want to lock all costbasis lots that were either 1) created this year or 2) drawn down from in the target year
         start_timestamp = int(datetime(self.year, 1, 1).timestamp())
@@ -0,0 +1,207 @@
+"""
+Batch costbasis runs across entities
+
+Each entity is regenerated in its own worker process (perfi startup is paid once per worker, not once per entity),
+logs to logs/costbasis-<entity>.log like bin/calculate_costbasis.py does, and reports back a summary of what it
+produced. Workers write straight to the shared DB; writes are short single-statement transactions and the WAL
+journal plus the busy timeout in perfi.db serialize them.
+"""
+import json
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from types import SimpleNamespace
+from typing import List, Optional
+
+import arrow
+from tqdm import tqdm
+
+from .constants.paths import LOG_DIR
+from .costbasis import (
+    regenerate_costbasis_lots,
+    in_progress_tx_logical_ids,
+    ENTITY_ADDRESSES_SQL,
+)
+from .costbasis_parallel import worker_db_path
+from .db import db
+from .models import CostbasisLot, CostbasisDisposal, TxLogical
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = "%(asctime)s : %(levelname)-8s : %(message)s"
+
+
+@dataclass
+class EntityRunSummary:
+    entity: str
+    ok: bool
+    seconds: float
+    lots: int = 0
+    disposals: int = 0
+    income: int = 0
+    # Non-manual flags on the entity's lots, disposals and tx_logicals after the run
+    flags: int = 0
+    # Errors logged while processing (e.g. tx_logicals the generator couldn't handle)
+    errors_logged: int = 0
+    error: Optional[str] = None
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def get_entity_names(names: List[str]) -> List[str]:
+    """Expand "all" and make sure every named entity exists"""
+    existing = [r["name"] for r in db.query("SELECT name FROM entity ORDER BY name")]
+    if names == ["all"]:
+        return existing
+    missing = [n for n in names if n not in existing]
+    if missing:
+        raise ValueError(f"Unknown entities: {', '.join(missing)}")
+    return names
+
+
+@contextmanager
+def entity_log(entity):
+    """Send this entity's WARN+ logging to its own file and count the errors"""
+    root = logging.getLogger()
+    file_handler = logging.FileHandler(f"{LOG_DIR}/costbasis-{entity}.log")
+    file_handler.setLevel(logging.WARN)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    errors = ErrorCounter()
+    previous_level = root.level
+    root.setLevel(min(previous_level or logging.WARN, logging.WARN))
+    root.addHandler(file_handler)
+    root.addHandler(errors)
+    try:
+        yield errors
+    finally:
+        root.removeHandler(file_handler)
+        root.removeHandler(errors)
+        root.setLevel(previous_level)
+        file_handler.close()
+
+
+def count_entity_results(entity) -> dict:
+    counts = {}
+    for table, key in [
+        ("costbasis_lot", "lots"),
+        ("costbasis_disposal", "disposals"),
+        ("costbasis_income", "income"),
+    ]:
+        sql = f"""SELECT COUNT(*) FROM {table} WHERE entity = ?"""
+        counts[key] = db.query(sql, entity)[0][0]
+
+    sql = f"""SELECT COUNT(*) FROM flag
+              WHERE source != 'manual'
+              AND (
+                  (target_type = ? AND target_id IN (SELECT tx_ledger_id FROM costbasis_lot WHERE entity = ?))
+                  OR (target_type = ? AND target_id IN (SELECT CAST(id AS TEXT) FROM costbasis_disposal WHERE entity = ?))
+                  OR (target_type = ? AND target_id IN (SELECT id FROM tx_logical WHERE address IN ({ENTITY_ADDRESSES_SQL})))
+              )
+           """
+    params = [
+        CostbasisLot.__name__,
+        entity,
+        CostbasisDisposal.__name__,
+        entity,
+        TxLogical.__name__,
+        entity,
+    ]
+    counts["flags"] = db.query(sql, params)[0][0]
+    return counts
+
+
+def run_entity(entity, year=None) -> EntityRunSummary:
+    args = SimpleNamespace(year=year, resumefrom=None, debugtx=None)
+    start = time.perf_counter()
+    error = None
+    with entity_log(entity) as errors:
+        try:
+            regenerate_costbasis_lots(entity, args=args, quiet=True, progress=False)
+        except Exception as err:
+            # The batch summary reports this, so it shouldn't also show up in the atexit report
+            last_tx_logical_id = in_progress_tx_logical_ids.pop(entity, None)
+            error = f"{err!r} (last tx_logical_id: {last_tx_logical_id})"
+            logger.error(f"Costbasis for {entity} failed: {error}", exc_info=True)
+    seconds = time.perf_counter() - start
+
+    return EntityRunSummary(
+        entity=entity,
+        ok=error is None,
+        seconds=round(seconds, 3),
+        errors_logged=errors.count,
+        error=error,
+        **count_entity_results(entity),
+    )
+
+
+def run_batch(entities: List[str], processes=1, year=None) -> List[EntityRunSummary]:
+    """Regenerate costbasis for each entity, returning summaries in the order given"""
+    summaries = {}
+    # Workers open the DB file themselves, so anything that only lives in this process has to run here
+    if (
+        processes <= 1
+        or len(entities) <= 1
+        or db.db_file == ":memory:"
+        or db.con is db.mcon
+    ):
+        for entity in tqdm(entities, desc="Entities", disable=None):
+            summaries[entity] = run_entity(entity, year)
+    else:
+        with worker_db_path(db.db_file), ProcessPoolExecutor(
+            max_workers=min(processes, len(entities)),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            futures = {
+                executor.submit(run_entity, entity, year): entity for entity in entities
+            }
+            progress = tqdm(
+                as_completed(futures), total=len(futures), desc="Entities", disable=None
+            )
+            for future in progress:
+                entity = futures[future]
+                try:
+                    summary = future.result()
+                except Exception as err:
+                    # The worker itself died (not just the costbasis run)
+                    summary = EntityRunSummary(
+                        entity=entity, ok=False, seconds=0, error=repr(err)
+                    )
+                summaries[entity] = summary
+                status = "ok" if summary.ok else "FAILED"
+                progress.write(f"{entity}: {status} in {summary.seconds:.1f}s")
+
+    return [summaries[entity] for entity in entities]
+
+
+def write_run_summary(
+    summaries: List[EntityRunSummary], seconds: float, path=None
+) -> str:
+    path = (
+        path
+        or f"{LOG_DIR}/costbasis-batch-{arrow.utcnow().format('YYYYMMDD-HHmmss')}.json"
+    )
+    totals = dict(
+        entities=len(summaries),
+        failed=len([s for s in summaries if not s.ok]),
+        seconds=round(seconds, 3),
+        lots=sum(s.lots for s in summaries),
+        disposals=sum(s.disposals for s in summaries),
+        income=sum(s.income for s in summaries),
+        flags=sum(s.flags for s in summaries),
+        errors_logged=sum(s.errors_logged for s in summaries),
+    )
+    with open(path, "w") as f:
+        json.dump(
+            dict(totals=totals, entities=[asdict(s) for s in summaries]), f, indent=2
+        )
+    return path
@@ -0,0 +1,155 @@
+"""
+Lot matching algorithm comparison
+
+Loads and types an entity's tx_logicals once, then replays them through a CostbasisGenerator per algorithm (see
+LotMatcher) instead of doing a full regenerate_costbasis_lots run per algorithm. The generators run on a single
+in-memory copy of the DB whose costbasis tables are cleared before each algorithm, so the entity's real lots, disposals
+and income are left alone. Only the disposals come back, into costbasis_disposal_scenario with the algorithm that made
+them, and lot_algorithm_summary totals their realized short and long term gains per year.
+
+This is not a single costbasis pass. The lot books live in the costbasis tables, so advancing every algorithm's books
+together would take a DB copy per algorithm. Instead the replay runs once per algorithm, which costs
+len(algorithms) times the lot matching work (the loading and typing are shared) for one DB copy's worth of memory.
+"""
+import copy
+import logging
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, List
+
+import arrow
+from tqdm import tqdm
+
+from . import costbasis
+from .costbasis import (
+    LOT_ALGORITHMS,
+    CostbasisGenerator,
+    ENTITY_ADDRESSES_SQL,
+    clear_costbasis,
+    entity_flag_targets,
+    lot_algorithm,
+)
+from .costbasis_parallel import log_process_error, prepare_tx_logicals
+from .db import db
+from .models import TxLogical, flag_index
+
+logger = logging.getLogger(__name__)
+
+# Same cutoff as Form8949
+LONG_TERM_SECONDS = 31556952
+
+DISPOSAL_COLUMNS = [
+    "entity",
+    "address",
+    "asset_price_id",
+    "symbol",
+    "amount",
+    "timestamp",
+    "duration_held",
+    "basis_timestamp",
+    "basis_tx_ledger_id",
+    "basis_usd",
+    "total_usd",
+    "tx_ledger_id",
+    "price_source",
+]
+
+
+def compare_lot_algorithms(entity, algorithms=LOT_ALGORITHMS, progress=True):
+    """Replay the entity's preloaded tx_logicals once per algorithm and return lot_algorithm_summary"""
+    unknown = set(algorithms) - set(LOT_ALGORITHMS)
+    if unknown:
+        raise ValueError(
+            f"Unknown lot algorithms {sorted(unknown)}, expected some of {LOT_ALGORITHMS}"
+        )
+
+    # One scratch copy of the DB is shared by every algorithm; between runs only the entity's costbasis is cleared
+    scratch = db.copy_to_memory()
+    disposals = []
+    with db.using(scratch):
+        clear_costbasis(entity)
+        sql = f"""SELECT id FROM tx_logical
+                  WHERE address IN ({ENTITY_ADDRESSES_SQL})
+                  ORDER BY timestamp ASC
+               """
+        tx_logical_ids = [r["id"] for r in db.query(sql, entity)]
+        # Typed and loaded once here, so every algorithm sees the same types and flags
+        with flag_index.loaded(entity_flag_targets(entity)):
+            tx_logicals = prepare_tx_logicals(entity, tx_logical_ids)
+        loaded = []
+        for typed in tqdm(
+            tx_logicals,
+            desc=f"Loading TxLogicals ({entity})",
+            disable=None if progress else True,
+        ):
+            tx_logical = TxLogical.from_id(id=typed.id, entity_name=entity)
+            tx_logical.tx_logical_type = typed.tx_logical_type
+            loaded.append(tx_logical)
+
+        for algorithm in algorithms:
+            clear_costbasis(entity)
+            with lot_algorithm(algorithm):
+                for tx_logical in tqdm(
+                    loaded,
+                    desc=f"Comparing Lot Algorithms ({entity}, {algorithm})",
+                    disable=None if progress else True,
+                ):
+                    # The generator adjusts its ledgers while it works, so each algorithm gets its own copy
+                    tx_logical = copy.deepcopy(tx_logical)
+                    try:
+                        CostbasisGenerator(tx_logical).process(retype=False)
+                    except Exception as err:
+                        log_process_error(err, tx_logical)
+
+            sql = f"""SELECT {", ".join(DISPOSAL_COLUMNS)}
+                      FROM costbasis_disposal
+                      WHERE entity = ?
+                      ORDER BY id
+                   """
+            disposals += [[algorithm, *r] for r in db.query(sql, entity)]
+    scratch.close()
+
+    sql = """DELETE FROM costbasis_disposal_scenario WHERE entity = ?"""
+    db.execute(sql, entity)
+    if disposals:
+        sql = f"""INSERT INTO costbasis_disposal_scenario
+                  (algorithm, {", ".join(DISPOSAL_COLUMNS)})
+                  VALUES
+                  ({", ".join("?" * (len(DISPOSAL_COLUMNS) + 1))})
+               """
+        db.execute_many(sql, disposals)
+
+    return lot_algorithm_summary(entity)
+
+
+def lot_algorithm_summary(entity) -> List[Dict]:
+    """Realized gains per algorithm per year (in REPORTING_TIMEZONE) from the last compare_lot_algorithms run"""
+    sql = """SELECT algorithm, timestamp, duration_held, basis_usd, total_usd
+             FROM costbasis_disposal_scenario
+             WHERE entity = ?
+          """
+    totals = defaultdict(
+        lambda: {"short_term_usd": Decimal(0), "long_term_usd": Decimal(0)}
+    )
+    for r in db.query(sql, entity):
+        year = arrow.get(r["timestamp"]).to(costbasis.REPORTING_TIMEZONE).year
+        gain = Decimal(r["total_usd"] or 0) - Decimal(r["basis_usd"] or 0)
+        term = (
+            "long_term_usd"
+            if r["duration_held"] > LONG_TERM_SECONDS
+            else "short_term_usd"
+        )
+        totals[(r["algorithm"], year)][term] += gain
+
+    return [
+        {
+            "algorithm": algorithm,
+            "year": year,
+            **gains,
+            "total_usd": gains["short_term_usd"] + gains["long_term_usd"],
+        }
+        for (algorithm, year), gains in sorted(
+            totals.items(),
+            key=lambda item: (item[0][1], LOT_ALGORITHMS.index(item[0][0])),
+        )
+    ]
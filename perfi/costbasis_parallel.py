@@ -0,0 +1,344 @@
+"""
+Parallel costbasis regeneration
+
+Lot books only interact through tx_logicals that touch more than one asset (swaps, LPs, deposit receipts...), so we
+union the books each logical touches and every connected component can be replayed independently. Gas fees would
+otherwise tie everything on a chain to its native token, so a logical whose fee asset falls in another component is
+split into its main part and a fee drawdown that runs in the fee asset's component.
+
+Each worker process works on a private in-memory copy of the DB, replays its components in timeline order, and sends
+back the rows it created and the new current_amount of any lot that was already there (e.g. restored from a closed
+year's snapshot); the parent then writes them in a deterministic order.
+"""
+import logging
+import multiprocessing
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pprint import pformat
+from typing import Dict, List, Optional, Tuple
+
+from tqdm import tqdm
+
+from .costbasis import CostbasisGenerator, entity_flag_targets
+from .db import db
+from .models import TxLogical, TX_LOGICAL_FLAG, flag_index, has_flag
+from .price import price_feed
+
+logger = logging.getLogger(__name__)
+
+PART_ALL = "all"
+PART_MAIN = "main"
+PART_FEE = "fee"
+
+# Rows created by a component are everything past these rowid watermarks in the worker's copy
+RESULT_TABLES = ["costbasis_lot", "costbasis_disposal", "costbasis_income", "flag"]
+NO_BOOK = "__no_book__"
+
+
+@dataclass
+class CostbasisTask:
+    order: int
+    tx_logical_id: str
+    part: str
+    # Types are assigned by the parent (see prepare_tx_logicals) so workers don't rewrite tx_logical
+    tx_logical_type: Optional[str]
+
+
+def lot_book_keys(txle) -> set:
+    """Every key LotMatcher or the lot writers could use for this tx_ledger's asset"""
+    keys = {f"{txle.chain}:{txle.asset_tx_id}"}
+    if txle.asset_price_id:
+        keys.add(txle.asset_price_id)
+    mapped_asset = price_feed.map_asset(txle.chain, txle.asset_tx_id)
+    if mapped_asset:
+        keys.add(mapped_asset["asset_price_id"])
+    return keys
+
+
+def logical_book_keys(tx_logical: TxLogical) -> Tuple[set, set]:
+    main_keys = set()
+    fee_keys = set()
+    for t in tx_logical.tx_ledgers:
+        if t.tx_ledger_type == "fee":
+            # Fiat fees never drawdown
+            if not t.asset_tx_id.startswith("FIAT:"):
+                fee_keys |= lot_book_keys(t)
+        # The fiat side of a trade never touches a lot book (see CostbasisGenerator.process)
+        elif tx_logical.tx_logical_type == "trade" and t.asset_tx_id.startswith(
+            "FIAT:"
+        ):
+            continue
+        else:
+            main_keys |= lot_book_keys(t)
+    return main_keys, fee_keys
+
+
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, key):
+        self.parent.setdefault(key, key)
+        root = key
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[key] != root:
+            self.parent[key], key = root, self.parent[key]
+        return root
+
+    def union(self, keys):
+        keys = list(keys)
+        for key in keys[1:]:
+            a, b = self.find(keys[0]), self.find(key)
+            if a != b:
+                # Keep roots deterministic
+                self.parent[max(a, b)] = min(a, b)
+
+
+def partition_tx_logicals(tx_logicals: List[TxLogical]) -> List[List[CostbasisTask]]:
+    """Split timestamp-ordered tx_logicals into independent lists of tasks, ordered by their first task"""
+    book_keys = [logical_book_keys(txl) for txl in tx_logicals]
+
+    books = UnionFind()
+    for main_keys, fee_keys in book_keys:
+        if main_keys:
+            books.union(main_keys)
+        if fee_keys:
+            books.union(fee_keys)
+
+    components: Dict[str, List[CostbasisTask]] = defaultdict(list)
+    for order, (txl, (main_keys, fee_keys)) in enumerate(zip(tx_logicals, book_keys)):
+        main_root = books.find(next(iter(main_keys))) if main_keys else None
+        fee_root = books.find(next(iter(fee_keys))) if fee_keys else None
+
+        if main_root and fee_root and main_root != fee_root:
+            components[main_root].append(
+                CostbasisTask(order, txl.id, PART_MAIN, txl.tx_logical_type)
+            )
+            components[fee_root].append(
+                CostbasisTask(order, txl.id, PART_FEE, txl.tx_logical_type)
+            )
+        else:
+            root = main_root or fee_root or NO_BOOK
+            components[root].append(
+                CostbasisTask(order, txl.id, PART_ALL, txl.tx_logical_type)
+            )
+
+    return sorted(components.values(), key=lambda tasks: tasks[0].order)
+
+
+def prepare_tx_logicals(entity, tx_logical_ids) -> List[TxLogical]:
+    """Load, filter and type tx_logicals the same way the sequential loop in regenerate_costbasis_lots does"""
+    tx_logicals = []
+    for tx_logical_id in tqdm(tx_logical_ids, desc="Typing TxLogicals", disable=None):
+        if has_flag(
+            TxLogical.__name__,
+            tx_logical_id,
+            TX_LOGICAL_FLAG.ignored_from_costbasis.value,
+        ):
+            continue
+        tx_logical = TxLogical.from_id(id=tx_logical_id, entity_name=entity)
+        if len(tx_logical.tx_ledgers) == 0:
+            continue
+        try:
+            tx_logical.refresh_type()
+        except Exception as err:
+            log_process_error(err, tx_logical)
+            continue
+        tx_logicals.append(tx_logical)
+    return tx_logicals
+
+
+def log_process_error(err, tx_logical):
+    logger.error("-----------------")
+    logger.error(
+        "Encountered an unknown error when processing a tx_logical for costbasis:"
+    )
+    logger.error(err, exc_info=True)
+    logger.error("TxLogical:")
+    logger.error(pformat(tx_logical))
+    logger.error("-----------------")
+
+
+@contextmanager
+def worker_db_path(db_file):
+    # Spawned workers import perfi.db fresh, so point its singleton at the same file as ours
+    previous = os.environ.get("PERFI_DB_PATH")
+    os.environ["PERFI_DB_PATH"] = db_file
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ["PERFI_DB_PATH"]
+        else:
+            os.environ["PERFI_DB_PATH"] = previous
+
+
+def init_worker():
+    # A private copy that is never written back, so workers can't step on each other or the parent
+    db.use_mem(save_at_exit=False)
+
+
+def decimal_safe_columns(table) -> List[str]:
+    # Selecting DECIMAL columns through CAST skips the converter so values are copied back byte for byte
+    columns = []
+    for r in db.query(f"PRAGMA table_info({table})"):
+        if r["type"].upper() == "DECIMAL":
+            columns.append(f'CAST("{r["name"]}" AS BLOB)')
+        else:
+            columns.append(f'"{r["name"]}"')
+    return columns
+
+
+def table_columns(table) -> List[str]:
+    return [r["name"] for r in db.query(f"PRAGMA table_info({table})")]
+
+
+def process_component(entity, tasks: List[CostbasisTask]):
+    watermarks = {
+        table: db.query(f"SELECT IFNULL(MAX(rowid), 0) FROM {table}")[0][0]
+        for table in RESULT_TABLES
+    }
+    # Lots that were already there (e.g. restored from a closed year's snapshot) are drawn down in place
+    existing_lots_sql = """SELECT tx_ledger_id, CAST(current_amount AS BLOB)
+                           FROM costbasis_lot
+                           WHERE entity = ?
+                           AND rowid <= ?
+                        """
+    existing_lots = dict(
+        db.query(existing_lots_sql, [entity, watermarks["costbasis_lot"]])
+    )
+    ledger_prices = {}
+
+    for task in tasks:
+        tx_logical = TxLogical.from_id(id=task.tx_logical_id, entity_name=entity)
+        tx_logical.tx_logical_type = task.tx_logical_type
+        if task.part != PART_FEE:
+            for t in tx_logical.tx_ledgers:
+                ledger_prices.setdefault(t.id, t.price_usd)
+        try:
+            CostbasisGenerator(tx_logical).process(
+                retype=False,
+                include_fee=task.part != PART_MAIN,
+                fee_only=task.part == PART_FEE,
+            )
+        except Exception as err:
+            log_process_error(err, tx_logical)
+
+    rows = {}
+    for table in RESULT_TABLES:
+        sql = f"""SELECT rowid AS _rowid, {", ".join(decimal_safe_columns(table))}
+                  FROM {table}
+                  WHERE rowid > ?
+                  ORDER BY rowid
+               """
+        rows[table] = [tuple(r) for r in db.query(sql, [watermarks[table]])]
+
+    updated_amounts = [
+        (current_amount, tx_ledger_id)
+        for tx_ledger_id, current_amount in db.query(
+            existing_lots_sql, [entity, watermarks["costbasis_lot"]]
+        )
+        if existing_lots.get(tx_ledger_id) != current_amount
+    ]
+
+    # LP entries save a derived price onto the LP token's tx_ledger
+    updated_prices = []
+    for tx_ledger_id, price_usd in ledger_prices.items():
+        sql = (
+            """SELECT price_usd, CAST(price_usd AS BLOB) FROM tx_ledger WHERE id = ?"""
+        )
+        r = db.query(sql, tx_ledger_id)
+        if r and r[0][0] != price_usd:
+            updated_prices.append((r[0][1], tx_ledger_id))
+
+    return rows, updated_prices, updated_amounts
+
+
+def merge_results(results):
+    # Lot flags are replaced when a lot is saved (see replace_flags), same as the sequential run would
+    lot_ids = [[r[1]] for rows, *_ in results for r in rows["costbasis_lot"]]
+    sql = """DELETE FROM flag WHERE target_type = 'CostbasisLot' AND target_id = ?"""
+    if lot_ids:
+        db.execute_many(sql, lot_ids)
+
+    # Autoincrement ids are reassigned in timeline order, ties broken by component then creation order
+    for table in RESULT_TABLES:
+        columns = table_columns(table)
+        if table == "costbasis_lot":
+            insert_columns = columns
+        else:
+            insert_columns = [c for c in columns if c != "id"]
+        indexes = [columns.index(c) + 1 for c in insert_columns]
+
+        sort_rows = []
+        for component_index, (rows, *_) in enumerate(results):
+            for r in rows[table]:
+                timestamp = (
+                    r[columns.index("timestamp") + 1] if "timestamp" in columns else 0
+                )
+                sort_rows.append((timestamp or 0, component_index, r[0], r))
+        sort_rows.sort(key=lambda x: x[:3])
+
+        verb = "REPLACE" if table == "costbasis_lot" else "INSERT"
+        sql = f"""{verb} INTO {table}
+                  ({", ".join(insert_columns)})
+                  VALUES
+                  ({", ".join("?" * len(insert_columns))})
+               """
+        params = [[r[i] for i in indexes] for *_, r in sort_rows]
+        if params:
+            db.execute_many(sql, params)
+
+    sql = """UPDATE tx_ledger SET price_usd = ? WHERE id = ?"""
+    params = [p for _, updated_prices, _ in results for p in updated_prices]
+    if params:
+        db.execute_many(sql, params)
+
+    # Each lot is in exactly one component, so its drawdowns only ever come back from one worker
+    sql = """UPDATE costbasis_lot SET current_amount = ? WHERE tx_ledger_id = ?"""
+    params = [p for *_, updated_amounts in results for p in updated_amounts]
+    if params:
+        db.execute_many(sql, params)
+
+
+def regenerate_in_parallel(entity, tx_logical_ids, workers):
+    with flag_index.loaded(entity_flag_targets(entity)):
+        tx_logicals = prepare_tx_logicals(entity, tx_logical_ids)
+    components = partition_tx_logicals(tx_logicals)
+    logger.debug(
+        f"Split {len(tx_logicals)} TxLogicals into {len(components)} independent components"
+    )
+
+    # Workers copy the DB file, so it has to be the current state of the DB. Otherwise replay the components
+    # one after another right here, which writes straight to our DB
+    if db.db_file == ":memory:" or db.con is db.mcon or workers <= 1:
+        for tasks in tqdm(components, desc="Generating Costbasis", disable=None):
+            process_component(entity, tasks)
+    else:
+        results = [None] * len(components)
+        # Biggest components first so one long tail doesn't start last
+        schedule = sorted(
+            range(len(components)), key=lambda i: len(components[i]), reverse=True
+        )
+        with worker_db_path(db.db_file), ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+        ) as executor:
+            futures = {
+                executor.submit(process_component, entity, components[i]): i
+                for i in schedule
+            }
+            for future in tqdm(
+                as_completed(futures),
+                total=len(futures),
+                desc="Generating Costbasis",
+                disable=None,
+            ):
+                results[futures[future]] = future.result()
+
+        merge_results(results)
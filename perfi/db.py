@@ -1,11 +1,15 @@
 import atexit
 import os
 import sqlite3
+from contextlib import contextmanager, nullcontext
 from decimal import Decimal, Context
 
 import psutil
 
 from .constants.paths import DB_PATH, DB_SCHEMA_PATH
+from .metrics import metrics
+from .migrations import migrate
+from .query_profiler import QueryProfiler, DEFAULT_SLOW_QUERY_MS
 
 # Decimal adapting from https://stackoverflow.com/questions/6319409/how-to-convert-python-decimal-to-sqlite-numeric
 DECIMAL_QUANTIZE_PLACES = (
@@ -29,12 +33,20 @@ sqlite3.register_adapter(Decimal, adapt_decimal)
 
 sqlite3.register_converter("decimal", convert_decimal)
 
+# Batch runs write to the same DB file from several processes, so wait out their locks instead of failing
+BUSY_TIMEOUT_SECONDS = 60
+
 
 class DB:
     def __init__(self, db_file=DB_PATH, same_thread=True):
         self.db_file = db_file
+        # Label for metrics, the full path would leak the user's home directory into /metrics
+        self.db_name = os.path.basename(db_file)
         self.fcon = sqlite3.connect(
-            db_file, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=same_thread
+            db_file,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=same_thread,
+            timeout=BUSY_TIMEOUT_SECONDS,
         )
         self.mcon = sqlite3.connect(
             ":memory:",
@@ -53,6 +65,9 @@ class DB:
         self.cur.execute("pragma temp_store=memory")
         # 100 MiB just in case
         self.cur.execute("pragma cache_size=-100000")
+        # So REPLACE INTO fires delete triggers for the row it replaces (the tx_logical search index relies on it)
+        self.cur.execute("pragma recursive_triggers=on")
+        self.mcon.execute("pragma recursive_triggers=on")
 
         if db_file != ":memory:":
             free_memory = psutil.virtual_memory().free
@@ -63,12 +78,49 @@ class DB:
         # improve db perf...
         atexit.register(self.optimize)
 
-    def use_mem(self):
+        self.profiler = None
+        if os.environ.get("PERFI_PROFILE_SQL"):
+            slow_ms = float(
+                os.environ.get("PERFI_SLOW_QUERY_MS", DEFAULT_SLOW_QUERY_MS)
+            )
+            self.enable_profiling(slow_ms)
+
+    def enable_profiling(self, slow_ms=DEFAULT_SLOW_QUERY_MS, save_at_exit=True):
+        self.profiler = QueryProfiler(self.db_name, slow_ms)
+        if save_at_exit:
+            atexit.register(self.profiler.save)
+
+    def _profile(self, query, params):
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.measure(self.con, query, params)
+
+    def use_mem(self, save_at_exit=True):
         # print('using memory')
         self.fcon.backup(self.mcon)
         self.con = self.mcon
         self.cur = self.mcon.cursor()
-        atexit.register(self.save_mem)
+        if save_at_exit:
+            atexit.register(self.save_mem)
+
+    def copy_to_memory(self):
+        """A private in-memory snapshot of the DB, for use with using()"""
+        con = sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_DECLTYPES)
+        con.row_factory = sqlite3.Row
+        self.con.backup(con)
+        con.execute("pragma recursive_triggers=on")
+        return con
+
+    @contextmanager
+    def using(self, con):
+        # Everything holding this DB object (models, price feed...) reads and writes con until we exit
+        previous = (self.con, self.cur)
+        self.con = con
+        self.cur = con.cursor()
+        try:
+            yield
+        finally:
+            self.con, self.cur = previous
 
     def save_mem(self):
         # print(f'saving db to disk: {self.db_file}')
@@ -77,25 +129,40 @@ class DB:
     def query(self, query, params=()):
         if type(params) == str:
             params = (params,)
-        self.cur.execute(query, params)
-        return self.cur.fetchall()
+        with metrics.timer("perfi_db_query", db=self.db_name), self._profile(
+            query, params
+        ):
+            self.cur.execute(query, params)
+            return self.cur.fetchall()
 
     def execute(self, query, params=()):
         if type(params) == str:
             params = (params,)
         try:
-            self.cur.execute(query, params)
-            self.con.commit()
+            with metrics.timer("perfi_db_commit", db=self.db_name), self._profile(
+                query, params
+            ):
+                self.cur.execute(query, params)
+                self.con.commit()
         except:
+            metrics.inc("perfi_db_rollback_total", db=self.db_name)
             self.con.rollback()
 
     def execute_many(self, query, params=()):
         if type(params) == str:
             params = (params,)
         try:
-            self.cur.executemany(query, params)
-            self.con.commit()
+            # Plans are captured with the first parameter set
+            first_params = (
+                params[0] if isinstance(params, (list, tuple)) and params else ()
+            )
+            with metrics.timer("perfi_db_commit", db=self.db_name), self._profile(
+                query, first_params
+            ):
+                self.cur.executemany(query, params)
+                self.con.commit()
         except:
+            metrics.inc("perfi_db_rollback_total", db=self.db_name)
             self.con.rollback()
 
     def create_db(self, schema_path):
@@ -109,6 +176,6 @@ class DB:
 
 # Singleton for perfi db
 db = DB(same_thread=False)
-db_is_empty = len(db.query("select * from sqlite_master")) == 0
-if db_is_empty:
-    db.create_db(DB_SCHEMA_PATH)
+# Every statement in the schema is IF NOT EXISTS so existing databases pick up new tables and indexes too
+db.create_db(DB_SCHEMA_PATH)
+migrate(db)
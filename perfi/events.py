@@ -1,7 +1,7 @@
 from typing import List
 
 from . import costbasis
-from .models import TxLedger, TxLogical, Flag, replace_flags
+from .models import TxLedger, TxLogical, TxLogicalStore, Flag, replace_flags
 
 from copy import copy
 from dataclasses import dataclass
@@ -76,9 +76,10 @@ class EventStore:
         if action:
             desc += ": " + action.value
         for event in tqdm(events, desc=desc, disable=None):
-            self.apply_event(event)
+            self.apply_event(event, refresh_search_index=False)
+        TxLogicalStore(self.db).refresh_search_index()
 
-    def apply_event(self, event: Event):
+    def apply_event(self, event: Event, refresh_search_index: bool = True):
         handlers = {
             EVENT_ACTION.tx_ledger_moved: self.handle_tx_ledger_moved_event,
             EVENT_ACTION.tx_ledger_type_updated: self.handle_tx_ledger_type_updated_event,
@@ -92,6 +93,8 @@ class EventStore:
             raise Exception(f"Don't know how to handle event action {event.action}")
         else:
             handlers[event.action].__call__(event)
+        if refresh_search_index:
+            TxLogicalStore(self.db).refresh_search_index()
 
     def create_tx_logical_type_updated(
         self, tx_logical_id: str, new_tx_logical_type: str, source: str = "perfi"
@@ -19,7 +19,6 @@ import sys
 import tabulate
 import time
 import numpy as np
-import scipy.optimize as opt
 
 """
 uv run python farm-helper.py | less -r
@@ -35,29 +34,76 @@ https://github.com/prompt-toolkit/pypager
 """
 apy should be in decimal form. e.g. .4 = 40% APY
 """
+MIN_CLAIMING_EVENTS = 0.1
+# With no fee more compounding is always better so cap at hourly claims
+MAX_CLAIMING_EVENTS = 365 * 24
+GRID_POINTS = 256
+REFINE_POINTS = 64
+REFINE_ROUNDS = 3
+
+
+def simulate_compound_year(principal, claiming_events, apy, fee):
+    # Compound interest formula with fees (works elementwise on numpy arrays)
+    first_term = principal - fee / apy * claiming_events
+    second_term = (1 + apy / claiming_events) ** claiming_events
+    third_term = fee / apy * claiming_events
+    return first_term * second_term + third_term
+
+
+def get_optimal_claiming_events(principals, apys, fees):
+    """Claiming events per year that maximize the compounded value, for every position at once
+
+    Each position is evaluated over a log-spaced grid between MIN_CLAIMING_EVENTS and the point
+    where a claim earns less than its fee, then the grid is refined around the best point.
+    """
+    principals = np.asarray(principals, dtype=float).reshape(-1, 1)
+    apys = np.asarray(apys, dtype=float).reshape(-1, 1)
+    fees = np.asarray(fees, dtype=float).reshape(-1, 1)
+
+    # Claiming more often than this means each claim earns less than its fee
+    with np.errstate(divide="ignore"):
+        maximum_claiming_events = principals * apys / fees
+    maximum_claiming_events = np.clip(
+        maximum_claiming_events, MIN_CLAIMING_EVENTS, MAX_CLAIMING_EVENTS
+    )
+
+    steps = np.linspace(0, 1, GRID_POINTS).reshape(1, -1)
+    grid = MIN_CLAIMING_EVENTS * (maximum_claiming_events / MIN_CLAIMING_EVENTS) ** steps
+
+    rows = np.arange(grid.shape[0])
+    for _ in range(REFINE_ROUNDS):
+        values = simulate_compound_year(principals, grid, apys, fees)
+        best = np.argmax(values, axis=1)
+        low = grid[rows, np.maximum(best - 1, 0)].reshape(-1, 1)
+        high = grid[rows, np.minimum(best + 1, grid.shape[1] - 1)].reshape(-1, 1)
+        grid = low + (high - low) * np.linspace(0, 1, REFINE_POINTS).reshape(1, -1)
+
+    values = simulate_compound_year(principals, grid, apys, fees)
+    return grid[rows, np.argmax(values, axis=1)]
+
+
 def get_optimal_days_between_compound_events(principal, apy, fee):
-    # Compound interest formula with fees
-    def simulateCompoundYear(principal, claimingEvents, apy, fee):
-        firstTerm = principal-fee/apy*claimingEvents
-        secondTerm = (1+apy/claimingEvents)**claimingEvents
-        thirdTerm = fee/apy*claimingEvents
-        result = firstTerm*secondTerm+thirdTerm
-        return result
-
-    minimumDeltaT=fee/(principal*apy/365)
-
-    # Calculate for 3rd party compounding
-    minimumDeltaT=fee/(306024.53*0.24/365)
-    maximumClaimingEvents = 365/minimumDeltaT
-
-    # Solve for the maximum
-    neg_simulateYear = lambda claimingEvents: -1 * simulateCompoundYear(principal, claimingEvents, apy, fee)
-    bounded_o = opt.minimize_scalar(neg_simulateYear,bounds=[0.1,maximumClaimingEvents],method="bounded")
-    ideal_reinvests_per_year = bounded_o.x
-    ideal_number_of_days_between_reinvests = 365/bounded_o.x
+    ideal_reinvests_per_year = get_optimal_claiming_events([principal], [apy], [fee])[0]
+    ideal_number_of_days_between_reinvests = 365 / ideal_reinvests_per_year
     return ideal_number_of_days_between_reinvests
 
 
+def get_claim_schedules(principals, apys, fees):
+    claiming_events = get_optimal_claiming_events(principals, apys, fees)
+    schedules = []
+    for principal, apy, events in zip(principals, apys, claiming_events):
+        days_between_claims = 365 / events
+        schedules.append(
+            {
+                "claims_per_year": float(events),
+                "days_between_claims": float(days_between_claims),
+                # Rewards accrued (simple interest) by the time the next claim is due
+                "claim_at_usd_value": float(principal * apy * days_between_claims / 365),
+            }
+        )
+    return schedules
+
+
 # Minimum to claim
 DEFAULT_MIN = 100
 chain_min = {
@@ -69,6 +115,20 @@ chain_min = {
     "op": 500,
 }
 
+# Rough guesses at the USD cost of a claim transaction. Override them per chain with the
+# FARM_HELPER_CLAIM_FEES setting (JSON, e.g. {"eth": 25}) or the claim_fees argument
+DEFAULT_CLAIM_FEE = 1
+chain_claim_fee = {
+    "arb": 1,
+    "avax": 1,
+    "eth": 40,
+    "ftm": 0.5,
+    "matic": 0.1,
+    "op": 1,
+}
+# Positions use the APY from their DeBank portfolio item. For ones without it, the FARM_HELPER_APY
+# setting (or the default_apy argument) is assumed, and if that isn't set either they get no claim schedule
+
 # Gas prices per chain
 gas_price_urls = {
     "eth": "https://api.etherscan.io/api?module=gastracker&action=gasoracle" # [1]
@@ -88,9 +148,14 @@ def main():
     parser.add_argument(
         "--entity",
     )
+    parser.add_argument(
+        "--apy",
+        type=float,
+        help="APY (e.g. 0.24) to assume for positions DeBank doesn't give one for",
+    )
     args = parser.parse_args()
 
-    rewards = get_claimable(args.entity, args.refresh)
+    rewards = get_claimable(args.entity, args.refresh, default_apy=args.apy)
     print_claimable(rewards)
 
 
@@ -120,12 +185,12 @@ def refresh_balance_if_needed(entity_name, force_refresh):
         print(f"Using existing balances for {entity_name}. Oldest record is ({int(delta/60)} minutes old)")
 
 
-def get_claimable(entity_name, force_refresh=False):
+def get_claimable(entity_name, force_refresh=False, default_apy=None, claim_fees=None):
     refresh_balance_if_needed(entity_name, force_refresh)
-    return _get_rewards(entity_name)
+    return _get_rewards(entity_name, default_apy, claim_fees)
 
 
-def _get_rewards(entity_name):
+def _get_rewards(entity_name, default_apy=None, claim_fees=None):
     sql = """SELECT address.label, balance_current.address, balance_current.chain, balance_current.protocol, balance_current.symbol, balance_current.usd_value, balance_current.label, balance_current.extra
              FROM balance_current, address, entity
              WHERE address.entity_id = entity.id
@@ -190,13 +255,88 @@ def _get_rewards(entity_name):
         rewards[label]["data"][chain][protocol]["site_url"] = protocol_info["site_url"]
         rewards[label]["data"][chain][protocol]["logo_url"] = protocol_info["logo_url"]
 
+    _add_claim_schedules(entity_name, rewards, default_apy, claim_fees)
+
     return rewards
 
 
+def position_apy(portfolio_item):
+    """The APY DeBank reports for a portfolio item (or its pool), if it has one"""
+    for d in [portfolio_item, portfolio_item.get("detail") or {}, portfolio_item.get("pool") or {}]:
+        for key in ["apy", "apr"]:
+            if d.get(key) is not None:
+                return float(d[key])
+    return None
+
+
+def _get_positions(entity_name):
+    sql = """SELECT balance_current.address, balance_current.chain, balance_current.protocol, balance_current.usd_value, balance_current.extra
+             FROM balance_current, address, entity
+             WHERE address.entity_id = entity.id
+             AND balance_current.address = address.address
+             AND entity.name = ?
+             AND balance_current.type IN ('deposit', 'lp')
+          """
+    positions = {}
+    for address, chain, protocol, usd_value, extra in db.query(sql, entity_name):
+        position = positions.setdefault((address, chain, protocol), {"principal": 0.0, "apy": None})
+        position["principal"] += float(usd_value or 0)
+        if position["apy"] is None and extra:
+            position["apy"] = position_apy(json.loads(extra))
+    return positions
+
+
+def _add_claim_schedules(entity_name, rewards, default_apy=None, claim_fees=None):
+    settings = setting(db)
+    if default_apy is None and settings.get("FARM_HELPER_APY"):
+        default_apy = float(settings["FARM_HELPER_APY"])
+    fees = {
+        **chain_claim_fee,
+        **json.loads(settings.get("FARM_HELPER_CLAIM_FEES") or "{}"),
+        **(claim_fees or {}),
+    }
+    positions = _get_positions(entity_name)
+
+    # Gather every position with a principal and an APY so we can solve them all in one batch
+    claimable = []
+    for label in rewards:
+        address = rewards[label]["address"]
+        for chain in rewards[label]["data"]:
+            for protocol, p in rewards[label]["data"][chain].items():
+                position = positions.get((address, chain, protocol), {"principal": 0.0, "apy": None})
+                apy = position["apy"] if position["apy"] is not None else default_apy
+                p["claim_schedule"] = None
+                if position["principal"] > 0 and apy:
+                    claimable.append((p, position["principal"], apy, float(fees.get(chain, DEFAULT_CLAIM_FEE))))
+
+    if not claimable:
+        return
+
+    schedules = get_claim_schedules(
+        [principal for _, principal, _, _ in claimable],
+        [apy for _, _, apy, _ in claimable],
+        [fee for _, _, _, fee in claimable],
+    )
+    for (p, _, apy, fee), schedule in zip(claimable, schedules):
+        # What the schedule assumed, so it can be checked against the position
+        p["claim_schedule"] = {**schedule, "apy": apy, "claim_fee_usd": fee}
+
+
+# Protocol details barely change so we keep them in memory for as long as the cache would
+PROTOCOL_DETAILS_TTL = 3600
+_protocol_details = {}
+
+
 def get_debank_protocol_details(id):
+    now = time.time()
+    if id in _protocol_details and now - _protocol_details[id][0] < PROTOCOL_DETAILS_TTL:
+        return _protocol_details[id][1]
+
     DEBANK_PROTOCOL_INFO_URL = f'https://openapi.debank.com/v1/protocol?&id={id}'
-    c = cache.get(DEBANK_PROTOCOL_INFO_URL, refresh_if=3600)
-    return json.loads(c['value'])
+    c = cache.get(DEBANK_PROTOCOL_INFO_URL, refresh_if=PROTOCOL_DETAILS_TTL)
+    details = json.loads(c['value'])
+    _protocol_details[id] = (now, details)
+    return details
 
 
 
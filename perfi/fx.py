@@ -0,0 +1,166 @@
+"""
+Fiat FX rates from the European Central Bank
+
+The ECB's reference rate history is stored in the fx_rates table (one row per currency per business day, as
+units of the currency per EUR) by update_fx_rates, which bin/update_fx_rates.py runs as a scheduled job. Lookups go
+through FxRates, which loads each currency's rates from the table once into sorted arrays.
+
+Conversions match what the CurrencyConverter lib gave us from the same file: days without a rate (weekends,
+holidays) are linearly interpolated between the closest business days either side, and dates outside a currency's
+history raise FxRateNotFound.
+"""
+import io
+import logging
+import pathlib
+import threading
+import zipfile
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+from .constants import paths
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ECB_HIST_URL = "https://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist.zip"
+ECB_CACHE_PATH = f"{paths.CACHE_DIR}/eurofxref-hist.zip"
+ECB_NA_VALUES = {"", "N/A"}
+REF_CURRENCY = "EUR"
+
+
+class FxRateNotFound(Exception):
+    pass
+
+
+def download_ecb_file(destination_file=ECB_CACHE_PATH):
+    response = httpx.get(ECB_HIST_URL)
+    metrics.inc("perfi_http_requests_total", host="www.ecb.europa.eu")
+    response.raise_for_status()
+    with open(destination_file, "wb") as f:
+        f.write(response.content)
+    logger.info(f"Updated {destination_file} with latest ECB rates file")
+
+
+def parse_ecb_file(content: bytes, after: Optional[str] = None):
+    """Yield (currency, day, rate) from an ECB history zip (or its CSV), only for days after `after` if given"""
+    if content[:2] == b"PK":
+        with zipfile.ZipFile(io.BytesIO(content)) as z:
+            content = z.read(z.namelist()[0])
+
+    lines = io.StringIO(content.decode("utf-8"))
+    currencies = [c.strip() for c in next(lines).strip().split(",")[1:]]
+    for line in lines:
+        values = line.strip().split(",")
+        day = values[0]
+        # Newest day first, so we can stop at what we already have
+        if after and day <= after:
+            break
+        for currency, rate in zip(currencies, values[1:]):
+            if currency and rate not in ECB_NA_VALUES:
+                yield currency, day, rate
+
+
+def update_fx_rates(db, ecb_file=None, download=True) -> int:
+    """
+    Append the days newer than what fx_rates already has. Reads ecb_file if given, otherwise downloads a fresh copy
+    of the ECB history to the cache dir (or uses the copy already there with download=False). Returns rows added.
+    """
+    if ecb_file is None:
+        ecb_file = ECB_CACHE_PATH
+        if download or not pathlib.Path(ecb_file).exists():
+            download_ecb_file(ecb_file)
+
+    latest = db.query("SELECT MAX(day) FROM fx_rates")[0][0]
+    rows = list(parse_ecb_file(pathlib.Path(ecb_file).read_bytes(), after=latest))
+    if rows:
+        sql = (
+            """INSERT OR REPLACE INTO fx_rates (currency, day, rate) VALUES (?, ?, ?)"""
+        )
+        db.execute_many(sql, rows)
+    logger.info(f"Added {len(rows)} fx rates after {latest}")
+    return len(rows)
+
+
+class FxRates:
+    def __init__(self, db, offline=False):
+        self.db = db
+        # Offline we never download the ECB file, only use the table or a cached copy of the file
+        self.offline = offline
+        self.lock = threading.Lock()
+        # currency -> (sorted day ordinals, rates per EUR)
+        self.rates: Dict[str, Tuple[array, List[Decimal]]] = {}
+        # currency -> newest day ordinal we've reloaded the table for, so days past the last ECB publish (e.g. today)
+        # only go back to the table once
+        self.checked: Dict[str, int] = {}
+
+    def _load(self, currency):
+        sql = """SELECT day, rate FROM fx_rates WHERE currency = ? ORDER BY day"""
+        rows = self.db.query(sql, currency)
+        if not rows and currency not in self.rates:
+            # Fresh installs won't have run the scheduled job yet
+            empty = self.db.query("SELECT COUNT(*) FROM fx_rates")[0][0] == 0
+            if empty and not (
+                self.offline and not pathlib.Path(ECB_CACHE_PATH).exists()
+            ):
+                update_fx_rates(self.db, download=False)
+                rows = self.db.query(sql, currency)
+        days = array("l", (date.fromisoformat(r["day"]).toordinal() for r in rows))
+        self.rates[currency] = (days, [Decimal(r["rate"]) for r in rows])
+
+    def rate(self, currency: str, day: date) -> Decimal:
+        """Units of currency per EUR on day"""
+        if currency == REF_CURRENCY:
+            return Decimal(1)
+
+        ordinal = day.toordinal()
+        with self.lock:
+            if currency not in self.rates:
+                self._load(currency)
+            days, rates = self.rates[currency]
+            # The table may have been appended to since we loaded it
+            if days and ordinal > days[-1] and ordinal > self.checked.get(currency, 0):
+                self._load(currency)
+                self.checked[currency] = ordinal
+                days, rates = self.rates[currency]
+
+        if not days or ordinal < days[0] or ordinal > days[-1]:
+            raise FxRateNotFound(f"No {currency} rate for {day}")
+
+        i = bisect_left(days, ordinal)
+        if days[i] == ordinal:
+            return rates[i]
+        # Same interpolation CurrencyConverter(fallback_on_missing_rate=True) used
+        d0 = ordinal - days[i - 1]
+        d1 = days[i] - ordinal
+        return (rates[i - 1] * d1 + rates[i] * d0) / (d0 + d1)
+
+    def convert(self, amount, from_currency: str, to_currency: str, epoch) -> Decimal:
+        day = datetime.fromtimestamp(epoch).date()
+        return (
+            Decimal(amount)
+            / self.rate(from_currency, day)
+            * self.rate(to_currency, day)
+        )
+
+    def convert_many(
+        self, conversions: Iterable[Tuple[Decimal, str, str, int]]
+    ) -> List[Decimal]:
+        """convert() for a batch of (amount, from_currency, to_currency, epoch), with each day's rate looked up once"""
+        rates = {}
+        results = []
+        for amount, from_currency, to_currency, epoch in conversions:
+            day = datetime.fromtimestamp(epoch).date()
+            for currency in (from_currency, to_currency):
+                if (currency, day) not in rates:
+                    rates[(currency, day)] = self.rate(currency, day)
+            results.append(
+                Decimal(amount)
+                / rates[(from_currency, day)]
+                * rates[(to_currency, day)]
+            )
+        return results
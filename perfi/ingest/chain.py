@@ -1,10 +1,13 @@
+import asyncio
 import json
 import logging
 import lzma
 import re
 import sys
+import threading
 import time
-from collections import namedtuple
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from decimal import Decimal
 from pprint import pprint, pformat
@@ -12,11 +15,16 @@ from pprint import pprint, pformat
 import arrow
 from bs4 import BeautifulSoup
 from lxml import etree, html
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+from playwright.async_api import (
+    async_playwright,
+    TimeoutError as PlaywrightTimeoutError,
+)
 from tqdm import tqdm
 
 from ..cache import cache, CacheGet404Exception
 from ..db import db
+from ..metrics import metrics
+from ..rpc import rpc_client
 from ..settings import setting
 
 logger = logging.getLogger(__name__)
@@ -232,7 +240,63 @@ def _etherscan_timestamp_to_epoch(timestamp):
         raise
 
 
+# Explorer detail pages fetched at once per host, across every fetcher in the process
+MAX_FETCHES_PER_HOST = 4
+TX_LINK_RE = re.compile(r"/tx/(0x[0-9a-fA-F]{64})")
+
+host_fetch_slots = defaultdict(lambda: threading.BoundedSemaphore(MAX_FETCHES_PER_HOST))
+host_fetch_slots_lock = threading.Lock()
+
+
+def _host_fetch_slot(host):
+    with host_fetch_slots_lock:
+        return host_fetch_slots[host]
+
+
 class TransactionsFetcher:
+    # Subclasses that scrape explorer HTML set this to the host their detail pages are on
+    DETAILS_HOST = None
+
+    def _parse_html(self, value):
+        # lxml's HTML parser copes with explorer markup itself, so pages are parsed once (no BeautifulSoup pass first)
+        return html.fromstring(value)
+
+    def _prefetch_transaction_details(self, doc):
+        """
+        Fetch and parse the detail page of every tx linked from an index page's tables concurrently, so the
+        per-row loop doesn't pay one round-trip per tx. lxml releases the GIL while parsing, so threads overlap
+        parsing as well as fetching. Anything that fails here is left for _get_transaction_details to retry (and
+        raise) in the loop like before.
+        """
+        self.prefetched_details = {}
+        hashes = []
+        for href in doc.xpath("//table//a/@href"):
+            m = TX_LINK_RE.search(href)
+            if m and m.group(1) not in hashes:
+                hashes.append(m.group(1))
+        if not hashes:
+            return
+
+        slot = _host_fetch_slot(self.DETAILS_HOST or type(self).__name__)
+
+        def scrape(hash):
+            with slot:
+                try:
+                    return hash, self._scrape_transaction_details(hash)
+                except Exception:
+                    return hash, None
+
+        with ThreadPoolExecutor(max_workers=MAX_FETCHES_PER_HOST) as executor:
+            for hash, tx_details in executor.map(scrape, hashes):
+                if tx_details is not None:
+                    self.prefetched_details[hash] = tx_details
+
+    def _get_transaction_details(self, hash):
+        prefetched = getattr(self, "prefetched_details", {})
+        if hash.strip() in prefetched:
+            return prefetched[hash.strip()]
+        return self._scrape_transaction_details(hash)
+
     def _log_tx(self, tx):
         """
         The goal would be to be able to log details like a timestamp for a tx after it was fetched
@@ -244,6 +308,8 @@ class TransactionsFetcher:
 
 class EtherscanTransactionsFetcher(TransactionsFetcher):
     # CONSIDER: should we use xpath selectors (more powerful) or switch to css selectors (more familiar to devs)?
+    DETAILS_HOST = "etherscan.io"
+
     def __init__(self, db=None):
         self.db = db
         self.ETHERSCAN_KEY = setting(self.db).get("ETHERSCAN_KEY")
@@ -376,8 +442,8 @@ class EtherscanTransactionsFetcher(TransactionsFetcher):
                 page_num,
             )
             c = cache.get(URL, REFRESH_INDEXES)
-            soup = BeautifulSoup(c["value"], "html.parser")
-            doc = html.fromstring(str(soup))
+            doc = self._parse_html(c["value"])
+            self._prefetch_transaction_details(doc)
             tx_rows = doc.xpath('//*[@id="paywall_mask"]/table/tbody/tr')
             for tx_row in tx_rows:
                 if "There are no matching entries" in tx_row.text_content():
@@ -416,7 +482,7 @@ class EtherscanTransactionsFetcher(TransactionsFetcher):
                     txn_dict["timestamp"]
                 )
 
-                tx_details = self._scrape_transaction_details(txn_dict["hash"])
+                tx_details = self._get_transaction_details(txn_dict["hash"])
                 txn_dict["details"] = tx_details
 
                 txn_dict["fee"] = tx_details["fee"]
@@ -441,8 +507,8 @@ class EtherscanTransactionsFetcher(TransactionsFetcher):
                 % (address, page_num)
             )
             c = cache.get(URL, REFRESH_INDEXES)
-            soup = BeautifulSoup(c["value"], "html.parser")
-            doc = html.fromstring(str(soup))
+            doc = self._parse_html(c["value"])
+            self._prefetch_transaction_details(doc)
             tx_rows = doc.xpath(
                 '//div[contains(@class, "table-responsive")]/table/tbody/tr'
             )
@@ -483,7 +549,7 @@ class EtherscanTransactionsFetcher(TransactionsFetcher):
                     txn_dict["timestamp"]
                 )
 
-                tx_details = self._scrape_transaction_details(txn_dict["parent_hash"])
+                tx_details = self._get_transaction_details(txn_dict["parent_hash"])
                 txn_dict["details"] = tx_details
                 txn_dict["value"] = tx_details["value"]
                 txn_dict["block"] = tx_details["block"]
@@ -507,8 +573,8 @@ class EtherscanTransactionsFetcher(TransactionsFetcher):
                 page_num,
             )
             c = cache.get(URL, REFRESH_INDEXES)
-            soup = BeautifulSoup(c["value"], "html.parser")
-            doc = html.fromstring(str(soup))
+            doc = self._parse_html(c["value"])
+            self._prefetch_transaction_details(doc)
             tx_rows = doc.xpath(
                 '//div[div[@id="ContentPlaceHolder1_divTopPagination"]]//table//tbody/tr'
             )
@@ -567,7 +633,7 @@ class EtherscanTransactionsFetcher(TransactionsFetcher):
                 txn_dict["_epoch_timestamp"] = _etherscan_timestamp_to_epoch(
                     txn_dict["timestamp"]
                 )
-                tx_details = self._scrape_transaction_details(txn_dict["hash"])
+                tx_details = self._get_transaction_details(txn_dict["hash"])
                 txn_dict["details"] = tx_details
                 txn_dict["fee"] = tx_details["fee"]
                 txn_dict["gas_price"] = tx_details["gas_price"]
@@ -589,8 +655,8 @@ class EtherscanTransactionsFetcher(TransactionsFetcher):
                 page_num,
             )
             c = cache.get(URL, REFRESH_INDEXES)
-            soup = BeautifulSoup(c["value"], "html.parser")
-            doc = html.fromstring(str(soup))
+            doc = self._parse_html(c["value"])
+            self._prefetch_transaction_details(doc)
             tx_rows = doc.xpath("//div//table//tbody/tr")
             for tx_row in tx_rows:
                 if "There are no matching entries" in tx_row.text_content():
@@ -635,7 +701,7 @@ class EtherscanTransactionsFetcher(TransactionsFetcher):
                 self._log_tx(txn_dict)
                 transactions.append(txn_dict)
 
-                tx_details = self._scrape_transaction_details(txn_dict["hash"])
+                tx_details = self._get_transaction_details(txn_dict["hash"])
                 txn_dict["details"] = tx_details
                 txn_dict["fee"] = tx_details["fee"]
                 txn_dict["gas_price"] = tx_details["gas_price"]
@@ -728,6 +794,8 @@ class EtherscanTransactionsFetcher(TransactionsFetcher):
 
 
 class AvalancheTransactionsFetcher(TransactionsFetcher):
+    DETAILS_HOST = "snowtrace.io"
+
     def __init__(self, db=None):
         self.db = db
         self.SNOWTRACE_KEY = setting(self.db).get("SNOWTRACE_KEY")
@@ -740,8 +808,8 @@ class AvalancheTransactionsFetcher(TransactionsFetcher):
         while has_tx_rows:
             URL = "https://snowtrace.io/txs?a=%s&p=%s" % (address, page_num)
             c = cache.get(URL, REFRESH_INDEXES)
-            soup = BeautifulSoup(c["value"], "html.parser")
-            doc = html.fromstring(str(soup))
+            doc = self._parse_html(c["value"])
+            self._prefetch_transaction_details(doc)
             tx_rows = doc.xpath('//*[@id="paywall_mask"]/table/tbody/tr')
             for tx_row in tx_rows:
                 if "There are no matching entries" in tx_row.text_content():
@@ -778,7 +846,7 @@ class AvalancheTransactionsFetcher(TransactionsFetcher):
                 txn_dict["_type"] = "normal"
                 # txn_dict['_epoch_timestamp'] = _etherscan_timestamp_to_epoch(txn_dict['timestamp'])
 
-                tx_details = self._scrape_transaction_details(txn_dict["hash"])
+                tx_details = self._get_transaction_details(txn_dict["hash"])
                 txn_dict["details"] = tx_details
 
                 txn_dict["value"] = tx_details["value"]
@@ -919,8 +987,8 @@ class AvalancheTransactionsFetcher(TransactionsFetcher):
         while has_tx_rows:
             URL = "https://snowtrace.io/txsInternal?a=%s&p=%s" % (address, page_num)
             c = cache.get(URL, REFRESH_INDEXES)
-            soup = BeautifulSoup(c["value"], "html.parser")
-            doc = html.fromstring(str(soup))
+            doc = self._parse_html(c["value"])
+            self._prefetch_transaction_details(doc)
             tx_rows = doc.xpath(
                 '//div[contains(@class, "table-responsive")]/table/tbody/tr'
             )
@@ -954,7 +1022,7 @@ class AvalancheTransactionsFetcher(TransactionsFetcher):
 
                 txn_dict["_type"] = "internal"
 
-                tx_details = self._scrape_transaction_details(txn_dict["parent_hash"])
+                tx_details = self._get_transaction_details(txn_dict["parent_hash"])
                 txn_dict["details"] = tx_details
                 txn_dict["value"] = tx_details["value"]
                 txn_dict["block"] = tx_details["block"]
@@ -977,8 +1045,8 @@ class AvalancheTransactionsFetcher(TransactionsFetcher):
         while has_tx_rows:
             URL = "https://snowtrace.io/tokentxns?a=%s&p=%s" % (address, page_num)
             c = cache.get(URL, REFRESH_INDEXES)
-            soup = BeautifulSoup(c["value"], "html.parser")
-            doc = html.fromstring(str(soup))
+            doc = self._parse_html(c["value"])
+            self._prefetch_transaction_details(doc)
             tx_rows = doc.xpath(
                 '//div[contains(@class, "table-responsive")]//table//tbody/tr'
             )
@@ -1034,7 +1102,7 @@ class AvalancheTransactionsFetcher(TransactionsFetcher):
                         )
 
                 txn_dict["_type"] = "token"
-                tx_details = self._scrape_transaction_details(txn_dict["hash"])
+                tx_details = self._get_transaction_details(txn_dict["hash"])
                 txn_dict["details"] = tx_details
 
                 # TODO: Snowscan has unreliable output for value/block/timestamp rows on the index pages
@@ -1060,8 +1128,8 @@ class AvalancheTransactionsFetcher(TransactionsFetcher):
         while has_tx_rows:
             URL = "https://snowtrace.io/tokentxns-nft?a=%s&p=%s" % (address, page_num)
             c = cache.get(URL, REFRESH_INDEXES)
-            soup = BeautifulSoup(c["value"], "html.parser")
-            doc = html.fromstring(str(soup))
+            doc = self._parse_html(c["value"])
+            self._prefetch_transaction_details(doc)
             tx_rows = doc.xpath("//div//table//tbody/tr")
             for tx_row in tx_rows:
                 if "There are no matching entries" in tx_row.text_content():
@@ -1097,7 +1165,7 @@ class AvalancheTransactionsFetcher(TransactionsFetcher):
                 self._log_tx(txn_dict)
                 transactions.append(txn_dict)
 
-                tx_details = self._scrape_transaction_details(txn_dict["hash"])
+                tx_details = self._get_transaction_details(txn_dict["hash"])
                 txn_dict["details"] = tx_details
 
                 txn_dict["value"] = tx_details["value"]
@@ -1140,6 +1208,8 @@ class AvalancheTransactionsFetcher(TransactionsFetcher):
 
 
 class PolygonTransactionsFetcher(TransactionsFetcher):
+    DETAILS_HOST = "polygonscan.com"
+
     def __init__(self, db=None):
         self.db = db
 
@@ -1151,8 +1221,8 @@ class PolygonTransactionsFetcher(TransactionsFetcher):
         while has_tx_rows:
             URL = "https://polygonscan.com/txs?a=%s&p=%s" % (address, page_num)
             c = cache.get(URL, REFRESH_INDEXES)
-            soup = BeautifulSoup(c["value"], "html.parser")
-            doc = html.fromstring(str(soup))
+            doc = self._parse_html(c["value"])
+            self._prefetch_transaction_details(doc)
             tx_rows = doc.xpath('//*[@id="paywall_mask"]/table/tbody/tr')
             for tx_row in tx_rows:
                 if "There are no matching entries" in tx_row.text_content():
@@ -1191,7 +1261,7 @@ class PolygonTransactionsFetcher(TransactionsFetcher):
                     txn_dict["timestamp"]
                 )
 
-                tx_details = self._scrape_transaction_details(txn_dict["hash"])
+                tx_details = self._get_transaction_details(txn_dict["hash"])
                 txn_dict["details"] = tx_details
 
                 txn_dict["fee"] = tx_details["fee"]
@@ -1321,8 +1391,8 @@ class PolygonTransactionsFetcher(TransactionsFetcher):
         while has_tx_rows:
             URL = "https://polygonscan.com/txsInternal?a=%s&p=%s" % (address, page_num)
             c = cache.get(URL, REFRESH_INDEXES)
-            soup = BeautifulSoup(c["value"], "html.parser")
-            doc = html.fromstring(str(soup))
+            doc = self._parse_html(c["value"])
+            self._prefetch_transaction_details(doc)
             tx_rows = doc.xpath(
                 '//div[contains(@class, "table-responsive")]/table/tbody/tr'
             )
@@ -1365,7 +1435,7 @@ class PolygonTransactionsFetcher(TransactionsFetcher):
 
                 txn_dict["_type"] = "internal"
 
-                tx_details = self._scrape_transaction_details(txn_dict["parent_hash"])
+                tx_details = self._get_transaction_details(txn_dict["parent_hash"])
                 txn_dict["details"] = tx_details
                 txn_dict["value"] = tx_details["value"]
                 txn_dict["block"] = tx_details["block"]
@@ -1389,8 +1459,8 @@ class PolygonTransactionsFetcher(TransactionsFetcher):
         while has_tx_rows:
             URL = "https://polygonscan.com/tokentxns?a=%s&p=%s" % (address, page_num)
             c = cache.get(URL, REFRESH_INDEXES)
-            soup = BeautifulSoup(c["value"], "html.parser")
-            doc = html.fromstring(str(soup))
+            doc = self._parse_html(c["value"])
+            self._prefetch_transaction_details(doc)
             tx_rows = doc.xpath(
                 '//div[contains(@class, "table-responsive")]//table//tbody/tr'
             )
@@ -1446,7 +1516,7 @@ class PolygonTransactionsFetcher(TransactionsFetcher):
                         )
 
                 txn_dict["_type"] = "token"
-                tx_details = self._scrape_transaction_details(txn_dict["hash"])
+                tx_details = self._get_transaction_details(txn_dict["hash"])
                 txn_dict["details"] = tx_details
                 txn_dict["value"] = tx_details["value"]
                 txn_dict["block"] = tx_details["block"]
@@ -1474,8 +1544,8 @@ class PolygonTransactionsFetcher(TransactionsFetcher):
                 page_num,
             )
             c = cache.get(URL, REFRESH_INDEXES)
-            soup = BeautifulSoup(c["value"], "html.parser")
-            doc = html.fromstring(str(soup))
+            doc = self._parse_html(c["value"])
+            self._prefetch_transaction_details(doc)
             tx_rows = doc.xpath("//div//table//tbody/tr")
             for tx_row in tx_rows:
                 if "There are no matching entries" in tx_row.text_content():
@@ -1515,7 +1585,7 @@ class PolygonTransactionsFetcher(TransactionsFetcher):
 
                 txn_dict["_type"] = "nft"
 
-                tx_details = self._scrape_transaction_details(txn_dict["hash"])
+                tx_details = self._get_transaction_details(txn_dict["hash"])
                 txn_dict["details"] = tx_details
                 txn_dict["value"] = tx_details["value"]
                 txn_dict["block"] = tx_details["block"]
@@ -1565,6 +1635,8 @@ class PolygonTransactionsFetcher(TransactionsFetcher):
 
 
 class FantomTransactionsFetcher(TransactionsFetcher):
+    DETAILS_HOST = "ftmscan.com"
+
     def __init__(self, db=None):
         self.db = db
 
@@ -1578,8 +1650,8 @@ class FantomTransactionsFetcher(TransactionsFetcher):
             try:
                 URL = "https://ftmscan.com/txs?a=%s&p=%s" % (address, page_num)
                 c = cache.get(URL, REFRESH_INDEXES)
-                soup = BeautifulSoup(c["value"], "html.parser")
-                doc = html.fromstring(str(soup))
+                doc = self._parse_html(c["value"])
+                self._prefetch_transaction_details(doc)
                 tx_rows = doc.xpath('//*[@id="paywall_mask"]/table/tbody/tr')
                 for tx_row in tx_rows:
                     if "There are no matching entries" in tx_row.text_content():
@@ -1617,7 +1689,7 @@ class FantomTransactionsFetcher(TransactionsFetcher):
                         txn_dict["timestamp"]
                     )
 
-                    tx_details = self._scrape_transaction_details(txn_dict["hash"])
+                    tx_details = self._get_transaction_details(txn_dict["hash"])
                     txn_dict["details"] = tx_details
 
                     txn_dict["fee"] = tx_details["fee"]
@@ -1750,8 +1822,8 @@ class FantomTransactionsFetcher(TransactionsFetcher):
         while has_tx_rows:
             URL = "https://ftmscan.com/txsInternal?a=%s&p=%s" % (address, page_num)
             c = cache.get(URL, REFRESH_INDEXES)
-            soup = BeautifulSoup(c["value"], "html.parser")
-            doc = html.fromstring(str(soup))
+            doc = self._parse_html(c["value"])
+            self._prefetch_transaction_details(doc)
             tx_rows = doc.xpath(
                 '//div[contains(@class, "table-responsive")]/table/tbody/tr'
             )
@@ -1794,7 +1866,7 @@ class FantomTransactionsFetcher(TransactionsFetcher):
 
                 txn_dict["_type"] = "internal"
 
-                tx_details = self._scrape_transaction_details(txn_dict["parent_hash"])
+                tx_details = self._get_transaction_details(txn_dict["parent_hash"])
                 txn_dict["details"] = tx_details
                 txn_dict["value"] = tx_details["value"]
                 txn_dict["block"] = tx_details["block"]
@@ -1817,8 +1889,8 @@ class FantomTransactionsFetcher(TransactionsFetcher):
         while has_tx_rows:
             URL = "https://ftmscan.com/tokentxns?a=%s&p=%s" % (address, page_num)
             c = cache.get(URL, REFRESH_INDEXES)
-            soup = BeautifulSoup(c["value"], "html.parser")
-            doc = html.fromstring(str(soup))
+            doc = self._parse_html(c["value"])
+            self._prefetch_transaction_details(doc)
             tx_rows = doc.xpath(
                 '//div[contains(@class, "table-responsive")]//table//tbody/tr'
             )
@@ -1878,7 +1950,7 @@ class FantomTransactionsFetcher(TransactionsFetcher):
                     txn_dict["timestamp"]
                 )
 
-                tx_details = self._scrape_transaction_details(txn_dict["hash"])
+                tx_details = self._get_transaction_details(txn_dict["hash"])
                 txn_dict["details"] = tx_details
                 txn_dict["fee"] = tx_details["fee"]
                 txn_dict["gas_price"] = tx_details["gas_price"]
@@ -1898,8 +1970,8 @@ class FantomTransactionsFetcher(TransactionsFetcher):
         while has_tx_rows:
             URL = "https://ftmscan.com/tokentxns-nft?a=%s&p=%s" % (address, page_num)
             c = cache.get(URL, REFRESH_INDEXES)
-            soup = BeautifulSoup(c["value"], "html.parser")
-            doc = html.fromstring(str(soup))
+            doc = self._parse_html(c["value"])
+            self._prefetch_transaction_details(doc)
             tx_rows = doc.xpath("//div//table//tbody/tr")
             for tx_row in tx_rows:
                 try:
@@ -1938,7 +2010,7 @@ class FantomTransactionsFetcher(TransactionsFetcher):
                         txn_dict["timestamp"]
                     )
 
-                    tx_details = self._scrape_transaction_details(txn_dict["hash"])
+                    tx_details = self._get_transaction_details(txn_dict["hash"])
                     txn_dict["fee"] = tx_details["fee"]
                     txn_dict["gas_price"] = tx_details["gas_price"]
                     txn_dict["details"] = tx_details
@@ -2008,7 +2080,8 @@ class DeBankTransactionsFetcher:
             "AccessKey": self.DEBANK_KEY,
         }
 
-    def scrape_history(self, address):
+    def scrape_history(self, address, since=0):
+        """History is paged newest first, so with since set we stop after the page that reaches back to it"""
         fetch_more = True
         transactions = []
         projects = {}
@@ -2063,6 +2136,8 @@ class DeBankTransactionsFetcher:
 
             if len(j["history_list"]) == 0:
                 fetch_more = False
+            elif since and start_time <= since:
+                fetch_more = False
 
         for t in transactions:
             t["_source"] = "debank"
@@ -2073,12 +2148,34 @@ class DeBankTransactionsFetcher:
         return transactions
 
 
+# Address pages the browser pool scrapes at once
+MAX_BROWSER_PAGES = 4
+DEBANK_HISTORY_API_URL = "https://api.debank.com/history/list"
+LOAD_MORE_SELECTOR = "button:has-text('Load More')"
+
+
+def history_response_done(response, until_epoch=0):
+    """Whether a captured history/list response is the last page we need"""
+    try:
+        history_list = json.loads(response)["data"]["history_list"]
+    except Exception:
+        return False
+    if not history_list:
+        return True
+    if until_epoch:
+        return any(tx.get("time_at", 0) <= until_epoch for tx in history_list)
+    return False
+
+
 class DeBankBrowserTransactionsFetcher:
-    def __init__(self, db=None, headless: bool = True):
+    def __init__(self, db=None, headless: bool = True, max_pages=MAX_BROWSER_PAGES):
         self.db = db
         self.headless = headless
+        self.max_pages = max_pages
+        # address -> captured history responses, filled by prefetch_histories()
+        self.prefetched_responses = {}
 
-    def scrape_history(self, address, until_date=None):
+    def scrape_history(self, address, until_date=None, since=0):
         transactions = []
         projects = {}
         tokens = {}
@@ -2090,8 +2187,14 @@ class DeBankBrowserTransactionsFetcher:
             until_epoch = arrow.get(until_date).timestamp()
         except:
             until_epoch = 0
+        if since:
+            until_epoch = since
+
+        responses = self.prefetched_responses.pop(address, None)
+        if responses is None:
+            responses = self.scrape_all_history_responses(address, until_epoch)
 
-        for history_response in self.scrape_all_history_responses(address, until_epoch):
+        for history_response in responses:
             if not history_response:
                 print("Empty Response, moving on...")
                 # DeBank Browser Scraping API can just decide to stop...
@@ -2143,75 +2246,121 @@ class DeBankBrowserTransactionsFetcher:
 
         return transactions
 
+    def prefetch_histories(self, until_epochs):
+        """
+        Scrape the history of several addresses ({address: until_epoch}) at once in one browser. Addresses that fail
+        are logged and left out, so scrape_history falls back to scraping them on their own.
+        """
+        if not until_epochs:
+            return
+        results, errors = asyncio.run(self._scrape_histories(until_epochs))
+        for address, err in errors.items():
+            logger.error(
+                f"Prefetching DeBank history for {address} failed, it will be scraped on its own",
+                exc_info=err,
+            )
+        self.prefetched_responses.update(results)
+
     def scrape_all_history_responses(self, address, until_epoch=0):
+        results, errors = asyncio.run(self._scrape_histories({address: until_epoch}))
+        if address in errors:
+            raise errors[address]
+        return results[address]
+
+    async def _scrape_histories(self, until_epochs):
+        """({address: responses}, {address: exception}) for every address scraped"""
+        # One Chromium for every address, each in its own context, max_pages at a time
+        slots = asyncio.Semaphore(self.max_pages)
+
+        async with async_playwright() as playwright:
+            browser = await playwright.chromium.launch(headless=self.headless)
+
+            async def scrape(address, until_epoch):
+                async with slots:
+                    return address, await self._scrape_history_responses(
+                        browser, address, until_epoch
+                    )
+
+            try:
+                # One address failing (a timeout, a crashed page) mustn't throw away everyone else's responses
+                outcomes = await asyncio.gather(
+                    *[scrape(a, e) for a, e in until_epochs.items()],
+                    return_exceptions=True,
+                )
+            finally:
+                await browser.close()
+
+        results, errors = {}, {}
+        for address, outcome in zip(until_epochs, outcomes):
+            if isinstance(outcome, BaseException):
+                errors[address] = outcome
+            else:
+                results[address] = outcome[1]
+        return results, errors
+
+    async def _scrape_history_responses(self, browser, address, until_epoch=0):
         url = f"https://debank.com/profile/{address}/history"
-        url_to_capture = "https://api.debank.com/history/list"
         responses: list[str] = []
 
-        with sync_playwright() as playwright:
-            browser = playwright.chromium.launch(headless=self.headless)
-            context = browser.new_context()
-            page = context.new_page()
+        def is_history_response(r):
+            return r.url.startswith(DEBANK_HISTORY_API_URL)
+
+        context = await browser.new_context()
+        try:
+            page = await context.new_page()
 
-            print("Getting History...")
+            print(f"Getting History for {address}...")
             try:
-                with page.expect_response(
-                    lambda r: r.url.startswith(url_to_capture), timeout=30000
+                async with page.expect_response(
+                    is_history_response, timeout=30000
                 ) as resp_info:
-                    page.goto(url, wait_until="domcontentloaded")
-                responses.append(resp_info.value.text())
+                    await page.goto(url, wait_until="domcontentloaded")
+                responses.append(await (await resp_info.value).text())
             except PlaywrightTimeoutError:
-                page.goto(url, wait_until="domcontentloaded")
-
-            while True:
-                if until_epoch and responses:
-                    try:
-                        j = json.loads(responses[-1])
-                        for tx in j.get("data", {}).get("history_list", []):
-                            if tx.get("time_at", 0) <= until_epoch:
-                                print("Stopping at until_epoch")
-                                context.close()
-                                browser.close()
-                                return responses
-                    except Exception:
-                        pass
-
-                button = page.query_selector("button:has-text('Load More')")
-                if not button:
+                await page.goto(url, wait_until="domcontentloaded")
+
+            while not (responses and history_response_done(responses[-1], until_epoch)):
+                # The button is re-rendered once the last page lands, so wait for it rather than sleeping
+                try:
+                    button = await page.wait_for_selector(
+                        LOAD_MORE_SELECTOR, state="visible", timeout=10000
+                    )
+                except PlaywrightTimeoutError:
                     break
 
-                print("Fetching more...")
+                print(f"Fetching more for {address}...")
                 try:
-                    with page.expect_response(
-                        lambda r: r.url.startswith(url_to_capture), timeout=30000
+                    async with page.expect_response(
+                        is_history_response, timeout=30000
                     ) as resp_info:
-                        button.click()
-                    responses.append(resp_info.value.text())
+                        await button.click()
+                    responses.append(await (await resp_info.value).text())
                 except PlaywrightTimeoutError:
                     break
-
-                page.wait_for_timeout(2000)
-
-            context.close()
-            browser.close()
+        finally:
+            await context.close()
 
         return responses
 
 
 class TransactionsUnifier:
-    def __init__(self, chain, address):
+    def __init__(self, chain, address, since=0, debank=None):
         self.etherscan = EtherscanTransactionsFetcher(db)
         self.avalanche = AvalancheTransactionsFetcher(db)
         self.polygon = PolygonTransactionsFetcher(db)
         self.fantom = FantomTransactionsFetcher(db)
 
-        if setting(db).get("DEBANK_KEY"):
+        if debank:
+            self.debank = debank
+        elif setting(db).get("DEBANK_KEY"):
             self.debank = DeBankTransactionsFetcher(db)
         else:
             self.debank = DeBankBrowserTransactionsFetcher()
 
         self.chain = chain
         self.address = address
+        # Only fetch history back to this epoch (0 fetches everything)
+        self.since = since
 
     def all_transactions(self):
         # TODO: as we support ingesting from more chains, add them in here.
@@ -2234,7 +2383,7 @@ class TransactionsUnifier:
             # self.fantom.scrape_internal_transactions(self.address),
             # self.fantom.scrape_token_transactions(self.address),
             # self.fantom.scrape_nft_transactions(self.address),
-            self.debank.scrape_history(self.address),
+            self.debank.scrape_history(self.address, since=self.since),
         ]
         flattened_txs = []
         for sublist in txns:
@@ -2352,7 +2501,7 @@ def write_to_file(unified_transactions, filename):
             )
 
 
-def save_to_db(unified_transactions):
+def save_to_db(unified_transactions, progress=True):
     # TODO: consider combining into one (or chunk to multiple) transactions for speed
     sql = """REPLACE INTO tx_chain
              (chain, address, hash, timestamp, raw_data_lzma)
@@ -2360,31 +2509,67 @@ def save_to_db(unified_transactions):
              (?, ?, ?, ?, ?)
           """
     items_params = []
-    for hash in tqdm(unified_transactions, desc="Saving unified txs to db"):
+    for hash in tqdm(
+        unified_transactions,
+        desc="Saving unified txs to db",
+        disable=None if progress else True,
+    ):
+        tx = unified_transactions[hash]
+        raw_data_json = json.dumps(
+            tx, cls=MyEncoder, indent=4, sort_keys=True, ensure_ascii=False
+        ).encode("utf8")
+        lzmac = lzma.LZMACompressor()
+        raw_data_lzma = lzmac.compress(raw_data_json)
+        raw_data_lzma += lzmac.flush()
+
+        params = [
+            tx["chain"],
+            tx["address"],
+            tx["hash"],
+            tx["timestamp"],
+            raw_data_lzma,
+        ]
+        items_params.append(params)
         if len(items_params) == 1000:
             db.execute_many(sql, items_params)
             items_params = []
-        else:
-            tx = unified_transactions[hash]
-            raw_data_json = json.dumps(
-                tx, cls=MyEncoder, indent=4, sort_keys=True, ensure_ascii=False
-            ).encode("utf8")
-            lzmac = lzma.LZMACompressor()
-            raw_data_lzma = lzmac.compress(raw_data_json)
-            raw_data_lzma += lzmac.flush()
-
-            params = [
-                tx["chain"],
-                tx["address"],
-                tx["hash"],
-                tx["timestamp"],
-                raw_data_lzma,
-            ]
-            items_params.append(params)
-    db.execute_many(sql, items_params)
-
-
-def scrape_entity_transactions(entity_name):
+    if items_params:
+        db.execute_many(sql, items_params)
+
+
+# Incremental syncs re-fetch this far back from the newest stored tx to pick up late indexed txs
+INCREMENTAL_SYNC_OVERLAP = 24 * 60 * 60
+
+
+def get_sync_since(address, overlap=INCREMENTAL_SYNC_OVERLAP):
+    """Epoch an incremental sync of address has to fetch back to, or 0 if nothing is stored for it yet"""
+    sql = """SELECT MAX(timestamp) FROM tx_chain WHERE address = ?"""
+    newest = db.query(sql, address)[0][0]
+    if not newest:
+        return 0
+    return max(int(newest) - overlap, 1)
+
+
+def load_tx_chain_raw(chain, address, hash):
+    sql = """SELECT raw_data_lzma FROM tx_chain WHERE chain = ? AND address = ? AND hash = ?"""
+    r = db.query(sql, [chain, address, hash])
+    if not r:
+        return None
+    return json.loads(lzma.LZMADecompressor().decompress(r[0][0]))
+
+
+def merge_with_saved(unified_transactions):
+    """Re-fetched txs keep whatever sources they were saved with that this fetch didn't return"""
+    for ut in unified_transactions.values():
+        saved = load_tx_chain_raw(ut["chain"], ut["address"], ut["hash"])
+        if saved:
+            saved.update(ut)
+            ut.update(saved)
+    return unified_transactions
+
+
+@metrics.timed_stage("ingest")
+def scrape_entity_transactions(entity_name, incremental=False):
     print(f"Entity: {entity_name}")
     print("---")
     # Get List of Accounts
@@ -2396,6 +2581,21 @@ def scrape_entity_transactions(entity_name):
            ORDER BY ord, label
         """
     results = db.query(sql, entity_name)
+    sinces = {
+        wallet[2]: get_sync_since(wallet[2]) if incremental else 0 for wallet in results
+    }
+
+    debank = None
+    if not setting(db).get("DEBANK_KEY"):
+        # Without the API we scrape, so get every wallet's history in one go with a shared browser
+        debank = DeBankBrowserTransactionsFetcher()
+        debank.prefetch_histories(
+            {
+                address: sinces[address]
+                for _, chain, address in results
+                if chain == "ethereum"
+            }
+        )
 
     for wallet in results:
         label = wallet[0]
@@ -2403,8 +2603,13 @@ def scrape_entity_transactions(entity_name):
         address = wallet[2]
 
         print(f"Processsing {label} ({chain}: {address} )")
-        tu = TransactionsUnifier(chain, address)
+        since = sinces[address]
+        if since:
+            print(f"Syncing txs since {arrow.get(since).isoformat()}")
+        tu = TransactionsUnifier(chain, address, since=since, debank=debank)
         unifieds = tu.unified_transactions()
+        if since:
+            unifieds = merge_with_saved(unifieds)
 
         save_to_db(unifieds)
 
@@ -2466,35 +2671,13 @@ def get_covalent_tx(api_key, chain_id_or_name, hash):
 def get_harmony_tx(hash):
     """Harmony API Docs https://documenter.getpostman.com/view/6221615/Szt7BB28#ff4b8f6a-7723-472c-97e3-06c4221de383"""
 
-    # Common URL and Headers
-    url = "https://api.s0.t.hmny.io"
-    headers = {"Content-Type": "application/json"}
-
-    # Get to/from/gas_price from the Transaction
-    data = {
-        "jsonrpc": "2.0",
-        "method": "hmyv2_getTransactionByHash",
-        "params": [hash],
-        "id": 1,
-    }
-    j = json.loads(
-        cache.get_v2(url, method="POST", headers=headers, data=data)["value"]
-    )["result"]
-    gas_price = j["gasPrice"]
-    to_address = j["to"]
-    from_address = j["from"]
-
-    # Get gas_used from the Receipt
-    data = {
-        "jsonrpc": "2.0",
-        "method": "hmyv2_getTransactionReceipt",
-        "params": [hash],
-        "id": 1,
-    }
-    j = json.loads(
-        cache.get_v2(url, method="POST", headers=headers, data=data)["value"]
-    )["result"]
-    gas_used = j["gasUsed"]
+    # The tx has to/from/gas_price and the receipt has gas_used, both come back in one batch request
+    found = rpc_client("harmony").lookup([hash])[hash.strip()]
+    tx = found["tx"]
+    gas_price = tx["gasPrice"]
+    to_address = tx["to"]
+    from_address = tx["from"]
+    gas_used = found["receipt"]["gasUsed"]
 
     # Return a result with the keys care about
     return dict(
@@ -2511,35 +2694,13 @@ def get_optimism_tx(hash):
     Optimism API via Alchemy: https://docs.alchemy.com/alchemy/apis/optimism-api
     """
 
-    # Common URL and Headers
-    url = f"https://opt-mainnet.g.alchemy.com/v2/{setting['ALCHEMY_KEY']}"
-    headers = {"Content-Type": "application/json"}
-
-    # Get to/from/gas_price from the Transaction
-    data = {
-        "jsonrpc": "2.0",
-        "method": "eth_getTransactionByHash",
-        "params": [hash],
-        "id": 0,
-    }
-    j = json.loads(
-        cache.get_v2(url, method="POST", headers=headers, data=data)["value"]
-    )["result"]
-    to_address = j["to"]
-    from_address = j["from"]
-    gas_price = int(j["gas"], 16)
-
-    # Get gas_used from the Receipt
-    data = {
-        "jsonrpc": "2.0",
-        "method": "eth_getTransactionReceipt",
-        "params": [hash],
-        "id": 0,
-    }
-    j = json.loads(
-        cache.get_v2(url, method="POST", headers=headers, data=data)["value"]
-    )["result"]
-    gas_used = int(j["gasUsed"], 16)
+    # The tx has to/from/gas_price and the receipt has gas_used, both come back in one batch request
+    found = rpc_client("optimism").lookup([hash])[hash.strip()]
+    tx = found["tx"]
+    to_address = tx["to"]
+    from_address = tx["from"]
+    gas_price = int(tx["gas"], 16)
+    gas_used = int(found["receipt"]["gasUsed"], 16)
 
     # Return a result with the keys care about
     # TODO - this doesn't look right. Optimism has L1 and L2 fees. What do we do here?
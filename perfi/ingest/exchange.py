@@ -1,13 +1,20 @@
 import csv
+import hashlib
 import io
+import itertools
+import json
+import os
 import re
+from datetime import datetime, timezone
 from decimal import Decimal
 
 import arrow
 import openpyxl
+from tqdm import tqdm
 
 from .chain import save_to_db
 from ..constants.assets import FIAT_SYMBOLS
+from ..constants.paths import CACHE_DIR
 from ..price import PriceFeed
 
 price_feed = PriceFeed()
@@ -21,7 +28,9 @@ def normalize_asset_tx_id(str):
 
 # Sometimes our price unit is not in USD (could be other fiat or even other crypto).
 # This function takes in a price_symbol, a price_value, and a timestamp and gives back a price_usd and a price_source string.
-def get_price_usd_and_source(price_symbol: str, price_value: Decimal, timestamp: int):
+def get_price_usd_and_source(
+    price_symbol: str, price_value: Decimal, timestamp: int, coin_prices=None
+):
     if price_symbol.upper() == "USD":
         # Price is USD already so just take it in as-is
         price_usd = price_value
@@ -33,23 +42,148 @@ def get_price_usd_and_source(price_symbol: str, price_value: Decimal, timestamp:
         )
         price_source = "exchange_file_converted_from_fiat"
     else:
-        mapped_asset = price_feed.map_asset("import", price_symbol.lower(), True)
-        coin_price = price_feed.get(mapped_asset["asset_price_id"], timestamp)
+        # CoinGecko prices are per UTC day, so with a coin_prices dict one lookup covers every row for an asset that day
+        key = (price_symbol.lower(), int(timestamp) // 86400)
+        if coin_prices is not None and key in coin_prices:
+            coin_price = coin_prices[key]
+        else:
+            mapped_asset = price_feed.map_asset("import", price_symbol.lower(), True)
+            coin_price = price_feed.get(mapped_asset["asset_price_id"], timestamp)
+            if coin_prices is not None:
+                coin_prices[key] = coin_price
         price_usd = Decimal(coin_price.price) * price_value
         price_source = coin_price.source
     return price_usd, price_source
 
 
-class BitcoinTaxImporter:
+def parse_timestamp(value: str) -> float:
+    """Same as arrow.get(value).timestamp() for the ISO 8601 timestamps exchanges export, but much cheaper"""
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        return arrow.get(value).timestamp()
+    # Like arrow, timestamps without an offset are UTC
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+# Unified txs held in memory at a time during a streaming import
+IMPORT_CHUNK_SIZE = 5000
+
+
+class ImportCheckpoint:
+    """How many rows of an export file a streaming import has saved, so an interrupted import can pick up from there"""
+
+    def __init__(self, exchange, exchange_account_id, file_path):
+        # A different or modified file starts over
+        stat = os.stat(file_path)
+        key = f"{exchange}:{exchange_account_id}:{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        digest = hashlib.sha1(key.encode("utf8")).hexdigest()[:16]
+        self.path = f"{CACHE_DIR}/import-{exchange}-{digest}.json"
+
+    def load(self) -> int:
+        try:
+            with open(self.path) as f:
+                return json.load(f)["rows_saved"]
+        except FileNotFoundError:
+            return 0
+
+    def save(self, rows_saved):
+        with open(self.path, "w") as f:
+            json.dump(dict(rows_saved=rows_saved), f)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class StreamingImporter:
+    """
+    Importers yield unified txs from iter_chain_txns as they read rows, so exports too big to hold in memory can be
+    saved in chunks with do_stream_import. A tx is only yielded once every row it was built from has been read, so
+    the rows read at that point are a safe place to resume from.
+    """
+
+    rows_read = 0
+
+    def read_rows(self, rows, start_row=0):
+        self.rows_read = 0
+        self.coin_prices = {}
+        for r in rows:
+            self.rows_read += 1
+            if self.rows_read > start_row:
+                yield r
+
+    def get_price_usd_and_source(self, price_symbol, price_value, timestamp):
+        return get_price_usd_and_source(
+            price_symbol, price_value, timestamp, coin_prices=self.coin_prices
+        )
+
+    def do_stream_import(
+        self,
+        file,
+        entity_address_for_imports,
+        exchange_account_id,
+        chunk_size=IMPORT_CHUNK_SIZE,
+        checkpoint: ImportCheckpoint = None,
+    ):
+        start_row = checkpoint.load() if checkpoint else 0
+        if start_row:
+            print(f"Resuming import after row {start_row}")
+
+        progress = tqdm(
+            desc="Importing rows", unit="rows", initial=start_row, disable=None
+        )
+        unifieds = {}
+
+        def save_chunk():
+            save_to_db(unifieds, progress=False)
+            if checkpoint:
+                checkpoint.save(self.rows_read)
+            progress.update(self.rows_read - progress.n)
+            unifieds.clear()
+
+        txns = self.iter_chain_txns(
+            file,
+            entity_address_for_imports=entity_address_for_imports,
+            exchange_account_id=exchange_account_id,
+            start_row=start_row,
+        )
+        for tx in txns:
+            unifieds[f"{tx['chain']}:{tx['hash']}"] = tx
+            if len(unifieds) >= chunk_size:
+                save_chunk()
+        save_chunk()
+        progress.close()
+
+        if checkpoint:
+            checkpoint.clear()
+
+
+class BitcoinTaxImporter(StreamingImporter):
     def raw_transactions_csv_to_chain_txns(
         self, csv_file, entity_address_for_imports=None, exchange_account_id=None
     ):
-        txns = []
+        return list(
+            self.iter_chain_txns(
+                csv_file,
+                entity_address_for_imports=entity_address_for_imports,
+                exchange_account_id=exchange_account_id,
+            )
+        )
+
+    def iter_chain_txns(
+        self,
+        csv_file,
+        entity_address_for_imports=None,
+        exchange_account_id=None,
+        start_row=0,
+    ):
         reader = csv.DictReader(csv_file)
-        for r in reader:
+        for r in self.read_rows(reader, start_row):
             # From CSV
-            date = arrow.get(r["Date"], "YYYY-MM-DD HH:mm:ss")
-            timestamp = int(date.timestamp())
+            timestamp = int(parse_timestamp(r["Date"]))
             symbol = r["Symbol"]
             account = r["Account"]
             amount = Decimal(r["Volume"])
@@ -154,9 +288,7 @@ class BitcoinTaxImporter:
                 price_currency=price_currency,
                 account=account,
             )
-            txns.append(tx)
-
-        return txns
+            yield tx
 
     def do_import(self, csv_file, entity_address_for_imports, exchange_account_id):
         txns = self.raw_transactions_csv_to_chain_txns(
@@ -171,7 +303,7 @@ class BitcoinTaxImporter:
         save_to_db(unifieds)
 
 
-class KrakenImporter:
+class KrakenImporter(StreamingImporter):
     # For info on the export format, see https://support.kraken.com/hc/en-us/articles/360001169383-How-to-interpret-Ledger-history-fields
     asset_code_mapping = {
         # https://support.kraken.com/hc/en-us/articles/360001185506-How-to-interpret-asset-codes
@@ -216,10 +348,24 @@ class KrakenImporter:
         exchange_account_id=None,
         db=None,
     ):
-        txns = []
+        return list(
+            self.iter_chain_txns(
+                csv_file,
+                entity_address_for_imports=entity_address_for_imports,
+                exchange_account_id=exchange_account_id,
+            )
+        )
+
+    def iter_chain_txns(
+        self,
+        csv_file,
+        entity_address_for_imports=None,
+        exchange_account_id=None,
+        start_row=0,
+    ):
         reader = csv.DictReader(csv_file)
         last_row_trade = None
-        for r in reader:
+        for r in self.read_rows(reader, start_row):
             txid = r["txid"]
             refid = r["refid"]
             time = r["time"]
@@ -232,7 +378,7 @@ class KrakenImporter:
             asset_tx_id = self.get_symbol(asset).lower()
             amount = Decimal(r["amount"])
             direction = "IN" if amount > 0 else "OUT"
-            timestamp = arrow.get(time.replace(" ", "T") + "Z").timestamp()
+            timestamp = parse_timestamp(time)
             tx_ledger_type = f"Kraken.{type}"
             symbol = self.get_symbol(asset).upper()
             default_from_to = f"Kraken:{exchange_account_id}"
@@ -292,7 +438,7 @@ class KrakenImporter:
                     if fee_amount > 0:
                         amount = abs(Decimal(fee_amount))
                         symbol = this_row_t["symbol"]
-                        total_price_usd, price_source = get_price_usd_and_source(
+                        total_price_usd, price_source = self.get_price_usd_and_source(
                             symbol, amount, int(timestamp)
                         )
                         price_usd = total_price_usd / abs(fee_amount)
@@ -337,7 +483,7 @@ class KrakenImporter:
                         receives=receives,
                         sends=sends,
                     )
-                    txns.append(tx)
+                    yield tx
                     last_row_trade = None  # we're done with this special holder var until the next time we see another trade row
                     continue
 
@@ -371,9 +517,7 @@ class KrakenImporter:
                 receives=receives,
                 sends=sends,
             )
-            txns.append(tx)
-
-        return txns
+            yield tx
 
     def do_import(self, csv_file, entity_address_for_imports, exchange_account_id):
         txns = self.ledgers_csv_to_chain_txns(
@@ -388,7 +532,7 @@ class KrakenImporter:
         save_to_db(unifieds)
 
 
-class GeminiImporter:
+class GeminiImporter(StreamingImporter):
     def xls_to_csv(self, xls_file):
         output = io.StringIO()
         wb = openpyxl.load_workbook(filename=xls_file)
@@ -401,8 +545,40 @@ class GeminiImporter:
 
         return output.getvalue()
 
+    def xls_rows(self, xls_file):
+        """Rows as dicts of strings, like csv.DictReader over xls_to_csv but without loading the whole sheet"""
+        wb = openpyxl.load_workbook(filename=xls_file, read_only=True)
+        try:
+            sheet = wb.active
+            # Some exporters write a wrong dimension, which read only mode would trust
+            sheet.reset_dimensions()
+            rows = sheet.iter_rows(values_only=True)
+            header = ["" if v is None else str(v) for v in next(rows, [])]
+            for values in rows:
+                values = ["" if v is None else str(v) for v in values]
+                # Read only rows stop at their last cell, where xls_to_csv wrote out every column
+                values += [""] * (len(header) - len(values))
+                yield dict(zip(header, values))
+        finally:
+            wb.close()
+
     def xls_to_chain_txns(
         self, xls_file=None, entity_address_for_imports=None, exchange_account_id=None
+    ):
+        return list(
+            self.iter_chain_txns(
+                xls_file,
+                entity_address_for_imports=entity_address_for_imports,
+                exchange_account_id=exchange_account_id,
+            )
+        )
+
+    def iter_chain_txns(
+        self,
+        xls_file,
+        entity_address_for_imports=None,
+        exchange_account_id=None,
+        start_row=0,
     ):
         def decimal_from_str(str):
             if not str:
@@ -425,10 +601,8 @@ class GeminiImporter:
             str = re.sub("[^0-9.]", "", str)
             return Decimal(str) * sign * (Decimal(10) ** exponent)
 
-        csv_file = self.xls_to_csv(xls_file)
-        reader = csv.DictReader(io.StringIO(csv_file))
-        txns = []
-        for r in reader:
+        reader = self.xls_rows(xls_file)
+        for r in self.read_rows(reader, start_row):
             date = r["Date"]
             if not date:
                 continue
@@ -486,7 +660,7 @@ class GeminiImporter:
             asset_tx_id = symbol_left.lower()
             tx_ledger_type = f"Gemini.{type}"
             chain = "import.gemini"
-            timestamp = arrow.get(date).timestamp()
+            timestamp = parse_timestamp(date)
 
             fallback_hash = f"{chain}_{timestamp}_{type}_{symbol}"
             fee_symbol = fiat_symbol_actual.upper() if fiat_symbol_actual else ""
@@ -499,7 +673,7 @@ class GeminiImporter:
             price_usd = None
             price_source = None
             if amount_fiat and amount:
-                total_price_usd, price_source = get_price_usd_and_source(
+                total_price_usd, price_source = self.get_price_usd_and_source(
                     fiat_symbol_actual, abs(amount_fiat), int(timestamp)
                 )
                 price_usd = total_price_usd / abs(Decimal(amount))
@@ -544,7 +718,7 @@ class GeminiImporter:
             # Add on the fee
             if fee_amount > 0:
                 amount = abs(Decimal(fee_amount))
-                total_price_usd, price_source = get_price_usd_and_source(
+                total_price_usd, price_source = self.get_price_usd_and_source(
                     fee_symbol, amount, int(timestamp)
                 )
                 price_usd = total_price_usd / abs(fee_amount)
@@ -571,9 +745,7 @@ class GeminiImporter:
                 receives=receives,
                 sends=sends,
             )
-            txns.append(tx)
-
-        return txns
+            yield tx
 
     def do_import(
         self,
@@ -593,14 +765,28 @@ class GeminiImporter:
         save_to_db(unifieds)
 
 
-class CoinbaseImporter:
+class CoinbaseImporter(StreamingImporter):
     # TODO - Treat Coinbase.Interest as Income ?
     # TODO - Treat Coinbase.Reward as Income?
 
     def raw_transactions_csv_to_chain_txns(
         self, csv_file, entity_address_for_imports=None, exchange_account_id=None
     ):
-        txns = []
+        return list(
+            self.iter_chain_txns(
+                csv_file,
+                entity_address_for_imports=entity_address_for_imports,
+                exchange_account_id=exchange_account_id,
+            )
+        )
+
+    def iter_chain_txns(
+        self,
+        csv_file,
+        entity_address_for_imports=None,
+        exchange_account_id=None,
+        start_row=0,
+    ):
         reader = csv.DictReader(csv_file)
 
         # Figure out what currency we are working with
@@ -615,7 +801,7 @@ class CoinbaseImporter:
         fiat_symbol = matches.group(1)
 
         last_row_converted_from = None
-        for r in reader:
+        for r in self.read_rows(reader, start_row):
             # Pull values out of the row
             quantity_acquired = (
                 Decimal(r["Quantity Acquired (Bought, Received, etc)"])
@@ -636,7 +822,7 @@ class CoinbaseImporter:
                 else normalize_asset_tx_id(asset_disposed)
             )
             amount = quantity_acquired if direction == "IN" else quantity_disposed
-            timestamp = arrow.get(r["Date & time"]).timestamp()
+            timestamp = parse_timestamp(r["Date & time"])
             tx_ledger_type = f"Coinbase.{r['Transaction Type']}"
             symbol = (
                 asset_acquired.upper() if direction == "IN" else asset_disposed.upper()
@@ -718,7 +904,7 @@ class CoinbaseImporter:
                             )
                         ],
                     )
-                    txns.append(tx)
+                    yield tx
                     last_row_converted_from = None  # we're done with this special holder var until the next time we see another Converted from row.
                     continue
 
@@ -754,7 +940,7 @@ class CoinbaseImporter:
                         )
                     ],
                 )
-                txns.append(tx)
+                yield tx
                 continue
 
             if transaction_type == "Sell":
@@ -787,7 +973,7 @@ class CoinbaseImporter:
                         )
                     ],
                 )
-                txns.append(tx)
+                yield tx
                 continue
 
             # Non-swap case
@@ -831,9 +1017,7 @@ class CoinbaseImporter:
                 receives=receives,
                 sends=sends,
             )
-            txns.append(tx)
-
-        return txns
+            yield tx
 
     def do_import(self, csv_file, entity_address_for_imports, exchange_account_id):
         txns = self.raw_transactions_csv_to_chain_txns(
@@ -848,21 +1032,34 @@ class CoinbaseImporter:
         save_to_db(unifieds)
 
 
-class CoinbaseTransactionHistoryImporter:
+class CoinbaseTransactionHistoryImporter(StreamingImporter):
     def transaction_history_csv_to_chain_txns(
         self,
         csv_file: io.StringIO,
         entity_address_for_imports=None,
         exchange_account_id=None,
     ):
-        txns = []
-        lines_after_header = csv_file.readlines()[7:]
-        cleaned_csv = io.StringIO("\n".join(lines_after_header))
-        reader = csv.DictReader(cleaned_csv)
+        return list(
+            self.iter_chain_txns(
+                csv_file,
+                entity_address_for_imports=entity_address_for_imports,
+                exchange_account_id=exchange_account_id,
+            )
+        )
 
-        for r in reader:
+    def iter_chain_txns(
+        self,
+        csv_file,
+        entity_address_for_imports=None,
+        exchange_account_id=None,
+        start_row=0,
+    ):
+        # Skip the preamble before the header without reading the whole file in
+        reader = csv.DictReader(itertools.islice(csv_file, 7, None))
+
+        for r in self.read_rows(reader, start_row):
             # Pull values out of the row
-            timestamp = int(arrow.get(r["Timestamp"]).timestamp())
+            timestamp = int(parse_timestamp(r["Timestamp"]))
             transaction_type = r["Transaction Type"]
             symbol = r["Asset"].upper()
             amount = r["Quantity Transacted"]
@@ -931,7 +1128,7 @@ class CoinbaseTransactionHistoryImporter:
                         ),
                     ],
                 )
-                txns.append(tx)
+                yield tx
                 continue
 
             if transaction_type in ["Buy", "Advanced Trade Buy"]:
@@ -979,7 +1176,7 @@ class CoinbaseTransactionHistoryImporter:
                         ),
                     ],
                 )
-                txns.append(tx)
+                yield tx
                 continue
 
             if transaction_type in ["Sell", "Advanced Trade Sell"]:
@@ -1025,7 +1222,7 @@ class CoinbaseTransactionHistoryImporter:
                         ),
                     ],
                 )
-                txns.append(tx)
+                yield tx
                 continue
 
             # Non-swap case
@@ -1068,9 +1265,7 @@ class CoinbaseTransactionHistoryImporter:
                 receives=receives,
                 sends=sends,
             )
-            txns.append(tx)
-
-        return txns
+            yield tx
 
     def do_import(self, csv_file, entity_address_for_imports, exchange_account_id):
         txns = self.transaction_history_csv_to_chain_txns(
@@ -1322,18 +1517,32 @@ class BROKEN_CoinbaseProAccountStatementImporter:
         save_to_db(unifieds)
 
 
-class CoinbaseProImporter:
+class CoinbaseProImporter(StreamingImporter):
     def fills_csv_to_chain_txns(
         self, csv_file, entity_address_for_imports=None, exchange_account_id=None
     ):
-        txns = []
+        return list(
+            self.iter_chain_txns(
+                csv_file,
+                entity_address_for_imports=entity_address_for_imports,
+                exchange_account_id=exchange_account_id,
+            )
+        )
+
+    def iter_chain_txns(
+        self,
+        csv_file,
+        entity_address_for_imports=None,
+        exchange_account_id=None,
+        start_row=0,
+    ):
         reader = csv.DictReader(csv_file)
-        for r in reader:
+        for r in self.read_rows(reader, start_row):
             chain = "import.coinbase_pro"
             side = r["side"]
             asset_tx_id = r["size unit"].lower()
             amount = Decimal(r["size"])
-            timestamp = int(arrow.get(r["created at"]).timestamp())
+            timestamp = int(parse_timestamp(r["created at"]))
             tx_ledger_type = f"CoinbasePro.{r['side']}"
             symbol = r["size unit"].upper()
             default_from_to = f"CoinbasePro:{exchange_account_id}"
@@ -1347,7 +1556,7 @@ class CoinbaseProImporter:
             hash = f"{portfolio}_{trade_id}_{product}_{side}"
 
             # NOTE: price is not always in USD, so we need to convert to USD if it's not USD...
-            price_usd, price_source = get_price_usd_and_source(
+            price_usd, price_source = self.get_price_usd_and_source(
                 price_unit, price, timestamp
             )
 
@@ -1385,7 +1594,7 @@ class CoinbaseProImporter:
             # Add on the fee
             if fee_amount > 0:
                 # price_usd needs to be a unit price so get the total in usd and divide by the amount
-                total_price_usd, price_source = get_price_usd_and_source(
+                total_price_usd, price_source = self.get_price_usd_and_source(
                     price_unit, abs(fee_amount), timestamp
                 )
                 price_usd = total_price_usd / abs(fee_amount)
@@ -1411,9 +1620,7 @@ class CoinbaseProImporter:
                 receives=receives,
                 sends=sends,
             )
-            txns.append(tx)
-
-        return txns
+            yield tx
 
     def do_import(self, csv_file, entity_address_for_imports, exchange_account_id):
         txns = self.fills_csv_to_chain_txns(
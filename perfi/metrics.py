@@ -0,0 +1,95 @@
+"""
+Process-wide counters and timers for the perfi pipeline
+
+Everything is a monotonically increasing counter keyed by name and labels, which keeps recording cheap
+(one dict update under a lock) and maps directly onto Prometheus counters for the API's /metrics endpoint.
+CLI scripts print the same data as JSON when they finish.
+"""
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from urllib.parse import urlparse
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Records `<name>_total` and `<name>_seconds_total` for the wrapped block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc(f"{name}_seconds_total", time.perf_counter() - start, **labels)
+            self.inc(f"{name}_total", **labels)
+
+    def timed_stage(self, stage: str):
+        """Decorator for the top-level pipeline stages (ingest, ledger, grouping, costbasis, 8949...)"""
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer("perfi_stage", stage=stage):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def count_http_request(self, request):
+        # Used as an httpx request event hook so retries and redirects are counted too
+        self.inc("perfi_http_requests_total", host=urlparse(str(request.url)).hostname)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def prometheus_text(self) -> str:
+        by_name = defaultdict(list)
+        for (name, labels), value in sorted(self.snapshot().items()):
+            by_name[name].append((labels, value))
+
+        lines = []
+        for name, samples in by_name.items():
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in samples:
+                if labels:
+                    label_str = ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels)
+                    lines.append(f"{name}{{{label_str}}} {value:g}")
+                else:
+                    lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        summary = defaultdict(dict)
+        for (name, labels), value in sorted(self.snapshot().items()):
+            label_str = ",".join(f"{k}={v}" for k, v in labels) or "total"
+            summary[name][label_str] = round(value, 6)
+        return dict(summary)
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def print_metrics_summary():
+    print(json.dumps(metrics.summary(), indent=2))
+
+
+# Singleton for the whole process
+metrics = Metrics()
@@ -0,0 +1,96 @@
+"""
+Versioned schema migrations
+
+perfi.schema.sql is the base schema and is safe to re-run (everything is IF NOT EXISTS). Changes after it go in
+migrations/NNNN_description.sql and are applied once, in order, at startup; schema_version records which ones a
+database already has so existing installs pick up new indexes and columns too.
+
+Data migrations SQL can't express go in migrations/NNNN_description.py as an upgrade(db) function. These run while
+perfi.db is still being imported, so they should only use the db they're given and only import perfi modules that
+don't import perfi.db themselves (like perfi.constants).
+"""
+import importlib.util
+import re
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+from .constants.paths import MIGRATIONS_DIR
+
+MIGRATION_FILE_RE = re.compile(r"^(\d+)_(\w+)\.(sql|py)$")
+
+
+def get_migrations(migrations_dir=MIGRATIONS_DIR) -> List[Tuple[int, str, Path]]:
+    migrations = []
+    for path in Path(migrations_dir).glob("*.*"):
+        m = MIGRATION_FILE_RE.match(path.name)
+        if m:
+            migrations.append((int(m.group(1)), m.group(2), path))
+    return sorted(migrations)
+
+
+def get_schema_version(db) -> int:
+    sql = """SELECT MAX(version) FROM schema_version"""
+    return db.query(sql)[0][0] or 0
+
+
+def apply_sql_migration(db, version, name, path):
+    # executescript commits first, so the migration and its version row go in one explicit transaction
+    script = f"""BEGIN;
+                 {path.read_text()}
+                 INSERT INTO schema_version (version, name, applied) VALUES ({version}, '{name}', {int(time.time())});
+                 COMMIT;
+              """
+    try:
+        db.cur.executescript(script)
+    except Exception:
+        db.con.rollback()
+        raise
+
+
+def apply_python_migration(db, version, name, path):
+    spec = importlib.util.spec_from_file_location(f"perfi_migration_{version}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    db.con.commit()
+    try:
+        db.cur.execute("BEGIN")
+        module.upgrade(db)
+        db.cur.execute(
+            "INSERT INTO schema_version (version, name, applied) VALUES (?, ?, ?)",
+            (version, name, int(time.time())),
+        )
+        db.con.commit()
+    except Exception:
+        db.con.rollback()
+        raise
+
+
+def migrate(db, migrations_dir=MIGRATIONS_DIR) -> List[int]:
+    """Apply pending migrations and return the versions that were applied"""
+    db.cur.execute(
+        """CREATE TABLE IF NOT EXISTS schema_version (
+               version INTEGER PRIMARY KEY,
+               name    TEXT    NOT NULL,
+               applied INTEGER NOT NULL
+           )"""
+    )
+    current = get_schema_version(db)
+
+    applied = []
+    for version, name, path in get_migrations(migrations_dir):
+        if version <= current:
+            continue
+        if path.suffix == ".py":
+            apply_python_migration(db, version, name, path)
+        else:
+            apply_sql_migration(db, version, name, path)
+        applied.append(version)
+
+    if applied:
+        # Refresh planner statistics so new indexes actually get used
+        db.cur.execute("ANALYZE")
+        db.con.commit()
+
+    return applied
@@ -1,17 +1,37 @@
+import base64
+import json
 import logging
 import time
 from abc import ABC
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields, replace
 from datetime import datetime
 from decimal import Decimal
 from enum import Enum
 from functools import lru_cache
 from pprint import pformat
-from typing import Optional, List, Type, Protocol, TypeVar, Generic
+from typing import (
+    Optional,
+    List,
+    Type,
+    Protocol,
+    TypeVar,
+    Generic,
+    Union,
+    Dict,
+    Set,
+    Tuple,
+)
 
-import jsonpickle
 from devtools import debug
 from pydantic import BaseModel, ConfigDict, field_validator
 
+from .balance.history import (
+    HOUR,
+    compact_number,
+    entity_value_series,
+    store_balance_json,
+)
 from .constants import assets
 from .db import db, DB
 
@@ -73,31 +93,130 @@ class Flag(BaseModel):
     description: Optional[str] = None
 
 
-def load_flags(target_type: str, target_id: str) -> List[Flag]:
-    sql = """SELECT id, name, description, created_at, source FROM flag WHERE target_type = ? AND target_id = ?"""
+def flag_from_row(r) -> Flag:
+    return Flag(
+        id=r["id"],
+        target_type=r["target_type"],
+        target_id=r["target_id"],
+        name=r["name"],
+        description=r["description"],
+        created_at=r["created_at"],
+        source=r["source"],
+    )
+
+
+class FlagIndex:
+    """
+    Flags for many targets loaded with one query per target_type, so loops over TxLogicals and lots don't run a flag
+    query for each one. It's only used inside loaded() - add_flag/replace_flags keep it current there, and any target
+    that wasn't bulk loaded is read from the DB the first time it's asked for.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.flags: Dict[Tuple[str, str], List[Flag]] = {}
+        self.names: Dict[Tuple[str, str], Set[str]] = {}
+
+    def load(self, target_type: str, target_ids_sql: str, params=()):
+        """Index every target_id selected by target_ids_sql, with or without flags"""
+        for r in db.query(target_ids_sql, params):
+            self.set(target_type, r[0], [])
+
+        sql = f"""SELECT id, target_type, target_id, name, description, created_at, source
+                  FROM flag
+                  WHERE target_type = ?
+                  AND target_id IN ({target_ids_sql})
+                  ORDER BY id
+               """
+        for r in db.query(sql, [target_type, *params]):
+            self.add(target_type, r["target_id"], flag_from_row(r))
+        self.active = True
+
+    @contextmanager
+    def loaded(self, targets: List[Tuple[str, str, list]]):
+        """Use the index for [(target_type, target_ids_sql, params), ...] until the block exits"""
+        self.clear()
+        try:
+            for target_type, target_ids_sql, params in targets:
+                self.load(target_type, target_ids_sql, params)
+            yield self
+        finally:
+            self.clear()
+
+    def clear(self):
+        self.active = False
+        self.flags = {}
+        self.names = {}
+
+    def get(self, target_type: str, target_id: str) -> List[Flag]:
+        key = (target_type, target_id)
+        if key not in self.flags:
+            self.set(target_type, target_id, query_flags(target_type, target_id))
+        return list(self.flags[key])
+
+    def has_flag(self, target_type: str, target_id: str, name: str) -> bool:
+        key = (target_type, target_id)
+        if key not in self.names:
+            self.get(target_type, target_id)
+        return name in self.names[key]
+
+    def set(self, target_type: str, target_id: str, flags: List[Flag]):
+        key = (target_type, target_id)
+        self.flags[key] = list(flags)
+        self.names[key] = {f.name for f in flags}
+
+    def add(self, target_type: str, target_id: str, flag: Flag):
+        key = (target_type, target_id)
+        if key in self.flags:
+            self.flags[key].append(flag)
+            self.names[key].add(flag.name)
+
+
+flag_index = FlagIndex()
+
+
+def query_flags(target_type: str, target_id: str) -> List[Flag]:
+    sql = """SELECT id, target_type, target_id, name, description, created_at, source
+             FROM flag
+             WHERE target_type = ? AND target_id = ?
+             ORDER BY id
+          """
     params = [target_type, target_id]
-    rows = db.query(sql, params)
-    flags = []
-    for r in rows:
-        flags.append(
-            Flag(
-                id=r["id"],
-                target_type=target_type,
-                target_id=target_id,
-                name=r["name"],
-                description=r["description"],
-                created_at=r["created_at"],
-                source=r["source"],
-            )
-        )
-    return flags
+    return [flag_from_row(r) for r in db.query(sql, params)]
 
 
-def add_flag(target_type: str, target_id: str, flag):
+def load_flags(target_type: str, target_id: str) -> List[Flag]:
+    if flag_index.active:
+        return flag_index.get(target_type, target_id)
+    return query_flags(target_type, target_id)
+
+
+def has_flag(target_type: str, target_id: str, name: str) -> bool:
+    if flag_index.active:
+        return flag_index.has_flag(target_type, target_id, name)
+    return name in [f.name for f in query_flags(target_type, target_id)]
+
+
+def insert_flag(target_type: str, target_id: str, flag) -> Flag:
     now = int(time.time())
     insert_sql = """INSERT INTO flag (target_type, target_id, created_at, name, description, source) VALUES (?, ?, ?, ?, ?, ?)"""
     params = [target_type, target_id, now, flag.name, flag.description, flag.source]
     db.execute(insert_sql, params)
+    return Flag(
+        id=db.cur.lastrowid,
+        target_type=target_type,
+        target_id=target_id,
+        source=flag.source,
+        created_at=now,
+        name=flag.name,
+        description=flag.description,
+    )
+
+
+def add_flag(target_type: str, target_id: str, flag):
+    saved = insert_flag(target_type, target_id, flag)
+    if flag_index.active:
+        flag_index.add(target_type, target_id, saved)
 
 
 def replace_flags(target_type: str, target_id: str, flags: List[Flag]):
@@ -105,11 +224,9 @@ def replace_flags(target_type: str, target_id: str, flags: List[Flag]):
     params = [target_type, target_id]
     db.execute(delete_sql, params)
 
-    insert_sql = """INSERT INTO flag (target_type, target_id, created_at, name, description, source) VALUES (?, ?, ?, ?, ?, ?)"""
-    for flag in flags:
-        now = int(time.time())
-        params = [target_type, target_id, now, flag.name, flag.description, flag.source]
-        db.execute(insert_sql, params)
+    saved = [insert_flag(target_type, target_id, flag) for flag in flags]
+    if flag_index.active:
+        flag_index.set(target_type, target_id, saved)
 
 
 class Entity(BaseModel):
@@ -137,7 +254,29 @@ class Setting(BaseModel):
 Entity.update_forward_refs()
 
 
-class TxLedger(BaseModel):
+class TxLedgerMethods:
+    """Behaviour shared by the TxLedger model and TxLedgerRow"""
+
+    __slots__ = ()
+
+    def auto_description(self):
+        return f"{self.amount} {self.symbol}"
+
+    def save_price(self, price_usd):
+        self.price_usd = price_usd
+        """
+        LATER: we should create a tx_ledger_event table
+        and apply price updates in the same way so they can be replayed, store source etc
+        """
+        sql = """UPDATE tx_ledger
+                 SET price_usd = ?
+                 WHERE id = ?
+              """
+        params = [float(price_usd), self.id]
+        db.execute(sql, params)
+
+
+class TxLedger(TxLedgerMethods, BaseModel):
     model_config = ConfigDict(json_encoders={Decimal: float})
 
     id: Optional[str] = None
@@ -168,6 +307,8 @@ class TxLedger(BaseModel):
         return value
 
     def __eq__(self, other):
+        if isinstance(other, TxLedgerRow):
+            other = other.to_model()
         if not isinstance(other, TxLedger):
             return NotImplemented
         d1 = self.dict()
@@ -231,21 +372,50 @@ class TxLedger(BaseModel):
             raise Exception(f"No tx_ledger found for id {id}")
         return cls(**result[0])
 
-    def auto_description(self):
-        return f"{self.amount} {self.symbol}"
 
-    def save_price(self, price_usd):
-        self.price_usd = price_usd
-        """
-        LATER: we should create a tx_ledger_event table
-        and apply price updates in the same way so they can be replayed, store source etc
-        """
-        sql = """UPDATE tx_ledger
-                 SET price_usd = ?
-                 WHERE id = ?
-              """
-        params = [float(price_usd), self.id]
-        db.execute(sql, params)
+@dataclass(slots=True)
+class TxLedgerRow(TxLedgerMethods):
+    """
+    A TxLedger for the ledger, grouping and costbasis loops
+
+    These get built for every tx_ledger row the pipeline touches, so unlike TxLedger nothing is validated or coerced;
+    values have to already be the right types (as they are coming out of the DB). Build them with
+    TxLedgerRow(*row) from a SELECT of TX_LEDGER_ROW_COLUMNS, unpacking a sqlite3.Row by name costs more than the
+    model's validation does. to_model() gives the TxLedger for the API.
+    """
+
+    chain: str
+    address: str
+    hash: str
+    from_address: str
+    to_address: str
+    asset_tx_id: str
+    isfee: int
+    amount: Decimal
+    timestamp: int
+    direction: str
+    id: Optional[str] = None
+    from_address_name: Optional[str] = None
+    to_address_name: Optional[str] = None
+    tx_ledger_type: Optional[str] = None
+    asset_price_id: Optional[str] = None
+    symbol: Optional[str] = None
+    price_usd: Optional[Decimal] = None
+    price_source: Optional[str] = None
+    tx_logical_id: Optional[int] = None
+
+    def __eq__(self, other):
+        if isinstance(other, (TxLedger, TxLedgerRow)):
+            return self.to_model() == other
+        return NotImplemented
+
+    def to_model(self) -> TxLedger:
+        return TxLedger(**{f.name: getattr(self, f.name) for f in fields(self)})
+
+
+TX_LEDGER_ROW_COLUMNS = ", ".join(
+    f.name for f in fields(TxLedgerRow) if f.name != "tx_logical_id"
+)
 
 
 class TxLogical(BaseModel):
@@ -254,16 +424,17 @@ class TxLogical(BaseModel):
     description: str = ""
     note: str = ""
     timestamp: int = -1
-    tx_ledgers: List[TxLedger] = []
+    # Loaded from the DB these are TxLedgerRows, TxLogicalOut turns them into TxLedgers for the API
+    tx_ledgers: List[Union[TxLedger, TxLedgerRow]] = []
     address: str = ""
     addresses: List[str] = []
     tx_logical_type: str = ""  # replace with enum?
     entity: Optional[str] = None
     flags: Optional[List[Flag]] = []
-    ins: List[TxLedger] = []
-    outs: List[TxLedger] = []
-    fee: Optional[TxLedger] = None
-    others: List[TxLedger] = []
+    ins: List[Union[TxLedger, TxLedgerRow]] = []
+    outs: List[Union[TxLedger, TxLedgerRow]] = []
+    fee: Optional[Union[TxLedger, TxLedgerRow]] = None
+    others: List[Union[TxLedger, TxLedgerRow]] = []
 
     def _group_ledgers(self):
         # group ledgers into INs, OUTs, fee, others
@@ -312,7 +483,7 @@ class TxLogical(BaseModel):
         txl.flags = load_flags(cls.__name__, id)
 
         # load the tx ledgers
-        sql = """SELECT id, chain, address, hash, from_address, to_address, from_address_name, to_address_name, asset_tx_id, isfee, amount, timestamp, direction, tx_ledger_type, asset_price_id, symbol, price_usd, price_source
+        sql = f"""SELECT {TX_LEDGER_ROW_COLUMNS}
              FROM tx_rel_ledger_logical rel
              JOIN tx_ledger led on led.id = rel.tx_ledger_id
              WHERE rel.tx_logical_id = ?
@@ -321,7 +492,7 @@ class TxLogical(BaseModel):
         params = [id]
         results = db.query(sql, params)
         for r in results:
-            txl.tx_ledgers.append(TxLedger(**r))
+            txl.tx_ledgers.append(TxLedgerRow(*r))
 
         txl._group_ledgers()
 
@@ -733,7 +904,7 @@ class CostbasisLot(BaseModel):
     price_usd: Decimal
     basis_usd: Decimal
     timestamp: int
-    history: List[TxLedger] = []
+    history: List[Union[TxLedger, TxLedgerRow]] = []
     flags: List[Flag] = []
     receipt: int
     price_source: str
@@ -741,6 +912,88 @@ class CostbasisLot(BaseModel):
     locked_for_year: Optional[int] = None
 
 
+@dataclass(slots=True)
+class CostbasisLotRow:
+    """A CostbasisLot loaded for lot matching; like TxLedgerRow it's built positionally from COSTBASIS_LOT_ROW_COLUMNS"""
+
+    tx_ledger_id: str
+    entity: str
+    address: str
+    asset_tx_id: str
+    original_amount: Decimal
+    current_amount: Decimal
+    price_usd: Decimal
+    basis_usd: Decimal
+    timestamp: int
+    receipt: int
+    price_source: str
+    chain: str
+    asset_price_id: Optional[str] = None
+    symbol: Optional[str] = None
+    history: list = field(default_factory=list)
+    flags: list = field(default_factory=list)
+    locked_for_year: Optional[int] = None
+
+    def to_model(self) -> CostbasisLot:
+        return CostbasisLot(**{f.name: getattr(self, f.name) for f in fields(self)})
+
+
+# history, flags and locked_for_year aren't needed for matching (or are decoded separately)
+COSTBASIS_LOT_ROW_COLUMNS = ", ".join(
+    f.name
+    for f in fields(CostbasisLotRow)
+    if f.name not in ("history", "flags", "locked_for_year")
+)
+
+# SQLite's default limit on host parameters is 999
+HISTORY_CHUNK_SIZE = 500
+
+
+def encode_lot_history(history) -> str:
+    """
+    A lot's history is stored as [[tx_ledger_id, amount], ...] rather than pickled copies of each TxLedger. The amount
+    is kept because deposit/withdrawal/loan lots store a copy of the ledger with its amount adjusted to the balance.
+    """
+    return json.dumps([[t.id, str(t.amount)] for t in history], separators=(",", ":"))
+
+
+class LotHistoryError(Exception):
+    pass
+
+
+def load_lot_histories(encoded_histories: List[str]) -> List[List[TxLedgerRow]]:
+    """
+    Decode a batch of stored lot histories, looking up all of their tx_ledgers at once. A history that references a
+    tx_ledger that's gone (e.g. re-imported since the lots were generated) raises LotHistoryError rather than coming
+    back short, since the lots are stale and need regenerating.
+    """
+    refs = [json.loads(h) if h else [] for h in encoded_histories]
+    ids = list(dict.fromkeys(id for history in refs for id, _ in history))
+
+    tx_ledgers = {}
+    for i in range(0, len(ids), HISTORY_CHUNK_SIZE):
+        chunk = ids[i : i + HISTORY_CHUNK_SIZE]
+        sql = f"""SELECT {TX_LEDGER_ROW_COLUMNS}
+                  FROM tx_ledger
+                  WHERE id IN ({", ".join("?" * len(chunk))})
+               """
+        for r in db.query(sql, chunk):
+            tx_ledger = TxLedgerRow(*r)
+            tx_ledgers[tx_ledger.id] = tx_ledger
+
+    missing = [id for id in ids if id not in tx_ledgers]
+    if missing:
+        raise LotHistoryError(
+            f"Lot histories reference {len(missing)} missing tx_ledgers ({', '.join(missing[:5])}"
+            f"{', ...' if len(missing) > 5 else ''}), regenerate the costbasis lots"
+        )
+
+    return [
+        [replace(tx_ledgers[id], amount=Decimal(amount)) for id, amount in history]
+        for history in refs
+    ]
+
+
 class CostbasisDisposal(BaseModel):
     id: Optional[int] = None
     entity: str
@@ -957,6 +1210,29 @@ class AddressStore(BaseStore[Address]):
         return [self.model_class(**r) for r in self.db.query(sql, params)]
 
 
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp: int, id: str) -> str:
+    """Opaque token for the (timestamp, id) position of the last tx_logical on a page"""
+    return base64.urlsafe_b64encode(json.dumps([timestamp, id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    try:
+        timestamp, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(timestamp), str(id)
+    except Exception:
+        raise InvalidCursor(f"Invalid cursor {cursor}")
+
+
+def fts_query(q: str) -> str:
+    """Quote each word of a search box query as an FTS5 prefix term, so punctuation in hashes etc. can't break it"""
+    terms = q.split()
+    return " ".join('"' + term.replace('"', '""') + '"*' for term in terms)
+
+
 class TxLogicalStore(BaseStore[TxLogical]):
     def __init__(self, db):
         self.tx_ledger_store = TxLedgerStore(db)
@@ -969,21 +1245,18 @@ class TxLogicalStore(BaseStore[TxLogical]):
         items_per_page: int = 100,
         page_num=0,
         direction: str = "DESC",
+        **filters,
     ):
+        order = "DESC" if direction == "DESC" else "ASC"
+        where, params = self._entity_filters_sql(entity_name, **filters)
         sql = f"""
             SELECT id
-            FROM tx_logical
-             WHERE address IN (
-                 SELECT address
-                 FROM address, entity
-                 WHERE entity_id = entity.id
-                 AND entity.name = ?
-             )
-            AND count > 0
-            ORDER BY timestamp { "DESC" if direction == "DESC" else "ASC" }
+            FROM tx_logical log
+            WHERE {where}
+            ORDER BY timestamp {order}, id {order}
             LIMIT ? OFFSET ?
         """
-        params = [entity_name, items_per_page, page_num * items_per_page]
+        params += [items_per_page, page_num * items_per_page]
         tx_logicals: List[TxLogical] = []
         for row in self.db.query(sql, params):
             txl = TxLogical.from_id(
@@ -992,6 +1265,173 @@ class TxLogicalStore(BaseStore[TxLogical]):
             tx_logicals.append(txl)
         return tx_logicals
 
+    def _entity_filters_sql(
+        self,
+        entity_name: str,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        tx_logical_type: Optional[str] = None,
+        chain: Optional[str] = None,
+        flag: Optional[str] = None,
+        symbol: Optional[str] = None,
+    ) -> Tuple[str, list]:
+        """WHERE conditions on tx_logical log for an entity's non-empty tx_logicals with the listing filters"""
+        sql = """log.address IN (
+                     SELECT address
+                     FROM address, entity
+                     WHERE entity_id = entity.id
+                     AND entity.name = ?
+                 )
+                 AND log.count > 0
+              """
+        params: list = [entity_name]
+        if start is not None:
+            sql += "AND log.timestamp >= ?\n"
+            params.append(start)
+        if end is not None:
+            sql += "AND log.timestamp < ?\n"
+            params.append(end)
+        if tx_logical_type:
+            sql += "AND log.tx_logical_type = ?\n"
+            params.append(tx_logical_type)
+        for column, value in [("chain", chain), ("symbol", symbol)]:
+            if value:
+                sql += f"""AND EXISTS (
+                               SELECT 1
+                               FROM tx_rel_ledger_logical rel
+                               JOIN tx_ledger led ON led.id = rel.tx_ledger_id
+                               WHERE rel.tx_logical_id = log.id
+                               AND led.{column} = ?
+                           )
+                        """
+                params.append(value)
+        if flag:
+            sql += f"""AND EXISTS (
+                           SELECT 1
+                           FROM flag f
+                           WHERE f.target_id = log.id
+                           AND f.target_type = '{TxLogical.__name__}'
+                           AND f.name = ?
+                       )
+                    """
+            params.append(flag)
+        return sql, params
+
+    def keyset_page(
+        self,
+        entity_name: str,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        direction: str = "DESC",
+        **filters,
+    ) -> Tuple[List[TxLogical], Optional[str]]:
+        """
+        A page of an entity's tx_logicals ordered by (timestamp, id), starting after cursor. Each page is a bounded
+        index range scan however deep it is, unlike LIMIT/OFFSET. Returns the page and the cursor for the next one
+        (None on the last page). filters are start/end epoch bounds (end is exclusive), tx_logical_type, chain, flag
+        and symbol.
+        """
+        order = "DESC" if direction == "DESC" else "ASC"
+        where, params = self._entity_filters_sql(entity_name, **filters)
+        sql = f"""SELECT id, timestamp
+                  FROM tx_logical log
+                  WHERE {where}
+               """
+        if cursor:
+            sql += f"AND (timestamp, id) {'<' if order == 'DESC' else '>'} (?, ?)\n"
+            params.extend(decode_cursor(cursor))
+        # One extra row tells us whether there's a next page
+        sql += f"ORDER BY timestamp {order}, id {order} LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self.db.query(sql, params)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["timestamp"], rows[-1]["id"])
+        return [TxLogical.from_id(r["id"]) for r in rows], next_cursor
+
+    def search(self, entity_name: str, q: str = "", limit: int = 100, **filters):
+        """
+        Full-text search (tx_logical_fts) over an entity's tx_logicals' descriptions, notes, symbols, counterparty
+        names and hashes, best matches first. Every word in q has to match, as a prefix. Returns the matches, the total
+        number of matches and facet counts of them by type, chain, symbol and flag. Read-only, writers keep the index
+        current with refresh_search_index.
+        """
+        where, params = self._entity_filters_sql(entity_name, **filters)
+        match = fts_query(q)
+        if match:
+            matched_sql = f"""SELECT log.id, log.timestamp, log.tx_logical_type, fts.rank
+                              FROM tx_logical_fts fts
+                              JOIN tx_logical log ON log.rowid = fts.rowid
+                              WHERE tx_logical_fts MATCH ?
+                              AND {where}
+                           """
+            params = [match, *params]
+        else:
+            matched_sql = f"""SELECT log.id, log.timestamp, log.tx_logical_type, 0 AS rank
+                              FROM tx_logical log
+                              WHERE {where}
+                           """
+
+        sql = f"""SELECT id FROM ({matched_sql})
+                  ORDER BY rank, timestamp DESC, id DESC
+                  LIMIT ?
+               """
+        tx_logicals = [
+            TxLogical.from_id(r["id"]) for r in self.db.query(sql, [*params, limit])
+        ]
+
+        sql = f"""SELECT COUNT(*) FROM ({matched_sql})"""
+        total = self.db.query(sql, params)[0][0]
+
+        ledger_join = """JOIN tx_rel_ledger_logical rel ON rel.tx_logical_id = m.id
+                         JOIN tx_ledger led ON led.id = rel.tx_ledger_id
+                      """
+        flag_join = f"""JOIN flag f ON f.target_id = m.id AND f.target_type = '{TxLogical.__name__}'"""
+        facets = {}
+        for facet, value, join in [
+            ("tx_logical_type", "m.tx_logical_type", ""),
+            ("chain", "led.chain", ledger_join),
+            ("symbol", "led.symbol", ledger_join),
+            ("flag", "f.name", flag_join),
+        ]:
+            sql = f"""SELECT {value} AS value, COUNT(DISTINCT m.id) AS count
+                      FROM ({matched_sql}) m
+                      {join}
+                      WHERE {value} IS NOT NULL
+                      GROUP BY {value}
+                      ORDER BY count DESC, value
+                   """
+            facets[facet] = {r["value"]: r["count"] for r in self.db.query(sql, params)}
+
+        return tx_logicals, total, facets
+
+    def refresh_search_index(self):
+        """Rebuild the tx_logical_fts rows the triggers have marked pending. Grouping, events and API writes call this
+        once they're done so searches never have to write."""
+        for sql in [
+            """DELETE FROM tx_logical_fts WHERE rowid IN (SELECT doc_rowid FROM tx_logical_fts_pending)""",
+            """INSERT INTO tx_logical_fts (rowid, description, note, symbols, counterparties, hashes)
+               SELECT doc_rowid, description, note, symbols, counterparties, hashes
+               FROM tx_logical_search_doc
+               WHERE doc_rowid IN (SELECT doc_rowid FROM tx_logical_fts_pending)
+            """,
+            """DELETE FROM tx_logical_fts_pending""",
+        ]:
+            self.db.execute(sql)
+
+    def iter_entity(self, entity_name: str, page_size: int = 500, **filters):
+        """Every tx_logical for an entity oldest first, a keyset page at a time"""
+        cursor = None
+        while True:
+            tx_logicals, cursor = self.keyset_page(
+                entity_name, page_size, cursor, direction="ASC", **filters
+            )
+            yield from tx_logicals
+            if not cursor:
+                return
+
     def find_by_primary_key(self, key):
         sql = """SELECT id from tx_logical WHERE id = ? ORDER BY timestamp ASC"""
         params = [key]
@@ -1079,13 +1519,14 @@ class TxLedgerStore(BaseStore[TxLedger]):
                 "Every TX Ledger should belong to a TxLogical. What happened here for tx_ledger id {ledger.id}"
             )
 
-    def save(self, tx: TxLedger):
-        sql = """REPLACE INTO tx_ledger
+    SAVE_SQL = """REPLACE INTO tx_ledger
              (id, chain, address, hash, from_address, to_address, from_address_name, to_address_name, asset_tx_id, isfee, amount, timestamp, direction, tx_ledger_type, asset_price_id, symbol, price_usd, price_source)
              VALUES
              (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
           """
-        params = [
+
+    def _save_params(self, tx: TxLedger):
+        return [
             tx.id,
             tx.chain,
             tx.address,
@@ -1105,9 +1546,16 @@ class TxLedgerStore(BaseStore[TxLedger]):
             tx.price_usd,
             tx.price_source,
         ]
-        self.db.execute(sql, params)
+
+    def save(self, tx: TxLedger):
+        self.db.execute(self.SAVE_SQL, self._save_params(tx))
         return tx
 
+    def save_many(self, txs: List[TxLedger]):
+        if txs:
+            self.db.execute_many(self.SAVE_SQL, [self._save_params(tx) for tx in txs])
+        return txs
+
 
 class CostbasisLotStore:
     def __init__(self, db):
@@ -1122,10 +1570,12 @@ class CostbasisLotStore:
         params = [kwargs[arg] for arg in kwargs]
         rows = self.db.query(sql, params)
 
+        histories = load_lot_histories([r["history"] for r in rows])
+
         results = []
-        for r in rows:
+        for r, history in zip(rows, histories):
             r_dict = dict(**r)
-            r_dict["history"] = jsonpickle.decode(r["history"])
+            r_dict["history"] = history
             r_dict.pop("flags")
             flags = load_flags(CostbasisLot.__name__, r["tx_ledger_id"])
             lot = CostbasisLot(flags=flags, **r_dict)
@@ -1150,6 +1600,12 @@ class AssetBalanceCurrentStore(BaseStore[AssetBalance]):
 class AssetBalanceHistoryStore(BaseStore[AssetBalance]):
     def __init__(self, db):
         super().__init__(db, "balance_history", AssetBalance)
+        for attr in ["price", "amount", "usd_value"]:
+            super()._add_param_mapping(attr, compact_number)
+        for attr in ["proxy", "extra"]:
+            super()._add_param_mapping(
+                attr, lambda data: store_balance_json(self.db, data)
+            )
 
     def all_for_entity_id(self, id: int):
         sql = """SELECT bc.*
@@ -1159,3 +1615,8 @@ class AssetBalanceHistoryStore(BaseStore[AssetBalance]):
               """
         params = [id]
         return self.db.query(sql, params)
+
+    def value_series_for_entity_id(
+        self, id: int, start: int, end: int, resolution: int = HOUR
+    ):
+        return entity_value_series(self.db, id, start, end, resolution)
@@ -1,15 +1,13 @@
 import json
-import pathlib
-import time
+import os
 from collections import namedtuple, defaultdict
 from datetime import datetime
 
-import httpx
-from currency_converter import CurrencyConverter
-
 from .cache import cache
 from .constants import assets, paths
 from .db import db
+from .fx import FxRates
+from .metrics import metrics
 from .settings import setting
 
 CoinPrice = namedtuple("CoinPrice", ["source", "coin_id", "epoch", "price"])
@@ -107,50 +105,71 @@ def get_coingecko_price_for_day(coin_id, epoch):
             return get_coingecko_price_for_day(coin_id, epoch)
 
 
-# The Currency Converter lib uses the European Central Bank's fx rates file to give day rate conversions for currency pairs.
-def download_latest_ecb_price_file(destination_file):
-    with open(destination_file, "wb") as download_file:
-        url = "https://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist.zip"
-        response = httpx.get(url)
-        download_file.write(response.content)
-    print(f"Updated {destination_file} with latest ECB price file")
+def _get_stored_price(db, coin_id, day_epoch):
+    sql = """SELECT price FROM prices WHERE coin_id = ? AND source = 'coingecko' AND epoch = ?"""
+    r = db.query(sql, (coin_id, day_epoch))
+    return r[0][0] if r else None
 
 
 class PriceFeed:
-    def __init__(self):
+    def __init__(self, offline=None):
         self.prices = defaultdict(lambda: defaultdict(lambda: []))
-        # If we don't yet have an ECB data file, or if it's more than an hour old, get it
-        ecb_path = f"{paths.CACHE_DIR}/eurofxref-hist.zip"
+        # Fiat rates come from the fx_rates table (see perfi.fx); bin/update_fx_rates.py keeps it current
+        self.fx_rates = None
+        # Offline, prices only come from the prices and fx_rates tables (e.g. loaded from a price bundle) and a
+        # missing price is a lookup failure instead of a CoinGecko request
+        if offline is None:
+            offline = os.getenv("PERFI_OFFLINE_PRICES") == "1"
+        self.offline = offline
+
+    def _fx(self) -> FxRates:
         if (
-            not pathlib.Path(ecb_path).exists()
-            or (int(time.time()) - pathlib.Path(ecb_path).stat().st_mtime) > 3600
+            self.fx_rates is None
+            or self.fx_rates.db is not db
+            or self.fx_rates.offline != self.offline
         ):
-            print("Price feed's ECB data file is missing or old, getting a new copy...")
-            download_latest_ecb_price_file(ecb_path)
-        # Use the ECB data file for our currency converter
-        self.currency_converter = CurrencyConverter(
-            ecb_path, decimal=True, fallback_on_missing_rate=True
-        )
+            self.fx_rates = FxRates(db, offline=self.offline)
+        return self.fx_rates
 
     def convert_fiat(self, from_fiat_symbol, to_fiat_symbol, amount, desired_epoch):
-        return (
-            self.currency_converter.convert(
-                amount,
-                from_fiat_symbol,
-                to_fiat_symbol,
-                datetime.fromtimestamp(desired_epoch).date(),
-            ),
-            "currency_converter",
-        )
+        with metrics.timer("perfi_price_lookup", kind="fiat"):
+            return (
+                self._fx().convert(
+                    amount, from_fiat_symbol, to_fiat_symbol, desired_epoch
+                ),
+                "currency_converter",
+            )
 
-    def get(self, coin_id, desired_epoch) -> CoinPrice:
-        try:
-            source, actual_epoch, price = get_coingecko_price_for_day(
-                coin_id, desired_epoch
+    def convert_fiat_many(self, conversions):
+        """convert_fiat for a list of (from_fiat_symbol, to_fiat_symbol, amount, desired_epoch)"""
+        with metrics.timer("perfi_price_lookup", kind="fiat"):
+            converted = self._fx().convert_many(
+                (amount, from_fiat, to_fiat, epoch)
+                for from_fiat, to_fiat, amount, epoch in conversions
             )
+            return [(amount, "currency_converter") for amount in converted]
+
+    def get(self, coin_id, desired_epoch) -> CoinPrice:
+        with metrics.timer("perfi_price_lookup", kind="coin"):
+            # CoinGecko prices are per UTC day; once fetched they're kept in the prices table keyed by the day's epoch
+            day_epoch = int(desired_epoch) // 86400 * 86400
+            price = _get_stored_price(db, coin_id, day_epoch)
+            if price is not None:
+                actual_epoch = datetime.utcfromtimestamp(desired_epoch).timestamp()
+                return CoinPrice("coingecko", coin_id, actual_epoch, price)
+            if self.offline:
+                metrics.inc("perfi_price_lookup_failures_total", kind="coin")
+                return None
+
+            try:
+                source, actual_epoch, price = get_coingecko_price_for_day(
+                    coin_id, desired_epoch
+                )
+            except:
+                metrics.inc("perfi_price_lookup_failures_total", kind="coin")
+                return None
+            _add_price_to_db(db, CoinPrice("coingecko", coin_id, day_epoch, price))
             return CoinPrice("coingecko", coin_id, actual_epoch, price)
-        except:
-            pass
 
     def get_by_asset_tx_id(self, chain, asset_tx_id, timestamp) -> CoinPrice:
         asset_price = self.map_asset(chain, asset_tx_id)
@@ -173,6 +192,7 @@ class PriceFeed:
         if chain.startswith("import."):
             chain = "import"
 
+        metrics.inc("perfi_price_map_asset_total")
         tx_key = f"{chain}:{asset_tx_id}"
         canonical_key = None
         symbol = None
@@ -0,0 +1,189 @@
+"""
+Offline price bundles
+
+A bundle is the prices table (and the fx_rates table) for a set of assets and a date range, stored column by column
+so a prepared price set can be shipped to another machine or worker and imported before running cost basis with
+PERFI_OFFLINE_PRICES=1 (see PriceFeed). Columns are dictionary encoded (coin ids, symbols, sources, currencies) and
+delta encoded (epochs, days) so the LZMA'd JSON stays small.
+"""
+import json
+import lzma
+from datetime import date, datetime
+from itertools import accumulate
+from typing import List, Optional
+
+BUNDLE_FORMAT = "perfi-price-bundle"
+BUNDLE_VERSION = 1
+
+
+class PriceBundleError(Exception):
+    pass
+
+
+def _dictionary_encode(values):
+    dictionary = []
+    indexes = {}
+    encoded = []
+    for value in values:
+        if value not in indexes:
+            indexes[value] = len(dictionary)
+            dictionary.append(value)
+        encoded.append(indexes[value])
+    return dictionary, encoded
+
+
+def _delta_encode(values):
+    previous = 0
+    deltas = []
+    for value in values:
+        deltas.append(value - previous)
+        previous = value
+    return deltas
+
+
+def _in_clause(column, values, params):
+    params.extend(values)
+    return f"{column} IN ({','.join('?' * len(values))})"
+
+
+def entity_coin_ids(db, entity_name, price_feed=None) -> List[str]:
+    """
+    The prices an entity's cost basis needs: the asset_price_ids on its ledgers, plus what PriceFeed.map_asset maps
+    each ledger's asset to (the COSTBASIS_LIKEKIND ids and symbol fallbacks costbasis prices lots with)
+    """
+    if price_feed is None:
+        from .price import price_feed
+    sql = """SELECT DISTINCT l.asset_price_id, l.chain, l.asset_tx_id
+             FROM tx_ledger l
+             JOIN address a on a.address = l.address
+             JOIN entity e on e.id = a.entity_id
+             WHERE e.name = ?
+          """
+    coin_ids = set()
+    for r in db.query(sql, entity_name):
+        if r["asset_price_id"]:
+            coin_ids.add(r["asset_price_id"])
+        if not r["chain"] or not r["asset_tx_id"]:
+            continue
+        mapped = price_feed.map_asset(r["chain"], r["asset_tx_id"])
+        if not mapped:
+            mapped = price_feed.map_asset(
+                r["chain"], r["asset_tx_id"], symbol_fallback=True
+            )
+        if mapped:
+            coin_ids.add(mapped["asset_price_id"])
+    return sorted(coin_ids)
+
+
+def export_price_bundle(
+    db,
+    path,
+    coin_ids: Optional[List[str]] = None,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> dict:
+    """Write prices for coin_ids (all if None) and fx rates between the start and end epochs (inclusive) to path"""
+    where = []
+    params = []
+    if coin_ids:
+        where.append(_in_clause("coin_id", coin_ids, params))
+    if start is not None:
+        where.append("epoch >= ?")
+        params.append(start)
+    if end is not None:
+        where.append("epoch <= ?")
+        params.append(end)
+    sql = f"""SELECT coin_id, symbol, source, epoch, price
+              FROM prices
+              {'WHERE ' + ' AND '.join(where) if where else ''}
+              ORDER BY coin_id, source, epoch
+           """
+    prices = db.query(sql, params)
+
+    where = []
+    params = []
+    if start is not None:
+        where.append("day >= ?")
+        params.append(datetime.utcfromtimestamp(start).date().isoformat())
+    if end is not None:
+        where.append("day <= ?")
+        params.append(datetime.utcfromtimestamp(end).date().isoformat())
+    sql = f"""SELECT currency, day, rate
+              FROM fx_rates
+              {'WHERE ' + ' AND '.join(where) if where else ''}
+              ORDER BY currency, day
+           """
+    fx_rates = db.query(sql, params)
+
+    coin_dictionary, coins = _dictionary_encode(r["coin_id"] for r in prices)
+    symbol_dictionary, symbols = _dictionary_encode(r["symbol"] for r in prices)
+    source_dictionary, sources = _dictionary_encode(r["source"] for r in prices)
+    currency_dictionary, currencies = _dictionary_encode(
+        r["currency"] for r in fx_rates
+    )
+    bundle = {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "prices": {
+            "coin_ids": coin_dictionary,
+            "coin_id": coins,
+            "symbols": symbol_dictionary,
+            "symbol": symbols,
+            "sources": source_dictionary,
+            "source": sources,
+            "epoch": _delta_encode(r["epoch"] for r in prices),
+            "price": [r["price"] for r in prices],
+        },
+        "fx_rates": {
+            "currencies": currency_dictionary,
+            "currency": currencies,
+            "day": _delta_encode(
+                date.fromisoformat(r["day"]).toordinal() for r in fx_rates
+            ),
+            "rate": [r["rate"] for r in fx_rates],
+        },
+    }
+    with lzma.open(path, "wt") as f:
+        json.dump(bundle, f, separators=(",", ":"))
+    return {"prices": len(prices), "fx_rates": len(fx_rates)}
+
+
+def import_price_bundle(db, path) -> dict:
+    """Load a bundle written by export_price_bundle, replacing any prices and fx rates it overlaps"""
+    try:
+        with lzma.open(path, "rt") as f:
+            bundle = json.load(f)
+    except (lzma.LZMAError, ValueError) as err:
+        raise PriceBundleError(f"{path} is not a price bundle: {err}")
+    if bundle.get("format") != BUNDLE_FORMAT or bundle.get("version") != BUNDLE_VERSION:
+        raise PriceBundleError(f"{path} is not a version {BUNDLE_VERSION} price bundle")
+
+    p = bundle["prices"]
+    prices = list(
+        zip(
+            (p["coin_ids"][i] for i in p["coin_id"]),
+            (p["symbols"][i] for i in p["symbol"]),
+            (p["sources"][i] for i in p["source"]),
+            accumulate(p["epoch"]),
+            p["price"],
+        )
+    )
+    if prices:
+        sql = """REPLACE INTO prices (coin_id, symbol, source, epoch, price) VALUES (?, ?, ?, ?, ?)"""
+        db.execute_many(sql, prices)
+
+    fx = bundle["fx_rates"]
+    fx_rates = list(
+        zip(
+            (fx["currencies"][i] for i in fx["currency"]),
+            (date.fromordinal(d).isoformat() for d in accumulate(fx["day"])),
+            fx["rate"],
+        )
+    )
+    if fx_rates:
+        sql = (
+            """INSERT OR REPLACE INTO fx_rates (currency, day, rate) VALUES (?, ?, ?)"""
+        )
+        db.execute_many(sql, fx_rates)
+
+    return {"prices": len(prices), "fx_rates": len(fx_rates)}
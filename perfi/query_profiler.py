@@ -0,0 +1,169 @@
+"""
+Optional per-statement SQL profiling for perfi.db.DB
+
+Turn it on with PERFI_PROFILE_SQL=1 (PERFI_SLOW_QUERY_MS sets the slow-query threshold, default 100ms) or
+DB.enable_profiling(). Statements are aggregated by normalized SQL text, slow statements are logged to
+logs/slow_queries.log, the first time a statement is seen its EXPLAIN QUERY PLAN is captured if it scans
+a whole table, and the stats are written to logs/sql_profile-<db>-<pid>.json at exit for `cli.py db top_queries`.
+Each process writes its own file, so parallel workers don't overwrite each other; the report merges them.
+"""
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+
+from .constants.paths import LOG_DIR
+
+DEFAULT_SLOW_QUERY_MS = 100
+SLOW_QUERY_LOG_PATH = f"{LOG_DIR}/slow_queries.log"
+
+slow_query_logger = logging.getLogger("perfi.db.slow")
+
+# A bare "SCAN <table>" in a plan means no index is used (a covering index scan says "USING ... INDEX")
+FULL_SCAN_RE = re.compile(r"^SCAN (\w+)$")
+STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+PARAM_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace and literals so the same statement built with different values aggregates together"""
+    sql = STRING_LITERAL_RE.sub("?", sql)
+    sql = NUMBER_LITERAL_RE.sub("?", sql)
+    sql = WHITESPACE_RE.sub(" ", sql).strip()
+    # IN (?, ?, ?) lists vary in length with the data
+    sql = PARAM_LIST_RE.sub("(?...)", sql)
+    return sql
+
+
+@dataclass
+class StatementStats:
+    sql: str
+    calls: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    slow_calls: int = 0
+    full_scans: List[str] = field(default_factory=list)
+    plan: Optional[List[str]] = None
+
+    @property
+    def avg_ms(self):
+        return self.total_ms / self.calls if self.calls else 0.0
+
+
+class QueryProfiler:
+    def __init__(self, db_name: str, slow_ms: float = DEFAULT_SLOW_QUERY_MS):
+        self.db_name = db_name
+        self.slow_ms = slow_ms
+        self.lock = threading.Lock()
+        self.stats: Dict[str, StatementStats] = {}
+
+        if not slow_query_logger.handlers:
+            handler = logging.FileHandler(SLOW_QUERY_LOG_PATH)
+            handler.setFormatter(
+                logging.Formatter("%(asctime)s : %(levelname)-8s : %(message)s")
+            )
+            slow_query_logger.addHandler(handler)
+            slow_query_logger.setLevel(logging.INFO)
+            slow_query_logger.propagate = False
+
+    @contextmanager
+    def measure(self, con, sql, params):
+        normalized = normalize_sql(sql)
+        with self.lock:
+            stats = self.stats.get(normalized)
+            first_call = stats is None
+            if first_call:
+                stats = self.stats[normalized] = StatementStats(normalized)
+        if first_call:
+            # The plan is looked up before running since EXPLAIN doesn't touch the caller's cursor or data
+            self.capture_plan(con, stats, sql, params)
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self.lock:
+                stats.calls += 1
+                stats.total_ms += elapsed_ms
+                stats.max_ms = max(stats.max_ms, elapsed_ms)
+                if elapsed_ms >= self.slow_ms:
+                    stats.slow_calls += 1
+            if elapsed_ms >= self.slow_ms:
+                slow_query_logger.info(
+                    f"{self.db_name} {elapsed_ms:.1f}ms: {normalized}"
+                )
+
+    def capture_plan(self, con, stats: StatementStats, sql, params):
+        if not sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "WITH")):
+            return
+        try:
+            rows = con.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        except Exception:
+            # Statements EXPLAIN can't take as-is just go without a plan
+            return
+        plan = [r[3] for r in rows]
+        full_scans = [m.group(1) for m in map(FULL_SCAN_RE.match, plan) if m]
+        if full_scans:
+            stats.plan = plan
+            stats.full_scans = full_scans
+
+    def top(self, n: int = 20) -> List[StatementStats]:
+        with self.lock:
+            stats = list(self.stats.values())
+        return sorted(stats, key=lambda s: s.total_ms, reverse=True)[:n]
+
+    def save(self, path: Optional[str] = None):
+        path = path or profile_path(self.db_name)
+        with self.lock:
+            statements = [asdict(s) for s in self.stats.values()]
+        with open(path, "w") as f:
+            json.dump(
+                dict(db=self.db_name, slow_ms=self.slow_ms, statements=statements),
+                f,
+                indent=2,
+            )
+
+
+def profile_path(db_name: str, pid: Optional[int] = None) -> str:
+    return f"{LOG_DIR}/sql_profile-{db_name}-{pid or os.getpid()}.json"
+
+
+def profile_paths(db_name: str) -> List[str]:
+    """Every process's profile for a DB"""
+    return sorted(
+        glob.glob(f"{LOG_DIR}/sql_profile-{glob.escape(db_name)}-[0-9]*.json")
+    )
+
+
+def load_profile(path: str) -> List[StatementStats]:
+    with open(path) as f:
+        profile = json.load(f)
+    return [StatementStats(**s) for s in profile["statements"]]
+
+
+def load_profiles(paths: List[str]) -> List[StatementStats]:
+    """Merge several processes' profiles into one set of stats per statement"""
+    merged: Dict[str, StatementStats] = {}
+    for path in paths:
+        for s in load_profile(path):
+            stats = merged.get(s.sql)
+            if stats is None:
+                merged[s.sql] = s
+                continue
+            stats.calls += s.calls
+            stats.total_ms += s.total_ms
+            stats.max_ms = max(stats.max_ms, s.max_ms)
+            stats.slow_calls += s.slow_calls
+            if s.plan and not stats.plan:
+                stats.plan = s.plan
+                stats.full_scans = s.full_scans
+    return list(merged.values())
@@ -0,0 +1,161 @@
+"""
+JSON-RPC tx and receipt lookups
+
+Each chain gets one shared RPCClient. Lookups go out as JSON-RPC batches (up to RPC_BATCH_SIZE calls per HTTP
+request, so a tx and its receipt or a whole wallet's receipts are one round-trip) and the results are kept as
+compact JSON in the cache DB's rpc_tx table, keyed by (chain, hash).
+"""
+import json
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from .cache import cache
+from .db import db
+from .metrics import metrics
+from .settings import setting
+
+RPC_BATCH_SIZE = 100
+# SQLite's default limit on host parameters is 999
+LOOKUP_CHUNK_SIZE = 500
+
+# Chains whose nodes don't speak the eth_ method names
+RPC_METHODS = dict(
+    harmony=("hmyv2_getTransactionByHash", "hmyv2_getTransactionReceipt"),
+)
+DEFAULT_RPC_METHODS = ("eth_getTransactionByHash", "eth_getTransactionReceipt")
+
+
+class RPCError(Exception):
+    pass
+
+
+def rpc_url(chain):
+    if chain == "boba":
+        return "https://mainnet.boba.network"
+    if chain == "harmony":
+        return "https://api.s0.t.hmny.io"
+    if chain == "optimism":
+        return f"https://opt-mainnet.g.alchemy.com/v2/{setting(db).get('ALCHEMY_KEY')}"
+    raise RPCError(f"No RPC endpoint for chain {chain}")
+
+
+class RPCClient:
+    def __init__(self, chain, url=None):
+        self.chain = chain
+        self.url = url or rpc_url(chain)
+        self.tx_method, self.receipt_method = RPC_METHODS.get(
+            chain, DEFAULT_RPC_METHODS
+        )
+
+    def batch(self, calls: List[Tuple[str, list]]) -> list:
+        """Make [(method, params), ...] calls and return their results in the same order"""
+        results = []
+        for i in range(0, len(calls), RPC_BATCH_SIZE):
+            chunk = calls[i : i + RPC_BATCH_SIZE]
+            payload = [
+                dict(jsonrpc="2.0", id=id, method=method, params=params)
+                for id, (method, params) in enumerate(chunk)
+            ]
+            r = cache._client().post(self.url, json=payload, timeout=30.0)
+            if r.status_code != 200:
+                raise RPCError(
+                    f"Got response status {r.status_code} from {self.chain} RPC: {r.text}"
+                )
+
+            responses = r.json()
+            # Nodes answer a batch they won't run with a single error object
+            if not isinstance(responses, list):
+                raise RPCError(f"Bad batch response from {self.chain} RPC: {responses}")
+            by_id = {}
+            for response in responses:
+                if response.get("error"):
+                    method = chunk[response["id"]][0]
+                    raise RPCError(
+                        f"{method} failed on {self.chain} RPC: {response['error']}"
+                    )
+                by_id[response["id"]] = response.get("result")
+            results.extend(by_id.get(id) for id in range(len(chunk)))
+        return results
+
+    def lookup(
+        self, hashes: Iterable[str], tx=True, receipt=True
+    ) -> Dict[str, Dict[str, dict]]:
+        """{hash: {"tx": ..., "receipt": ...}}, only asking the node for what isn't stored yet"""
+        hashes = list(dict.fromkeys(h.strip() for h in hashes))
+        stored = self._load(hashes)
+
+        calls = []
+        wanted = []
+        for hash in hashes:
+            saved = stored.setdefault(hash, {})
+            if tx and saved.get("tx") is None:
+                calls.append((self.tx_method, [hash]))
+                wanted.append((hash, "tx"))
+            if receipt and saved.get("receipt") is None:
+                calls.append((self.receipt_method, [hash]))
+                wanted.append((hash, "receipt"))
+        metrics.inc(
+            "perfi_cache_hits_total",
+            len(hashes) * (tx + receipt) - len(calls),
+            kind="rpc",
+        )
+        metrics.inc("perfi_cache_misses_total", len(calls), kind="rpc")
+
+        if calls:
+            for (hash, kind), result in zip(wanted, self.batch(calls)):
+                stored[hash][kind] = result
+            self._save({hash: stored[hash] for hash, _ in wanted})
+
+        return {hash: stored[hash] for hash in hashes}
+
+    def get_receipt(self, hash) -> dict:
+        return self.lookup([hash], tx=False)[hash.strip()]["receipt"]
+
+    def _load(self, hashes):
+        stored = {}
+        for i in range(0, len(hashes), LOOKUP_CHUNK_SIZE):
+            chunk = hashes[i : i + LOOKUP_CHUNK_SIZE]
+            sql = f"""SELECT hash, tx_json, receipt_json FROM rpc_tx
+                      WHERE chain = ? AND hash IN ({", ".join("?" * len(chunk))})
+                   """
+            with cache.db_lock:
+                rows = cache.db.query(sql, [self.chain, *chunk])
+            for r in rows:
+                stored[r["hash"]] = dict(
+                    tx=json.loads(r["tx_json"]) if r["tx_json"] else None,
+                    receipt=json.loads(r["receipt_json"])
+                    if r["receipt_json"]
+                    else None,
+                )
+        return stored
+
+    def _save(self, found):
+        def compact(value):
+            return (
+                json.dumps(value, separators=(",", ":")) if value is not None else None
+            )
+
+        sql = """REPLACE INTO rpc_tx
+                 (chain, hash, tx_json, receipt_json, saved)
+                 VALUES
+                 (?, ?, ?, ?, ?)
+              """
+        t = int(time.time())
+        params = [
+            [self.chain, hash, compact(v.get("tx")), compact(v.get("receipt")), t]
+            for hash, v in found.items()
+        ]
+        with cache.db_lock:
+            cache.db.execute_many(sql, params)
+
+
+rpc_clients: Dict[str, RPCClient] = {}
+rpc_clients_lock = threading.Lock()
+
+
+def rpc_client(chain) -> RPCClient:
+    with rpc_clients_lock:
+        if chain not in rpc_clients:
+            rpc_clients[chain] = RPCClient(chain)
+        return rpc_clients[chain]
@@ -8,12 +8,13 @@ from pprint import pprint
 
 import arrow
 from tqdm import tqdm
-from web3 import Web3
 
 from perfi.constants.assets import CHAIN_FEE_ASSETS
 from ..db import db
-from ..models import TxLedgerStore, TxLedger
+from ..metrics import metrics
+from ..models import TxLedgerStore, TxLedgerRow
 from ..price import price_feed
+from ..rpc import rpc_client
 
 messages = (
     []
@@ -34,6 +35,7 @@ class UnscrapedChainError(Exception):
         self.message = message
 
 
+@metrics.timed_stage("ledger")
 def update_entity_transactions(entity_name):
     logger.debug(f"Entity: {entity_name}")
     logger.debug("---")
@@ -73,6 +75,11 @@ def update_wallet_ledger_transactions(address):
         """
     results = db.query(sql, address)
 
+    # Fetch the receipts Boba fees need in a few batched requests instead of one request per tx
+    boba_hashes = [r[2] for r in results if r[0] == "boba"]
+    if boba_hashes:
+        rpc_client("boba").lookup(boba_hashes, tx=False)
+
     ledger_txs = []
 
     for tx_chain in tqdm(results, desc="Generate Ledger TXs", disable=None):
@@ -230,19 +237,39 @@ def update_wallet_ledger_transactions(address):
                 ledger_txs.append(tx)
 
     # Now we have all our ledger_txs, so lets put them into the tx_ledger table in the DB
-    tx_ledger_store = TxLedgerStore(db)
+    # This address's ledgers were all deleted above, so duplicate ids only need checking within this batch
+    seen_ids = set()
+    tx_ledgers = []
     for tx in tqdm(ledger_txs, desc="Saving Ledger TXs", disable=None):
-        tx.generate_id()
+        tx.generate_id(seen_ids)
         tx.assign_tx_ledger_type()
         tx.assign_price()
-        tx_ledger_store.save(tx.as_tx_ledger())
-        logger.debug(f"Inserted ledger_tx {tx.id}")
+        tx_ledgers.append(tx.as_tx_ledger())
+    TxLedgerStore(db).save_many(tx_ledgers)
+    logger.debug(f"Inserted {len(tx_ledgers)} ledger_txs for {address}")
+
+
+TX_LEDGER_REQUIRED_FIELDS = [
+    "chain",
+    "address",
+    "hash",
+    "from_address",
+    "to_address",
+    "asset_tx_id",
+    "amount",
+    "direction",
+]
+
+
+def to_decimal(value):
+    if value is None or isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
 
 
 # This will look at a Boba transaction hash to determine if its fee was in Boba or ETH
 def get_boba_fee_asset(hash: str):
-    w3 = Web3(Web3.HTTPProvider("https://mainnet.boba.network"))
-    receipt = w3.eth.getTransactionReceipt(hash)
+    receipt = rpc_client("boba").get_receipt(hash)
     if receipt["l2BobaFee"] != "0x0":
         return "boba"
     else:
@@ -303,7 +330,7 @@ class LedgerTx:
              debank_name : {self.debank_name or '__None__'}
              """
 
-    def generate_id(self):
+    def generate_id(self, seen_ids: set):
         # Generate UUID
         try:
             id_to_hash = (
@@ -323,19 +350,16 @@ class LedgerTx:
             logger.debug(err)
             raise
 
-        # TODO: We need to check the corner case if we have multiple identical tx's - eg, receiving 5 ETH to the same address in the same block
-        # If this ever happens, then the tx_ledger is no longer idempotent and can't replay an event_stream deterministically
-        # If this happens we can avoid this by summing txs with the same asset_tx_id
-        sql = """SELECT COUNT(id) from tx_ledger WHERE id = ?"""
-        params = [self.id]
-        result = db.query(sql, params)
-        if result[0][0] > 1:
-            logger.debug(self)
-            raise Exception(
-                f"{result[0][0]} results- Duplicate ledger_tx: {self.id} hash: {self.hash}"
-            )
+        # Identical transfers (eg, receiving 5 ETH twice to the same address in the same tx) hash to the same id, so
+        # each repeat gets its occurrence index hashed in too. The repeats are indistinguishable, so the ids come out
+        # the same however they're ordered and the tx_ledger stays idempotent for event replay
+        occurrence = 0
+        while self.id in seen_ids:
+            occurrence += 1
+            self.id = hashlib.sha256(f"{id_to_hash}#{occurrence}".encode()).hexdigest()
+        seen_ids.add(self.id)
 
-        return id
+        return self.id
 
     def normalize_asset(self, chain, token_id):
         sql = """SELECT symbol, asset_price_id
@@ -544,6 +568,7 @@ class LedgerTx:
                 self.price_source = coin_price.source
 
     def as_tx_ledger(self):
+        # TxLedgerRow doesn't coerce like the TxLedger model does, and DeBank gives us floats
         args = dict(
             id=self.id,
             chain=self.chain,
@@ -554,21 +579,21 @@ class LedgerTx:
             from_address_name=self.from_address_name,
             to_address_name=self.to_address_name,
             asset_tx_id=self.asset_tx_id,
-            isfee=self.isfee,
-            amount=self.amount,
-            timestamp=self.timestamp,
+            isfee=int(self.isfee),
+            amount=to_decimal(self.amount),
+            timestamp=int(self.timestamp),
             direction=self.direction,
             tx_ledger_type=self.tx_ledger_type,
             asset_price_id=self.asset_price_id,
             symbol=self.symbol,
-            price_usd=self.price_usd,
+            price_usd=to_decimal(self.price_usd),
             price_source=self.price_source,
         )
-        try:
-            return TxLedger(**args)
-        except Exception as err:
+        missing = [k for k in TX_LEDGER_REQUIRED_FIELDS if args[k] is None]
+        if missing:
             print(args)
-            raise err
+            raise ValueError(f"TxLedger is missing {', '.join(missing)}")
+        return TxLedgerRow(**args)
 
 
 class TxTyper:
@@ -2,7 +2,9 @@ import os
 
 from ..db import db
 from ..events import EventStore, EVENT_ACTION
-from ..models import TxLedger, TxLogical
+from ..metrics import metrics
+from ..models import TxLedgerRow, TxLogical, TxLogicalStore, TX_LEDGER_ROW_COLUMNS
+from ..tx_stream import refresh_entity_tx_stream
 
 import argparse
 from collections import namedtuple, defaultdict
@@ -32,6 +34,7 @@ class TransactionLogicalGrouper:
         self._print = print
         self.event_store = event_store
 
+    @metrics.timed_stage("grouping")
     def update_entity_transactions(self, skip_regeneration=False):
         logger.debug(f"Entity: {self.entity}")
         logger.debug("---")
@@ -51,13 +54,18 @@ class TransactionLogicalGrouper:
 
             self.update_wallet_logical_transactions(address, skip_regeneration)
 
+        # Regrouped tx_logicals were marked pending along the way, rebuild their entity_tx_stream rows and search index
+        # entries once at the end
+        refresh_entity_tx_stream()
+        TxLogicalStore(db).refresh_search_index()
+
     def update_wallet_logical_transactions(self, address, skip_regeneration):
         logger.debug(f"Updating {address}")
-        sql = """SELECT id, chain, address, hash, from_address, to_address, from_address_name, to_address_name, asset_tx_id, isfee, amount, timestamp, direction, tx_ledger_type, asset_price_id, symbol, price_usd
+        sql = f"""SELECT {TX_LEDGER_ROW_COLUMNS}
                FROM tx_ledger
                WHERE address = ?
             """
-        tx_ledgers = list(db.query(sql, address))
+        tx_ledgers = [TxLedgerRow(*r) for r in db.query(sql, address)]
         logger.debug(f"{len(tx_ledgers)} of tx_ledgers")
 
         # First Pass is going to insert a tx_logical for every tx_ledger (we need this for idempotency to be able to replay events)
@@ -71,9 +79,7 @@ class TransactionLogicalGrouper:
                  VALUES
                  (?, ?, ?, ?)
               """
-            tx_ledger = TxLedger(**tx)
-
-            params = [tx_ledger.id, address, 1, tx_ledger.timestamp]
+            params = [tx.id, address, 1, tx.timestamp]
             db.execute(sql, params)
 
             sql = """REPLACE INTO tx_rel_ledger_logical
@@ -81,14 +87,13 @@ class TransactionLogicalGrouper:
                  VALUES
                  (?, ?, ?)
               """
-            params = [tx_ledger.id, tx_ledger.id, 0]
+            params = [tx.id, tx.id, 0]
             db.execute(sql, params)
 
         # Second pass is to group all our transaction by hash
         tx_logicals_by_hash = defaultdict(list)
-        for tx in tqdm(tx_ledgers, desc="Group TXs by Hash   ", disable=None):
+        for tx_ledger in tqdm(tx_ledgers, desc="Group TXs by Hash   ", disable=None):
             # 1. Group all tx_logicals by the tx hash
-            tx_ledger = TxLedger(**tx)
             tx_logicals_by_hash[tx_ledger.hash].append(tx_ledger)
 
         for hash in tqdm(
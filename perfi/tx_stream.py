@@ -0,0 +1,168 @@
+"""
+Per-entity transaction stream
+
+entity_tx_stream is the tx_logical ⨝ tx_rel_ledger_logical ⨝ tx_ledger ⨝ flag join, denormalized to one row per
+tx_ledger per entity and kept in (entity, timestamp) order, so reading an entity's history (the 8949 ledger sheet,
+exports, the API) is one indexed range scan instead of a query per tx_logical. Each row carries its tx_logical's id,
+type and flags (as a TX_LOGICAL_FLAG bitmask).
+
+Triggers (migrations/0007_entity_tx_stream.sql) mark the tx_logicals whose rows changed as pending;
+refresh_entity_tx_stream rebuilds just those tx_logicals. Grouping refreshes when it's done and entity_tx_stream
+refreshes before it reads, so events applied since (e.g. from the CLI) are always picked up.
+"""
+import logging
+from typing import List, Optional
+
+from .db import db
+from .models import TX_LOGICAL_FLAG, TxLogical
+
+logger = logging.getLogger(__name__)
+
+# tx_logical ids per refresh query, well under SQLite's bound parameter limit
+REFRESH_BATCH_SIZE = 500
+
+# entity_tx_stream.flags bits. These are stored, so never renumber or reuse one; give new flags the next free bit.
+TX_LOGICAL_FLAG_BITS = {
+    TX_LOGICAL_FLAG.unknown_send.value: 1 << 0,
+    TX_LOGICAL_FLAG.zero_price.value: 1 << 1,
+    TX_LOGICAL_FLAG.auto_reconciled.value: 1 << 2,
+    TX_LOGICAL_FLAG.ignored_from_costbasis.value: 1 << 3,
+    TX_LOGICAL_FLAG.hidden_from_8949.value: 1 << 4,
+}
+
+STREAM_COLUMNS = [
+    "entity",
+    "timestamp",
+    "tx_logical_id",
+    "ledger_timestamp",
+    "tx_ledger_id",
+    "address",
+    "tx_logical_type",
+    "flags",
+    "chain",
+    "hash",
+    "from_address",
+    "to_address",
+    "asset_tx_id",
+    "isfee",
+    "amount",
+    "direction",
+    "tx_ledger_type",
+    "asset_price_id",
+    "symbol",
+    "price_usd",
+]
+
+
+def flags_bitmask(names) -> int:
+    bitmask = 0
+    for name in names:
+        if name in TX_LOGICAL_FLAG_BITS:
+            bitmask |= TX_LOGICAL_FLAG_BITS[name]
+        else:
+            logger.warning(
+                f"Flag {name} isn't a TX_LOGICAL_FLAG, leaving it out of entity_tx_stream"
+            )
+    return bitmask
+
+
+def flag_names(bitmask: int) -> List[str]:
+    """The TX_LOGICAL_FLAG values set in an entity_tx_stream flags bitmask, in bit order"""
+    return [name for name, bit in TX_LOGICAL_FLAG_BITS.items() if bitmask & bit]
+
+
+def refresh_entity_tx_stream() -> int:
+    """Rebuild the entity_tx_stream rows for the tx_logicals the triggers have marked pending, returns rows written"""
+    pending = [
+        r["tx_logical_id"]
+        for r in db.query("""SELECT tx_logical_id FROM entity_tx_stream_pending""")
+    ]
+    written = 0
+    for i in range(0, len(pending), REFRESH_BATCH_SIZE):
+        batch = pending[i : i + REFRESH_BATCH_SIZE]
+        in_batch = ",".join("?" * len(batch))
+
+        sql = f"""SELECT target_id, name
+                  FROM flag
+                  WHERE target_type = ?
+                  AND target_id IN ({in_batch})
+               """
+        flags = {}
+        for r in db.query(sql, [TxLogical.__name__, *batch]):
+            flags.setdefault(r["target_id"], []).append(r["name"])
+
+        sql = f"""SELECT e.name AS entity,
+                         coalesce(log.timestamp, 0) AS timestamp,
+                         log.id AS tx_logical_id,
+                         coalesce(led.timestamp, 0) AS ledger_timestamp,
+                         led.id AS tx_ledger_id,
+                         log.address,
+                         log.tx_logical_type,
+                         led.chain,
+                         led.hash,
+                         led.from_address,
+                         led.to_address,
+                         led.asset_tx_id,
+                         led.isfee,
+                         led.amount,
+                         led.direction,
+                         led.tx_ledger_type,
+                         led.asset_price_id,
+                         led.symbol,
+                         led.price_usd
+                  FROM tx_logical log
+                  JOIN tx_rel_ledger_logical rel ON rel.tx_logical_id = log.id
+                  JOIN tx_ledger led ON led.id = rel.tx_ledger_id
+                  JOIN (SELECT DISTINCT address, entity_id FROM address) a ON a.address = log.address
+                  JOIN entity e ON e.id = a.entity_id
+                  WHERE log.id IN ({in_batch})
+               """
+        rows = []
+        for r in db.query(sql, batch):
+            rows.append(
+                [
+                    *[r[c] for c in STREAM_COLUMNS[:7]],
+                    flags_bitmask(flags.get(r["tx_logical_id"], [])),
+                    *[r[c] for c in STREAM_COLUMNS[8:]],
+                ]
+            )
+
+        sql = f"""DELETE FROM entity_tx_stream WHERE tx_logical_id IN ({in_batch})"""
+        db.execute(sql, batch)
+        if rows:
+            sql = f"""INSERT OR REPLACE INTO entity_tx_stream
+                      ({", ".join(STREAM_COLUMNS)})
+                      VALUES
+                      ({", ".join("?" * len(STREAM_COLUMNS))})
+                   """
+            db.execute_many(sql, rows)
+        sql = f"""DELETE FROM entity_tx_stream_pending WHERE tx_logical_id IN ({in_batch})"""
+        db.execute(sql, batch)
+        written += len(rows)
+
+    if pending:
+        logger.debug(
+            f"Refreshed entity_tx_stream for {len(pending)} tx_logicals ({written} rows)"
+        )
+    return written
+
+
+def entity_tx_stream(
+    entity: str, start: Optional[int] = None, end: Optional[int] = None
+):
+    """An entity's ledgers oldest first, grouped by tx_logical, with tx_logical timestamps in [start, end)"""
+    refresh_entity_tx_stream()
+    where = ["entity = ?"]
+    params = [entity]
+    if start is not None:
+        where.append("timestamp >= ?")
+        params.append(start)
+    if end is not None:
+        where.append("timestamp < ?")
+        params.append(end)
+    sql = f"""SELECT {", ".join(STREAM_COLUMNS)}
+              FROM entity_tx_stream
+              WHERE {" AND ".join(where)}
+              ORDER BY entity, timestamp, tx_logical_id, ledger_timestamp, tx_ledger_id
+           """
+    return db.query(sql, params)
@@ -1,4 +1,5 @@
 import datetime
+import json
 import time
 import uuid
 from decimal import Decimal
@@ -26,6 +27,7 @@ from perfi.models import (
     TxLedgerStore,
     TX_LOGICAL_FLAG,
     AssetBalanceCurrentStore,
+    AssetBalanceHistoryStore,
     AssetBalance,
 )
 
@@ -302,6 +304,143 @@ def test_list_tx_logicals(test_db):
     assert response.status_code == 200
 
 
+def test_keyset_paginate_and_export_tx_logicals(test_db):
+    entity = EntityStore(test_db).create(name="Foo")
+    address = AddressStore(test_db).create(
+        "foo", Chain.ethereum, "0x123", entity_id=entity.id
+    )
+
+    tx_logical_store = TxLogicalStore(test_db)
+    created = []
+    for i, timestamp in enumerate([1, 2, 2, 3, 4]):
+        type = TX_LOGICAL_TYPE.receive if i % 2 else TX_LOGICAL_TYPE.send
+        tx_logical = make_tx_logical(
+            entity_name=entity.name,
+            address=address.address,
+            timestamp=timestamp,
+            tx_ledgers=[
+                make_tx_ledger(address.address, "OUT", "send", timestamp=timestamp),
+            ],
+            tx_logical_type=type,
+        )
+        created.append(tx_logical_store._create_for_tests(tx_logical))
+    expected = [t.id for t in sorted(created, key=lambda t: (t.timestamp, t.id))]
+
+    ids = []
+    cursor = None
+    while True:
+        params = dict(limit=2, **({"cursor": cursor} if cursor else {}))
+        response = client.get(f"/entities/{entity.id}/tx_logicals/", params=params)
+        assert response.status_code == 200
+        ids += [t["id"] for t in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert ids == list(reversed(expected))
+
+    response = client.get(
+        f"/entities/{entity.id}/tx_logicals/",
+        params=dict(tx_logical_type="receive", start=2),
+    )
+    assert [t["id"] for t in response.json()] == [
+        t.id
+        for t in sorted(created, key=lambda t: (t.timestamp, t.id), reverse=True)
+        if t.tx_logical_type == "receive"
+    ]
+
+    # Offset pages (page=1 onward) keep the same order and filters
+    pages = [
+        client.get(
+            f"/entities/{entity.id}/tx_logicals/",
+            params=dict(limit=1, page=page, start=2),
+        ).json()
+        for page in range(1, 4)
+    ]
+    assert [t["id"] for page in pages for t in page] == list(reversed(expected))[1:4]
+
+    response = client.get(
+        f"/entities/{entity.id}/tx_logicals/", params=dict(cursor="x")
+    )
+    assert response.status_code == 400
+
+    response = client.get(f"/entities/{entity.id}/tx_logicals.ndjson")
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [t["id"] for t in lines] == expected
+
+
+def test_search_tx_logicals(test_db):
+    entity = EntityStore(test_db).create(name="Foo")
+    address = AddressStore(test_db).create(
+        "foo", Chain.ethereum, "0x123", entity_id=entity.id
+    )
+
+    tx_logical_store = TxLogicalStore(test_db)
+    swap = tx_logical_store._create_for_tests(
+        make_tx_logical(
+            entity_name=entity.name,
+            address=address.address,
+            timestamp=2,
+            tx_ledgers=[
+                make_tx_ledger(address.address, "OUT", "swap", symbol="USDC"),
+                make_tx_ledger(address.address, "IN", "swap", symbol="WAVAX"),
+            ],
+            tx_logical_type=TX_LOGICAL_TYPE.swap,
+        )
+    )
+    send = tx_logical_store._create_for_tests(
+        make_tx_logical(
+            entity_name=entity.name,
+            address=address.address,
+            timestamp=1,
+            tx_ledgers=[
+                make_tx_ledger(address.address, "OUT", "send", symbol="USDC"),
+            ],
+            tx_logical_type=TX_LOGICAL_TYPE.send,
+        )
+    )
+
+    # Stores write straight to the tables, grouping and the API refresh the index when they're done
+    tx_logical_store.refresh_search_index()
+
+    def search(**params):
+        response = client.get(
+            f"/entities/{entity.id}/tx_logicals/search", params=params
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    found = search(q="usd")
+    assert sorted(t["id"] for t in found["results"]) == sorted([swap.id, send.id])
+    assert found["total"] == 2
+    assert found["facets"]["tx_logical_type"] == {"send": 1, "swap": 1}
+    assert found["facets"]["symbol"] == {"USDC": 2, "WAVAX": 1}
+    assert found["facets"]["chain"] == {"ethereum": 2}
+
+    assert [t["id"] for t in search(q="wavax")["results"]] == [swap.id]
+    assert [t["id"] for t in search(q=send.outs[0].hash[:15])["results"]] == [send.id]
+    assert search(q="usdc", tx_logical_type="send")["total"] == 1
+
+    # Edits made straight to the tables are marked pending, searching doesn't write so they show up after a refresh
+    test_db.execute("UPDATE tx_logical SET note = ? WHERE id = ?", ["rent", send.id])
+    test_db.execute(
+        "UPDATE tx_ledger SET to_address_name = ? WHERE id = ?",
+        ["Landlord", send.outs[0].id],
+    )
+    changes = test_db.con.total_changes
+    assert search(q="rent landlord")["total"] == 0
+    assert test_db.con.total_changes == changes
+    tx_logical_store.refresh_search_index()
+    assert [t["id"] for t in search(q="rent landlord")["results"]] == [send.id]
+    assert search(q="wavax")["facets"]["symbol"] == {"USDC": 1, "WAVAX": 1}
+
+    # Writes through the API refresh the index before they return
+    wavax = [l for l in swap.ins if l.symbol == "WAVAX"][0]
+    response = client.put(f"/tx_ledgers/{wavax.id}/tx_logical_id/{send.id}")
+    assert response.status_code == 200
+    assert [t["id"] for t in search(q="wavax")["results"]] == [send.id]
+
+
 def test_update_tx_logical_type(test_db):
     entity_store = EntityStore(test_db)
     entity = entity_store.create(name="Foo")
@@ -612,3 +751,78 @@ def test_get_balances(test_db):
     response = client.get(f"/entities/{entity.id}/balances/")
     assert response.status_code == 200
     assert response.json() == jsonable_encoder([ab1, ab2])
+
+
+def test_manual_balances_get_symbol_fixes(test_db):
+    entity = EntityStore(test_db).create(name="Foo")
+    address = AddressStore(test_db).create(
+        "foo", Chain.ethereum, "0x123", entity_id=entity.id
+    )
+    balance = dict(symbol="USDC.e", exposure_symbol="USDC.e", amount="100")
+    response = client.post(f"/addresses/{address.id}/manual_balances", json=balance)
+    assert response.status_code == 200
+    [created] = AssetBalanceCurrentStore(test_db).find(source="manual")
+    assert (created.exposure_symbol, created.stable) == ("USDC", 1)
+
+    balance = dict(created.dict(), symbol="WETH", exposure_symbol="WETH")
+    response = client.put(
+        f"/addresses/{address.id}/manual_balances/{created.id}",
+        json=jsonable_encoder(balance),
+    )
+    assert response.status_code == 200
+    [updated] = AssetBalanceCurrentStore(test_db).find(source="manual")
+    assert (updated.symbol, updated.exposure_symbol) == ("WETH", "ETH")
+
+
+def test_get_balance_history(test_db):
+    entity_store = EntityStore(test_db)
+    entity = entity_store.create(name="Foo")
+
+    address_store = AddressStore(test_db)
+    address = address_store.create("foo", Chain.ethereum, "0x123", entity_id=entity.id)
+
+    asset_balance_history_store = AssetBalanceHistoryStore(test_db)
+    for updated, usd_value in [(3600, 10), (7200, 20)]:
+        asset_balance_history_store.save(
+            AssetBalance(
+                source="debank",
+                address=address.address,
+                chain=Chain.ethereum.value,
+                symbol="ETH",
+                exposure_symbol="ETH",
+                protocol="wallet",
+                price=Decimal(usd_value),
+                amount=Decimal(1),
+                usd_value=Decimal(usd_value),
+                updated=updated,
+                extra="{}",
+            )
+        )
+
+    response = client.get(
+        f"/entities/{entity.id}/balances/history?start=0&end=10000&resolution=3600"
+    )
+    assert response.status_code == 200
+    assert response.json() == [
+        dict(timestamp=3600, usd_value=10.0),
+        dict(timestamp=7200, usd_value=20.0),
+    ]
+
+    # 0 is a timestamp, not a missing one
+    response = client.get(f"/entities/{entity.id}/balances/history?start=0&end=0")
+    assert response.status_code == 200
+    assert response.json() == []
+
+    response = client.get(f"/entities/{entity.id}/balances/history?resolution=0")
+    assert response.status_code == 422
+
+
+def test_get_metrics(test_db):
+    EntityStore(test_db).create(name="Foo")
+    test_db.query("SELECT * FROM entity")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE perfi_db_query_total counter" in response.text
+    assert 'perfi_db_query_total{db=":memory:"}' in response.text
@@ -2,6 +2,7 @@ import json
 
 from perfi.constants.paths import DB_SCHEMA_PATH
 from perfi.db import DB
+from perfi.migrations import migrate
 import pytest
 import os
 from pathlib import Path
@@ -32,14 +33,17 @@ def test_db(monkeypatch):
     seq_line = "CREATE TABLE sqlite_sequence(name,seq);"
     db_schema = db_schema.replace(seq_line, "")
     tdb.cur.executescript(db_schema)
+    migrate(tdb)
 
     # Ensure tests don't depend on any on-disk DB state or external price APIs.
     monkeypatch.setattr(price_module, "db", tdb)
     import perfi.asset as asset_module
     import bin.map_assets as map_assets_module
+    import perfi.tx_stream as tx_stream_module
 
     monkeypatch.setattr(asset_module, "db", tdb)
     monkeypatch.setattr(map_assets_module, "db", tdb)
+    monkeypatch.setattr(tx_stream_module, "db", tdb)
 
     stubbed_daily_prices_usd = {
         # Used by exchange-import tests (e.g. Kraken fee pricing); the code fetches daily prices.
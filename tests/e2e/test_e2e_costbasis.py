@@ -1,11 +1,14 @@
 from decimal import Decimal
+import json
 from pprint import pprint
+import sqlite3
 
 import jsonpickle
 import pytest
 from pytest import approx
 
 from perfi.costbasis import regenerate_costbasis_lots
+from perfi.db import DB
 from perfi.events import EventStore
 from perfi.models import (
     TxLedger,
@@ -15,7 +18,10 @@ from perfi.models import (
     CostbasisLot,
     CostbasisDisposal,
     load_flags,
+    load_lot_histories,
+    LotHistoryError,
 )
+from perfi.price import _add_price_to_db
 from perfi.transaction.chain_to_ledger import update_entity_transactions
 from perfi.transaction.ledger_to_logical import TransactionLogicalGrouper
 from tests.helpers import *
@@ -28,6 +34,8 @@ make: TxFactory = TxFactory()
 
 
 price_feed = MockPriceFeed()
+# conftest stubs PriceFeed.get for every test, so keep a reference to the real one
+price_feed_get = PriceFeed.get
 
 
 @pytest.fixture(scope="function", autouse=True)
@@ -72,10 +80,11 @@ def get_costbasis_lots(test_db, entity, address):
     """
     params = [entity, address]
     results = test_db.query(sql, params)
+    histories = load_lot_histories([r["history"] for r in results])
     lots_to_return = []
-    for r in results:
+    for r, history in zip(results, histories):
         r = dict(**r)
-        r["history"] = jsonpickle.decode(r["history"])
+        r["history"] = history
         flags = load_flags(CostbasisLot.__name__, r["tx_ledger_id"])
         lot = CostbasisLot(flags=flags, **r)
         lots_to_return.append(lot)
@@ -269,6 +278,21 @@ class TestCostbasisGeneral:
         print(foo_lots[0].history[0])
         assert foo_lots[0].history[0].amount == 10
 
+    def test_lot_history_with_missing_tx_ledger_raises(self, test_db):
+        make.tx(ins=["5 AVAX"], timestamp=1, from_address="A FRIEND")
+        price_feed.stub_price(1, "avalanche-2", 1.00)
+        common(test_db)
+
+        [tx_ledger_id] = [r[0] for r in test_db.query("SELECT id FROM tx_ledger")]
+        history = json.dumps([[tx_ledger_id, "5"]])
+        [[t]] = load_lot_histories([history])
+        assert (t.id, t.amount) == (tx_ledger_id, 5)
+
+        # e.g. the chain was re-imported with new tx_ledger ids since the lots were generated
+        test_db.execute("DELETE FROM tx_ledger WHERE id = ?", tx_ledger_id)
+        with pytest.raises(LotHistoryError, match="regenerate"):
+            load_lot_histories([history])
+
 
 class TestCostbasisFees:
     def test_fee_total_value_is_added_to_costbasis_total_usd_for_new_lots(
@@ -1503,3 +1527,435 @@ class TODO:
     ):
         # Initial Receive so we have a non-zero costbasis_lot of AVAX
         make.tx(ins=["1 AVAX"], timestamp=1, from_address="A FRIEND")
+
+
+class TestCostbasisParallel:
+    def setup_txs(self, step=1):
+        # step spaces the txs out, a day apart they can have their own daily price in the prices table
+        t1, t2, t3, t4 = [1 + i * step for i in range(4)]
+        make.tx(ins=["5 AVAX"], timestamp=t1, from_address="A FRIEND")
+        price_feed.stub_price(t1, "avalanche-2", 1.00)
+        make.tx(ins=["100 USDC"], timestamp=t2, from_address="A FRIEND")
+        price_feed.stub_price(t2, "usd-coin", 1.00)
+        make.tx(
+            outs=["1 AVAX"],
+            ins=["10 JOE"],
+            debank_name="swapExactTokensForETH",
+            fee=0.25,
+            fee_usd=1.25,
+            timestamp=t3,
+            to_address="Some DEX",
+        )
+        price_feed.stub_price(t3, "avalanche-2", 5.00)
+        price_feed.stub_price(t3, "joe", 0.50)
+        make.tx(
+            outs=["10 USDC"],
+            fee=0.1,
+            fee_usd=0.6,
+            timestamp=t4,
+            to_address="A FRIEND",
+        )
+        price_feed.stub_price(t4, "avalanche-2", 6.00)
+        price_feed.stub_price(t4, "usd-coin", 1.00)
+
+    def use_file_db(self, test_db, monkeypatch, tmp_path):
+        """
+        Copy test_db to a file and point perfi at it, so spawned workers (which import perfi.db fresh) open the same
+        DB. They don't get the MockPriceFeed either, so its stubs go in the prices table for their offline PriceFeed.
+        """
+        for stub in price_feed.stubs.values():
+            day_epoch = stub.epoch // 86400 * 86400
+            existing = test_db.query(
+                "SELECT price FROM prices WHERE coin_id = ? AND epoch = ?",
+                [stub.coin_id, day_epoch],
+            )
+            assert not existing or existing[0][0] == stub.price
+            _add_price_to_db(
+                test_db, CoinPrice("coingecko", stub.coin_id, day_epoch, stub.price)
+            )
+        monkeypatch.setenv("PERFI_OFFLINE_PRICES", "1")
+
+        path = str(tmp_path / "perfi.db")
+        con = sqlite3.connect(path)
+        test_db.con.backup(con)
+        con.close()
+        file_db = DB(path)
+        for module in [
+            "perfi.costbasis",
+            "perfi.costbasis_parallel",
+            "perfi.models",
+            "perfi.asset",
+            "perfi.price",
+            "perfi.tx_stream",
+            "perfi.transaction.chain_to_ledger",
+            "perfi.transaction.ledger_to_logical",
+        ]:
+            monkeypatch.setattr(f"{module}.db", file_db)
+        return file_db
+
+    def snapshot(self, test_db):
+        lots = test_db.query("SELECT * FROM costbasis_lot ORDER BY tx_ledger_id")
+        disposals = test_db.query(
+            "SELECT * FROM costbasis_disposal ORDER BY tx_ledger_id, basis_tx_ledger_id"
+        )
+        flags = test_db.query(
+            "SELECT target_type, target_id, name FROM flag ORDER BY target_type, target_id, name"
+        )
+        return (
+            [tuple(r) for r in lots],
+            [tuple(r)[1:] for r in disposals],
+            [tuple(r) for r in flags],
+        )
+
+    def test_partitions_books_and_splits_fees(self, test_db, monkeypatch):
+        monkeypatch.setattr("perfi.costbasis_parallel.db", test_db)
+        monkeypatch.setattr("perfi.costbasis_parallel.price_feed", price_feed)
+        from perfi.costbasis_parallel import (
+            partition_tx_logicals,
+            prepare_tx_logicals,
+            PART_MAIN,
+            PART_FEE,
+        )
+
+        self.setup_txs()
+        common(test_db)
+
+        ids = [
+            r["id"]
+            for r in test_db.query("SELECT id FROM tx_logical ORDER BY timestamp")
+        ]
+        components = partition_tx_logicals(prepare_tx_logicals(entity_name, ids))
+
+        # AVAX and JOE are tied by the swap, USDC is on its own except for the fee of its send
+        assert [[(t.order, t.part) for t in tasks] for tasks in components] == [
+            [(0, "all"), (2, "all"), (3, PART_FEE)],
+            [(1, "all"), (3, PART_MAIN)],
+        ]
+
+    def test_parallel_matches_sequential(self, test_db, monkeypatch):
+        monkeypatch.setattr("perfi.costbasis_parallel.db", test_db)
+        monkeypatch.setattr("perfi.costbasis_parallel.price_feed", price_feed)
+
+        self.setup_txs()
+        common(test_db)
+        sequential = self.snapshot(test_db)
+        assert len(sequential[0]) == 3
+        assert len(sequential[1]) == 1
+
+        regenerate_costbasis_lots(entity_name, quiet=True, workers=4)
+
+        assert self.snapshot(test_db) == sequential
+
+    def setup_restored_lots(self, test_db):
+        """Close 2021 and regenerate sequentially, returning the snapshot a parallel run has to match"""
+        from perfi.costbasis import CostbasisYearCloser
+
+        mid_2021 = 1622505600
+        mid_2022 = 1654041600
+        make.tx(ins=["5 AVAX"], timestamp=mid_2021, from_address="A FRIEND")
+        price_feed.stub_price(mid_2021, "avalanche-2", 1.00)
+        make.tx(ins=["100 USDC"], timestamp=mid_2021 + 1, from_address="A FRIEND")
+        price_feed.stub_price(mid_2021 + 1, "usd-coin", 1.00)
+        for timestamp in [mid_2021 + 86400, mid_2022]:
+            make.tx(
+                outs=["1 AVAX"],
+                ins=["10 JOE"],
+                debank_name="swapExactTokensForETH",
+                fee=0.00,
+                timestamp=timestamp,
+                to_address="Some DEX",
+            )
+            price_feed.stub_price(timestamp, "avalanche-2", 5.00)
+            price_feed.stub_price(timestamp, "joe", 0.50)
+        make.tx(
+            outs=["10 USDC"], fee=0.00, timestamp=mid_2022 + 1, to_address="A FRIEND"
+        )
+        price_feed.stub_price(mid_2022 + 1, "avalanche-2", 5.00)
+        price_feed.stub_price(mid_2022 + 1, "usd-coin", 1.00)
+        common(test_db)
+        CostbasisYearCloser(entity_name, 2021, None).snapshot_closing_lots()
+
+        # Both runs start from the 2021 closing book and draw its AVAX and USDC lots down in 2022
+        regenerate_costbasis_lots(entity_name, quiet=True, workers=1)
+        sequential = self.snapshot(test_db)
+        sql = """SELECT current_amount FROM costbasis_lot WHERE symbol = ?"""
+        assert [r[0] for r in test_db.query(sql, "AVAX")] == [3]
+        assert [r[0] for r in test_db.query(sql, "USDC")] == [90]
+        return sequential
+
+    def test_workers_draw_down_restored_lots(self, test_db, monkeypatch):
+        from concurrent.futures import Future
+
+        monkeypatch.setattr("perfi.costbasis_parallel.db", test_db)
+        monkeypatch.setattr("perfi.costbasis_parallel.price_feed", price_feed)
+
+        class InlineExecutor:
+            # Runs each component on a private copy of the DB like a spawned worker would, so only what
+            # process_component sends back makes it into test_db
+            def __init__(self, **kwargs):
+                pass
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def submit(self, fn, *args):
+                future = Future()
+                with test_db.using(test_db.copy_to_memory()):
+                    future.set_result(fn(*args))
+                return future
+
+        sequential = self.setup_restored_lots(test_db)
+
+        monkeypatch.setattr(test_db, "db_file", "workers.db")
+        monkeypatch.setattr(
+            "perfi.costbasis_parallel.ProcessPoolExecutor", InlineExecutor
+        )
+        regenerate_costbasis_lots(entity_name, quiet=True, workers=4)
+
+        assert self.snapshot(test_db) == sequential
+
+    def test_spawned_workers_match_sequential(self, test_db, monkeypatch, tmp_path):
+        monkeypatch.setattr("perfi.costbasis_parallel.price_feed", price_feed)
+        # Only this test's prices go in the prices table
+        price_feed.clear_stubs()
+
+        self.setup_txs(step=86400)
+        common(test_db)
+        sequential = self.snapshot(test_db)
+        assert len(sequential[0]) == 3
+        assert len(sequential[1]) == 1
+
+        # A real spawn ProcessPoolExecutor, each worker on its own in-memory copy of the file
+        file_db = self.use_file_db(test_db, monkeypatch, tmp_path)
+        regenerate_costbasis_lots(entity_name, quiet=True, workers=2)
+
+        assert self.snapshot(file_db) == sequential
+
+    def test_spawned_workers_draw_down_restored_lots(
+        self, test_db, monkeypatch, tmp_path
+    ):
+        monkeypatch.setattr("perfi.costbasis_parallel.db", test_db)
+        monkeypatch.setattr("perfi.costbasis_parallel.price_feed", price_feed)
+        price_feed.clear_stubs()
+        sequential = self.setup_restored_lots(test_db)
+
+        # Spawned workers send back the 2022 drawdowns of the restored 2021 lots
+        file_db = self.use_file_db(test_db, monkeypatch, tmp_path)
+        regenerate_costbasis_lots(entity_name, quiet=True, workers=2)
+
+        assert self.snapshot(file_db) == sequential
+        sql = """SELECT current_amount FROM costbasis_lot WHERE symbol = ? AND locked_for_year = 2021"""
+        assert [r[0] for r in file_db.query(sql, "AVAX")] == [3]
+        assert [r[0] for r in file_db.query(sql, "USDC")] == [90]
+
+
+class TestCostbasisBatch:
+    def test_batch_summarizes_and_keeps_other_entities_flags(
+        self, test_db, monkeypatch, tmp_path
+    ):
+        monkeypatch.setattr("perfi.costbasis_batch.db", test_db)
+        monkeypatch.setattr("perfi.costbasis_batch.LOG_DIR", str(tmp_path))
+        from perfi.costbasis_batch import run_batch, write_run_summary
+
+        # Sending AVAX we never received makes a flagged zero-cost lot
+        make.tx(outs=["1 AVAX"], timestamp=1, to_address="A FRIEND")
+        price_feed.stub_price(1, "avalanche-2", 1.00)
+        common(test_db)
+        setup_entity(test_db, "__OTHER_ENTITY__", [(chain, "__OTHER_ADDRESS__")])
+
+        [summary] = run_batch([entity_name])
+        assert summary.ok
+        assert summary.lots == 1
+        assert summary.flags >= 1
+        flags = test_db.query("SELECT * FROM flag")
+
+        # Regenerating another entity leaves this one's flags alone
+        summaries = run_batch(["__OTHER_ENTITY__", entity_name], processes=4)
+        assert [s.entity for s in summaries] == ["__OTHER_ENTITY__", entity_name]
+        assert summaries[0].lots == 0
+        assert summaries[1].flags == summary.flags
+        assert len(test_db.query("SELECT * FROM flag")) == len(flags)
+
+        path = write_run_summary(summaries, 1.0, path=str(tmp_path / "summary.json"))
+        totals = json.load(open(path))["totals"]
+        assert totals["entities"] == 2
+        assert totals["lots"] == 1
+
+
+class TestCostbasisCompare:
+    def test_compare_matches_a_run_per_algorithm(self, test_db, monkeypatch):
+        monkeypatch.setattr("perfi.costbasis_compare.db", test_db)
+        from perfi.costbasis import lot_algorithm
+        from perfi.costbasis_compare import compare_lot_algorithms
+
+        make.tx(ins=["1 AVAX"], timestamp=1, from_address="A FRIEND")
+        price_feed.stub_price(1, "avalanche-2", 1.00)
+        make.tx(ins=["1 AVAX"], timestamp=2, from_address="A FRIEND")
+        price_feed.stub_price(2, "avalanche-2", 3.00)
+        make.tx(
+            outs=["1 AVAX"],
+            ins=["10 JOE"],
+            debank_name="swapExactTokensForETH",
+            fee=0.00,
+            timestamp=3,
+            to_address="Some DEX",
+        )
+        price_feed.stub_price(3, "avalanche-2", 5.00)
+        price_feed.stub_price(3, "joe", 0.50)
+        common(test_db)
+        lots = test_db.query("SELECT * FROM costbasis_lot ORDER BY tx_ledger_id")
+
+        summary = compare_lot_algorithms(entity_name, progress=False)
+        gains = {row["algorithm"]: row["total_usd"] for row in summary}
+        assert gains == {"hifo": 2, "low": 4, "fifo": 4, "lifo": 2}
+
+        # The entity's own costbasis is untouched
+        after = test_db.query("SELECT * FROM costbasis_lot ORDER BY tx_ledger_id")
+        assert [tuple(r) for r in after] == [tuple(r) for r in lots]
+
+        for algorithm in ["fifo", "lifo"]:
+            with lot_algorithm(algorithm):
+                regenerate_costbasis_lots(entity_name, quiet=True)
+            sql = """SELECT basis_tx_ledger_id, amount, basis_usd, total_usd FROM {} WHERE entity = ? {}"""
+            sequential = test_db.query(
+                sql.format("costbasis_disposal", ""), entity_name
+            )
+            compared = test_db.query(
+                sql.format("costbasis_disposal_scenario", "AND algorithm = ?"),
+                [entity_name, algorithm],
+            )
+            assert [tuple(r) for r in compared] == [tuple(r) for r in sequential]
+
+
+class TestCostbasisYearSnapshot:
+    def test_regeneration_starts_from_the_closed_year(self, test_db, monkeypatch):
+        from types import SimpleNamespace
+        from perfi.costbasis import (
+            CostbasisGenerator,
+            CostbasisYearCloser,
+            YearClosedError,
+        )
+
+        mid_2021 = 1622505600
+        mid_2022 = 1654041600
+        make.tx(ins=["5 AVAX"], timestamp=mid_2021, from_address="A FRIEND")
+        price_feed.stub_price(mid_2021, "avalanche-2", 1.00)
+        for timestamp in [mid_2021 + 86400, mid_2022]:
+            make.tx(
+                outs=["1 AVAX"],
+                ins=["10 JOE"],
+                debank_name="swapExactTokensForETH",
+                fee=0.00,
+                timestamp=timestamp,
+                to_address="Some DEX",
+            )
+            price_feed.stub_price(timestamp, "avalanche-2", 5.00)
+            price_feed.stub_price(timestamp, "joe", 0.50)
+        common(test_db)
+
+        def snapshot():
+            # Closing the year locks its lots, which is all that should differ
+            lots = test_db.query("SELECT * FROM costbasis_lot ORDER BY tx_ledger_id")
+            disposals = test_db.query(
+                "SELECT * FROM costbasis_disposal ORDER BY timestamp"
+            )
+            return [
+                tuple(r[k] for k in r.keys() if k != "locked_for_year") for r in lots
+            ], [tuple(r)[1:] for r in disposals]
+
+        full = snapshot()
+
+        # Stale live rows for the year are regenerated before it's closed
+        test_db.execute("DELETE FROM costbasis_disposal")
+
+        # The closing book is as of the end of 2021, even though the lots have been drawn down since
+        assert CostbasisYearCloser(entity_name, 2021, None).snapshot_closing_lots() == 2
+        sql = """SELECT current_amount, locked_for_year FROM costbasis_lot_snapshot WHERE year = 2021 AND symbol = 'AVAX'"""
+        assert tuple(test_db.query(sql)[0]) == (4, 2021)
+        assert snapshot()[1] == full[1][:1]
+
+        processed = []
+        process = CostbasisGenerator.process
+        monkeypatch.setattr(
+            CostbasisGenerator,
+            "process",
+            lambda self, *args, **kwargs: processed.append(self.tx_logical.timestamp)
+            or process(self, *args, **kwargs),
+        )
+        args = SimpleNamespace(year=2022, resumefrom=None, debugtx=None)
+        regenerate_costbasis_lots(entity_name, args=args, quiet=True)
+        assert processed == [mid_2022]
+        assert snapshot() == full
+
+        regenerate_costbasis_lots(entity_name, quiet=True)
+        assert snapshot() == full
+
+        with pytest.raises(YearClosedError):
+            args = SimpleNamespace(year=2021, resumefrom=None, debugtx=None)
+            regenerate_costbasis_lots(entity_name, args=args, quiet=True)
+
+
+class TestCostbasisOfflineBundle:
+    def test_entity_bundle_prices_mapped_assets(self, test_db, monkeypatch, tmp_path):
+        import perfi.price as price_module
+        from perfi.price import _add_price_to_db
+        from perfi.price_bundle import (
+            entity_coin_ids,
+            export_price_bundle,
+            import_price_bundle,
+        )
+
+        # Aave's avUSDC is priced as usd-coin for costbasis (COSTBASIS_LIKEKIND), not by its own asset_price_id
+        avusdc = "0x46a51127c3ce23fb7ab1de06226147f446e4a857"
+        day = 86400
+        jan_1_2022 = 1640995200
+        make.tx(
+            ins=[f"100 avUSDC|{avusdc}"],
+            timestamp=jan_1_2022,
+            from_address="A FRIEND",
+        )
+        make.tx(
+            outs=[f"10 avUSDC|{avusdc}"],
+            fee=0.00,
+            timestamp=jan_1_2022 + day,
+            to_address="A FRIEND",
+        )
+        for timestamp in [jan_1_2022, jan_1_2022 + day]:
+            price_feed.stub_price(timestamp, "usd-coin", 1.00)
+            price_feed.stub_price(timestamp, "avalanche-2", 100.00)
+        common(test_db)
+
+        # Ledgers carry the most specific asset_price_id, which isn't the one costbasis prices the lots with
+        sql = """UPDATE tx_ledger SET asset_price_id = 'aave-usdc' WHERE asset_tx_id = ?"""
+        test_db.execute(sql, avusdc)
+        for timestamp in [jan_1_2022, jan_1_2022 + day]:
+            for coin_id in ["aave-usdc", "usd-coin"]:
+                _add_price_to_db(
+                    test_db, CoinPrice("coingecko", coin_id, timestamp, 1.00)
+                )
+        coin_ids = entity_coin_ids(test_db, entity_name)
+        assert coin_ids == ["aave-usdc", "usd-coin"]
+
+        # Only the prices in the entity's bundle are there when costbasis runs offline
+        bundle = tmp_path / "prices.bundle"
+        export_price_bundle(test_db, bundle, coin_ids=coin_ids)
+        test_db.execute("DELETE FROM prices")
+        test_db.execute("UPDATE tx_ledger SET price_usd = NULL")
+        TxLogical.from_id.cache_clear()
+        import_price_bundle(test_db, bundle)
+
+        def no_network(*args, **kwargs):
+            raise AssertionError("offline price feed went to the network")
+
+        monkeypatch.setattr(price_module, "get_coingecko_price_for_day", no_network)
+        monkeypatch.setattr(PriceFeed, "get", price_feed_get)
+        monkeypatch.setattr("perfi.costbasis.price_feed", PriceFeed(offline=True))
+        regenerate_costbasis_lots(entity_name, quiet=True)
+
+        [lot] = get_costbasis_lots(test_db, entity_name, address)
+        assert lot.current_amount == 90
+        assert lot.price_usd == 1
+        assert lot.basis_usd == 100
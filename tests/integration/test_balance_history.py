@@ -0,0 +1,140 @@
+import json
+from decimal import Decimal
+
+from perfi.balance.history import (
+    DAY,
+    HOUR,
+    insert_balance_history,
+    downsample_balance_history,
+    entity_value_series,
+)
+from perfi.models import AddressStore, Chain, EntityStore
+
+address = "0x123"
+NOW = 1_000 * DAY
+
+
+def snapshot(test_db, updated, usd_value, symbol="ETH"):
+    insert_balance_history(
+        test_db,
+        dict(
+            source="debank",
+            address=address,
+            chain="eth",
+            symbol=symbol,
+            exposure_symbol=symbol,
+            protocol="wallet",
+            price=Decimal(usd_value),
+            amount=Decimal(1),
+            usd_value=Decimal(usd_value),
+            updated=updated,
+            extra=json.dumps({"symbol": symbol}),
+        ),
+    )
+
+
+def history_timestamps(test_db):
+    sql = "SELECT DISTINCT updated FROM balance_history ORDER BY updated"
+    return [r["updated"] for r in test_db.query(sql)]
+
+
+def test_json_is_deduplicated(test_db):
+    snapshot(test_db, NOW - 2, 10)
+    snapshot(test_db, NOW - 1, 11)
+
+    assert test_db.query("SELECT COUNT(*) FROM balance_json")[0][0] == 1
+    keys = test_db.query("SELECT DISTINCT extra FROM balance_history")
+    assert len(keys) == 1
+    assert len(keys[0]["extra"]) == 40
+
+
+def test_downsampling_keeps_last_snapshot_per_bucket(test_db):
+    recent = NOW - DAY
+    hourly = NOW - 30 * DAY
+    daily = NOW - 200 * DAY
+    for ts in [recent, recent + 60, hourly, hourly + 60, daily, daily + HOUR]:
+        snapshot(test_db, ts, 10)
+        snapshot(test_db, ts, 5, symbol="USDC")
+
+    downsample_balance_history(test_db, now=NOW)
+
+    assert history_timestamps(test_db) == [
+        daily + HOUR,
+        hourly + 60,
+        recent,
+        recent + 60,
+    ]
+    # Both tokens of each surviving snapshot are kept
+    assert test_db.query("SELECT COUNT(*) FROM balance_history")[0][0] == 8
+
+
+def test_downsampling_only_compacts_newly_aged_windows(test_db):
+    hourly = NOW - 30 * DAY
+    for ts in [hourly, hourly + 60]:
+        snapshot(test_db, ts, 10)
+    downsample_balance_history(test_db, now=NOW)
+    assert history_timestamps(test_db) == [hourly + 60]
+
+    # A backfilled snapshot in a window that's already compacted is left for a full pass
+    snapshot(test_db, hourly + 30, 10, symbol="OLD")
+    # This one ages out of the raw window by the next refresh
+    recent = NOW - 6 * DAY - 2 * HOUR
+    for ts in [recent, recent + 60]:
+        snapshot(test_db, ts, 10, symbol="NEW")
+    assert downsample_balance_history(test_db, now=NOW + DAY) == 1
+    assert history_timestamps(test_db) == [hourly + 30, hourly + 60, recent + 60]
+    # The deleted snapshot's JSON is still used by the one that was kept
+    assert test_db.query("SELECT COUNT(*) FROM balance_json")[0][0] == 3
+
+    assert downsample_balance_history(test_db, now=NOW + DAY, full=True) == 1
+    assert history_timestamps(test_db) == [hourly + 60, recent + 60]
+    # OLD's JSON went with its only row
+    keys = test_db.query("SELECT data FROM balance_json ORDER BY data")
+    assert [json.loads(r["data"])["symbol"] for r in keys] == ["ETH", "NEW"]
+
+
+def test_entity_value_series(test_db):
+    entity = EntityStore(test_db).create(name="Foo")
+    AddressStore(test_db).create("foo", Chain.ethereum, address, entity_id=entity.id)
+    snapshot(test_db, HOUR, 10)
+    snapshot(test_db, HOUR, 5, symbol="USDC")
+    snapshot(test_db, HOUR + 60, 12)
+    snapshot(test_db, 3 * HOUR, 20)
+
+    series = entity_value_series(test_db, entity.id, 0, NOW, resolution=HOUR)
+
+    assert series == [
+        dict(timestamp=HOUR, usd_value=12.0),
+        dict(timestamp=3 * HOUR, usd_value=20.0),
+    ]
+
+
+def test_entity_value_series_carries_values_from_before_start(test_db):
+    entity = EntityStore(test_db).create(name="Foo")
+    AddressStore(test_db).create("foo", Chain.ethereum, address, entity_id=entity.id)
+    AddressStore(test_db).create("bar", Chain.ethereum, "0x456", entity_id=entity.id)
+    # Written once, well before the window
+    snapshot(test_db, HOUR, 10)
+    snapshot(test_db, 2 * HOUR, 99)
+    insert_balance_history(
+        test_db,
+        dict(
+            source="debank",
+            address="0x456",
+            chain="eth",
+            symbol="USDC",
+            exposure_symbol="USDC",
+            protocol="wallet",
+            price=Decimal(1),
+            amount=Decimal(5),
+            usd_value=Decimal(5),
+            updated=6 * HOUR,
+            extra=json.dumps({"symbol": "USDC"}),
+        ),
+    )
+
+    series = entity_value_series(test_db, entity.id, 5 * HOUR, NOW, resolution=HOUR)
+    assert series == [
+        dict(timestamp=5 * HOUR, usd_value=99.0),
+        dict(timestamp=6 * HOUR, usd_value=104.0),
+    ]
@@ -0,0 +1,83 @@
+import pytest
+
+from perfi.balance.updating import (
+    ingest_debank_token_list,
+    ingest_debank_complex_protocol_list,
+    backfill_balance_symbols,
+    load_balance_symbol_map,
+)
+from perfi.constants.balance_symbols import default_balance_symbol_map
+
+address = "0x123"
+
+
+@pytest.fixture(scope="function", autouse=True)
+def common_setup(monkeypatch, test_db):
+    monkeypatch.setattr("perfi.balance.updating.db", test_db)
+
+
+def token(symbol, amount=1.0, price=1.0):
+    return dict(
+        chain="eth",
+        name=symbol,
+        symbol=symbol,
+        optimized_symbol=symbol,
+        price=price,
+        amount=amount,
+    )
+
+
+def balances(test_db, table):
+    sql = f"SELECT symbol, exposure_symbol, stable, amount FROM {table} ORDER BY id"
+    return [tuple(r) for r in test_db.query(sql)]
+
+
+def test_exposure_symbols_are_applied_at_ingest(test_db):
+    tokens = [token("WETH"), token("USDC.e"), token("FOO")]
+    ingest_debank_token_list(address, tokens, 1, ["balance_current", "balance_history"])
+
+    for table in ["balance_current", "balance_history"]:
+        assert [b[:3] for b in balances(test_db, table)] == [
+            ("WETH", "ETH", None),
+            ("USDC.e", "USDC", 1),
+            ("FOO", "FOO", None),
+        ]
+
+
+def test_symbol_map_is_seeded_by_migrations_and_read_only(test_db):
+    changes = test_db.con.total_changes
+    symbol_map = load_balance_symbol_map()
+    assert test_db.con.total_changes == changes
+    assert set(symbol_map) == {row[0] for row in default_balance_symbol_map()}
+    assert symbol_map["WETH"]["exposure_symbol"] == "ETH"
+
+
+def test_loans_are_negated_once_per_table(test_db):
+    protocol = dict(
+        id="aave",
+        portfolio_item_list=[
+            dict(
+                detail_types=["lending"],
+                detail=dict(borrow_token_list=[token("DAI", amount=10.0)]),
+            )
+        ],
+    )
+    ingest_debank_complex_protocol_list(
+        address, [protocol], 1, ["balance_current", "balance_history"]
+    )
+
+    assert balances(test_db, "balance_current") == [("DAI", "DAI", 1, -10)]
+    assert balances(test_db, "balance_history") == [("DAI", "DAI", 1, -10)]
+
+
+def test_backfill_existing_rows(test_db):
+    sql = """INSERT INTO balance_current (source, address, symbol, exposure_symbol)
+             VALUES ('debank', ?, 'WAVAX', 'WAVAX')
+          """
+    test_db.execute(sql, address)
+
+    backfill_balance_symbols()
+
+    assert [b[:3] for b in balances(test_db, "balance_current")] == [
+        ("WAVAX", "AVAX", None)
+    ]
@@ -0,0 +1,30 @@
+from pathlib import Path
+
+from perfi.benchmark import BenchmarkConfig, SyntheticDataGenerator
+from perfi.constants.paths import DB_SCHEMA_PATH
+from perfi.db import DB
+
+
+def generate(tmp_path, name):
+    db = DB(db_file=":memory:", same_thread=False)
+    db.cur.executescript(Path(DB_SCHEMA_PATH).read_text())
+    csv_dir = tmp_path / name
+    csv_dir.mkdir()
+    config = BenchmarkConfig(entities=2, wallets=2, txs=20, fills=10, seed=7)
+    entities = SyntheticDataGenerator(db, config).generate(str(csv_dir))
+    return db, entities
+
+
+def test_synthetic_data_is_deterministic(tmp_path):
+    db_a, entities_a = generate(tmp_path, "a")
+    db_b, entities_b = generate(tmp_path, "b")
+
+    sql = (
+        "SELECT chain, address, hash, timestamp FROM tx_chain ORDER BY timestamp, hash"
+    )
+    rows_a = [tuple(r) for r in db_a.query(sql)]
+    assert len(rows_a) == 2 * 2 * 20
+    assert rows_a == [tuple(r) for r in db_b.query(sql)]
+
+    for a, b in zip(entities_a, entities_b):
+        assert Path(a["fills_csv"]).read_text() == Path(b["fills_csv"]).read_text()
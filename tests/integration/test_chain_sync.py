@@ -0,0 +1,200 @@
+import asyncio
+import json
+import re
+
+import perfi.ingest.chain
+from perfi.ingest.chain import (
+    DeBankBrowserTransactionsFetcher,
+    DeBankTransactionsFetcher,
+    INCREMENTAL_SYNC_OVERLAP,
+    get_sync_since,
+    history_response_done,
+    load_tx_chain_raw,
+    merge_with_saved,
+    save_to_db,
+)
+
+ADDRESS = "0x0000000000000000000000000000000000000001"
+
+
+def debank_tx(id, time_at):
+    return dict(
+        id=id,
+        chain="eth",
+        time_at=time_at,
+        cate_id="receive",
+        receives=[],
+        sends=[],
+    )
+
+
+class FakeDeBankCache:
+    """Serves pages of 2 txs, newest first, paging on start_time like the DeBank API"""
+
+    def __init__(self, times):
+        self.times = sorted(times, reverse=True)
+        self.start_times = []
+
+    def get(self, url, refresh=False, headers=None):
+        start_time = int(re.search(r"start_time=(\d+)", url).group(1))
+        self.start_times.append(start_time)
+        older = [t for t in self.times if not start_time or t < start_time]
+        page = [debank_tx(f"0x{t:x}", t) for t in older[:2]]
+        return dict(value=json.dumps(dict(history_list=page)))
+
+
+def unified(hash, timestamp, source, data):
+    return {
+        source: data,
+        "chain": "ethereum",
+        "address": ADDRESS,
+        "hash": hash,
+        "timestamp": timestamp,
+    }
+
+
+def test_incremental_debank_sync(test_db, monkeypatch):
+    monkeypatch.setattr(perfi.ingest.chain, "db", test_db)
+    fake_cache = FakeDeBankCache([100, 200, 300, 400, 500, 600])
+    monkeypatch.setattr(perfi.ingest.chain, "cache", fake_cache)
+
+    fetcher = DeBankTransactionsFetcher(test_db)
+    fetcher.DEBANK_KEY = "test"
+
+    # Full sync pages back until DeBank runs out of history
+    assert len(fetcher.scrape_history(ADDRESS)) == 6
+    assert fake_cache.start_times == [0, 500, 300, 100]
+
+    # Incremental syncs stop at the page that reaches since
+    fake_cache.start_times = []
+    txs = fetcher.scrape_history(ADDRESS, since=450)
+    assert [t["time_at"] for t in txs] == [600, 500, 400, 300]
+    assert fake_cache.start_times == [0, 500]
+
+    # since is the newest stored tx minus the overlap
+    assert get_sync_since(ADDRESS) == 0
+    t = INCREMENTAL_SYNC_OVERLAP + 1000
+    save_to_db(
+        {"a": unified("0xa", t, "etherscan", dict(_id="0xa", extra=1))},
+        progress=False,
+    )
+    assert get_sync_since(ADDRESS) == 1000
+
+    # Re-fetched txs are merged into what was stored rather than replacing it
+    merged = merge_with_saved(
+        {
+            "a": unified("0xa", t, "debank", dict(_id="0xa")),
+            "b": unified("0xb", t + 1, "debank", dict(_id="0xb")),
+        }
+    )
+    save_to_db(merged, progress=False)
+    saved = load_tx_chain_raw("ethereum", ADDRESS, "0xa")
+    assert saved["etherscan"] == dict(_id="0xa", extra=1)
+    assert saved["debank"] == dict(_id="0xa")
+    assert "etherscan" not in load_tx_chain_raw("ethereum", ADDRESS, "0xb")
+
+
+class FakeBrowser:
+    closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class FakePlaywright:
+    def __init__(self):
+        self.launches = []
+        self.chromium = self
+
+    async def launch(self, headless=True):
+        browser = FakeBrowser()
+        self.launches.append(browser)
+        return browser
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class FakeBrowserFetcher(DeBankBrowserTransactionsFetcher):
+    def __init__(self, max_pages):
+        super().__init__(max_pages=max_pages)
+        self.running = 0
+        self.max_running = 0
+
+    async def _scrape_history_responses(self, browser, address, until_epoch=0):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        page = dict(
+            history_list=[debank_tx(address, until_epoch + 1)],
+            project_dict={},
+            token_dict={},
+        )
+        return [json.dumps(dict(error_code=0, data=page))]
+
+
+def test_debank_browser_pool(monkeypatch):
+    playwright = FakePlaywright()
+    monkeypatch.setattr(perfi.ingest.chain, "async_playwright", lambda: playwright)
+
+    fetcher = FakeBrowserFetcher(max_pages=3)
+    addresses = [f"0x{i:040x}" for i in range(8)]
+    fetcher.prefetch_histories({a: 100 for a in addresses})
+
+    # One browser for every address, a few pages at a time
+    assert len(playwright.launches) == 1
+    assert playwright.launches[0].closed
+    assert 1 < fetcher.max_running <= 3
+
+    txs = fetcher.scrape_history(addresses[0], since=100)
+    assert [t["_id"] for t in txs] == [addresses[0]]
+    assert addresses[0] not in fetcher.prefetched_responses
+
+
+def test_debank_browser_pool_falls_back_for_failed_addresses(monkeypatch, caplog):
+    playwright = FakePlaywright()
+    monkeypatch.setattr(perfi.ingest.chain, "async_playwright", lambda: playwright)
+
+    class FlakyFetcher(FakeBrowserFetcher):
+        def __init__(self, failing):
+            super().__init__(max_pages=3)
+            self.failing = set(failing)
+
+        async def _scrape_history_responses(self, browser, address, until_epoch=0):
+            if address in self.failing:
+                self.failing.remove(address)
+                raise RuntimeError("page crashed")
+            return await super()._scrape_history_responses(
+                browser, address, until_epoch
+            )
+
+    addresses = [f"0x{i:040x}" for i in range(4)]
+    fetcher = FlakyFetcher(failing=[addresses[1]])
+    fetcher.prefetch_histories({a: 100 for a in addresses})
+
+    # Everyone else's responses are kept, the failure is logged
+    assert sorted(fetcher.prefetched_responses) == sorted(
+        a for a in addresses if a != addresses[1]
+    )
+    assert addresses[1] in caplog.text
+
+    # and the failed address is scraped on its own
+    txs = fetcher.scrape_history(addresses[1], since=100)
+    assert [t["_id"] for t in txs] == [addresses[1]]
+    assert len(playwright.launches) == 2
+
+
+def test_history_response_done():
+    def response(*times):
+        page = dict(history_list=[debank_tx("0x1", t) for t in times])
+        return json.dumps(dict(error_code=0, data=page))
+
+    assert history_response_done(response())
+    assert not history_response_done(response(300, 200))
+    assert history_response_done(response(300, 200), until_epoch=250)
+    assert not history_response_done(response(300, 200), until_epoch=150)
+    assert not history_response_done("not json")
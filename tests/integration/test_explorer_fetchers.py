@@ -0,0 +1,57 @@
+import threading
+import time
+
+import pytest
+
+from perfi.ingest.chain import TransactionsFetcher, MAX_FETCHES_PER_HOST
+
+
+class FakeFetcher(TransactionsFetcher):
+    DETAILS_HOST = "explorer.test"
+
+    def __init__(self, fail=()):
+        self.fail = fail
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.scraped = []
+
+    def _scrape_transaction_details(self, hash):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.scraped.append(hash)
+        time.sleep(0.02)
+        with self.lock:
+            self.running -= 1
+        if hash in self.fail:
+            raise Exception(f"Couldn't scrape {hash}")
+        return dict(hash=hash)
+
+
+def index_page(hashes):
+    rows = "".join(
+        f'<tr><td><a href="/tx/{h}">{h[:10]}</a></td><td><a href="/address/0x1">0x1</a></td></tr>'
+        for h in hashes
+    )
+    return f"<html><body><table><tbody>{rows}</tbody></table></body></html>"
+
+
+def test_prefetches_details_concurrently_with_bounded_parallelism():
+    hashes = [f"0x{i:064x}" for i in range(12)]
+    fetcher = FakeFetcher(fail=[hashes[3]])
+    doc = fetcher._parse_html(index_page(hashes + hashes[:2]))
+
+    fetcher._prefetch_transaction_details(doc)
+
+    # Each linked tx is scraped once, a few at a time
+    assert sorted(fetcher.scraped) == hashes
+    assert 1 < fetcher.max_running <= MAX_FETCHES_PER_HOST
+
+    assert fetcher._get_transaction_details(hashes[0]) == dict(hash=hashes[0])
+    assert len(fetcher.scraped) == len(hashes)
+
+    # Failures are retried in the loop so they raise where they always did
+    with pytest.raises(Exception):
+        fetcher._get_transaction_details(hashes[3])
+    assert len(fetcher.scraped) == len(hashes) + 1
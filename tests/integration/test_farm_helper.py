@@ -0,0 +1,107 @@
+from pytest import approx
+from scipy.optimize import minimize_scalar
+
+from perfi.farming.farm_helper import (
+    get_optimal_days_between_compound_events,
+    get_optimal_claiming_events,
+    get_claim_schedules,
+)
+
+
+def test_optimal_days_between_compound_events():
+    # Matches scipy's bounded minimize_scalar on the same objective
+    assert get_optimal_days_between_compound_events(306024.53, 0.24, 40) == approx(
+        23.4434, rel=1e-4
+    )
+
+
+def test_batched_positions_match_individual_solves():
+    def compounded(principal, claiming_events, apy, fee):
+        return (principal - fee / apy * claiming_events) * (
+            1 + apy / claiming_events
+        ) ** claiming_events + fee / apy * claiming_events
+
+    positions = [
+        (1_000, 0.1, 1),
+        (5_000, 0.05, 2),
+        (50_000, 0.24, 10),
+        (306024.53, 0.24, 40),
+        (2_500, 1.5, 3),
+    ]
+    batched = get_optimal_claiming_events(*zip(*positions))
+    for (principal, apy, fee), events in zip(positions, batched):
+        # Independent reference: a bounded scalar solve per position, like the original solver
+        reference = minimize_scalar(
+            lambda n: -compounded(principal, n, apy, fee),
+            bounds=[0.1, principal * apy / fee],
+            method="bounded",
+            options=dict(xatol=1e-8),
+        )
+        assert events == approx(reference.x, rel=1e-3)
+        assert compounded(principal, events, apy, fee) == approx(
+            -reference.fun, rel=1e-9
+        )
+
+
+def test_claim_schedule():
+    schedule = get_claim_schedules([1_000], [0.2], [1])[0]
+    assert schedule["days_between_claims"] == approx(365 / schedule["claims_per_year"])
+    assert schedule["claim_at_usd_value"] == approx(
+        1_000 * 0.2 * schedule["days_between_claims"] / 365
+    )
+
+
+def test_claim_schedules_use_each_positions_apy(test_db, monkeypatch):
+    import json
+    from perfi.farming import farm_helper
+    from perfi.models import AddressStore, Chain, EntityStore
+
+    monkeypatch.setattr(farm_helper, "db", test_db)
+    entity = EntityStore(test_db).create(name="Foo")
+    for address in ["0x1", "0x2"]:
+        AddressStore(test_db).create(
+            address, Chain.ethereum, address, entity_id=entity.id
+        )
+    sql = """INSERT INTO balance_current (source, address, chain, protocol, type, usd_value, extra) VALUES (?, ?, ?, ?, ?, ?, ?)"""
+    test_db.execute(
+        sql,
+        [
+            "debank",
+            "0x1",
+            "eth",
+            "aave",
+            "deposit",
+            10_000,
+            json.dumps({"pool": {"apy": 0.05}}),
+        ],
+    )
+    test_db.execute(
+        sql,
+        ["debank", "0x2", "eth", "aave", "deposit", 10_000, json.dumps({"detail": {}})],
+    )
+
+    def rewards():
+        return {
+            address: {"address": address, "data": {"eth": {"aave": {}}}}
+            for address in ["0x1", "0x2"]
+        }
+
+    # Without an APY to assume, the position DeBank didn't give one for gets no schedule
+    r = rewards()
+    farm_helper._add_claim_schedules("Foo", r, claim_fees={"eth": 5})
+    schedule = r["0x1"]["data"]["eth"]["aave"]["claim_schedule"]
+    assert schedule["apy"] == 0.05
+    assert schedule["claim_fee_usd"] == 5
+    assert schedule["claims_per_year"] == approx(
+        get_optimal_claiming_events([10_000], [0.05], [5])[0]
+    )
+    assert r["0x2"]["data"]["eth"]["aave"]["claim_schedule"] is None
+
+    test_db.execute(
+        "INSERT INTO setting (key, value) VALUES ('FARM_HELPER_APY', '0.3')"
+    )
+    r = rewards()
+    farm_helper._add_claim_schedules("Foo", r)
+    assert r["0x1"]["data"]["eth"]["aave"]["claim_schedule"]["apy"] == 0.05
+    assert r["0x2"]["data"]["eth"]["aave"]["claim_schedule"]["apy"] == 0.3
+    assert r["0x2"]["data"]["eth"]["aave"]["claim_schedule"]["claim_fee_usd"] == 40
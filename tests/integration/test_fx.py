@@ -0,0 +1,69 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+from perfi.fx import FxRateNotFound, FxRates, update_fx_rates
+
+ECB_CSV = """Date,USD,SGD,
+2022-01-10,1.1318,1.5338,
+2022-01-07,1.1298,N/A,
+2022-01-06,1.1315,1.5360,
+"""
+
+
+def epoch(day):
+    return int(datetime(day.year, day.month, day.day, 12).timestamp())
+
+
+def test_fx_rates_are_appended_and_interpolated(test_db, tmp_path, monkeypatch):
+    ecb_file = tmp_path / "eurofxref-hist.csv"
+    ecb_file.write_text(ECB_CSV)
+    assert update_fx_rates(test_db, ecb_file=str(ecb_file)) == 5
+    # Only newer days are appended
+    newer = "Date,USD,SGD,\n2022-01-11,1.1336,1.5336,\n"
+    ecb_file.write_text(ECB_CSV.replace("Date,USD,SGD,\n", newer))
+    assert update_fx_rates(test_db, ecb_file=str(ecb_file)) == 2
+
+    fx = FxRates(test_db)
+    assert fx.rate("USD", date(2022, 1, 7)) == Decimal("1.1298")
+    # Weekend between Friday and Monday
+    assert (
+        fx.rate("USD", date(2022, 1, 8))
+        == (Decimal("1.1298") * 2 + Decimal("1.1318")) / 3
+    )
+    # N/A days are treated as missing
+    assert (
+        fx.rate("SGD", date(2022, 1, 7))
+        == (Decimal("1.5360") * 3 + Decimal("1.5338")) / 4
+    )
+    assert fx.rate("EUR", date(1999, 1, 1)) == Decimal(1)
+
+    amount = Decimal(100)
+    converted = amount / Decimal("1.5336") * Decimal("1.1336")
+    assert fx.convert(amount, "SGD", "USD", epoch(date(2022, 1, 11))) == converted
+    conversions = [
+        (amount, "SGD", "USD", epoch(date(2022, 1, 11))),
+        (amount, "USD", "USD", epoch(date(2022, 1, 6))),
+    ]
+    assert fx.convert_many(conversions) == [converted, amount]
+
+    with pytest.raises(FxRateNotFound):
+        fx.rate("USD", date(2022, 1, 5))
+
+    # Days past the newest rate go back to the table once, not on every lookup
+    queries = []
+    query = test_db.query
+    monkeypatch.setattr(
+        test_db,
+        "query",
+        lambda sql, params=(): queries.append(sql) or query(sql, params),
+    )
+    for _ in range(3):
+        with pytest.raises(FxRateNotFound):
+            fx.rate("USD", date(2022, 1, 12))
+    assert len(queries) == 1
+    test_db.execute(
+        "INSERT INTO fx_rates (currency, day, rate) VALUES ('USD', '2022-01-13', '1.1400')"
+    )
+    assert fx.rate("USD", date(2022, 1, 13)) == Decimal("1.1400")
@@ -12,6 +12,8 @@ from perfi.ingest.exchange import (
     CoinbaseProImporter,
     KrakenImporter,
     CoinbaseTransactionHistoryImporter,
+    ImportCheckpoint,
+    parse_timestamp,
 )
 from perfi.models import TxLedger
 from perfi.transaction.chain_to_ledger import update_entity_transactions
@@ -1188,3 +1190,63 @@ class TestGeminiImporter:
         )
         actual_out.id = None
         assert actual_out == expected_out
+
+
+class TestStreamingImport:
+    def test_parse_timestamp_matches_arrow(self):
+        for value in [
+            "2016-10-29 11:30:16",
+            "2020-01-01T00:00:00Z",
+            "2021-11-06T09:33:32.618Z",
+            "2021-12-08 03:47:23.014",
+            "2021-12-08 03:47:23+08:00",
+            "2022-01-12",
+        ]:
+            assert parse_timestamp(value) == arrow.get(value).timestamp()
+
+    def test_stream_import_matches_import_and_resumes(
+        self, test_db, tmp_path, monkeypatch
+    ):
+        monkeypatch.setattr("perfi.ingest.exchange.CACHE_DIR", str(tmp_path))
+        export = tmp_path / "coinbase.csv"
+        export.write_text(table_to_csv(coinbase_sample_raw_txs_tbl))
+
+        with open(export) as f:
+            CoinbaseImporter().do_import(
+                f,
+                entity_address_for_imports=address,
+                exchange_account_id="SomeCoinbaseAccountId",
+            )
+        imported = [
+            tuple(r) for r in get_tx_chains(test_db, "import.coinbase", address)
+        ]
+        test_db.execute("DELETE FROM tx_chain")
+
+        checkpoint = ImportCheckpoint("coinbase", "SomeCoinbaseAccountId", str(export))
+        with open(export) as f:
+            CoinbaseImporter().do_stream_import(
+                f,
+                entity_address_for_imports=address,
+                exchange_account_id="SomeCoinbaseAccountId",
+                chunk_size=2,
+                checkpoint=checkpoint,
+            )
+        streamed = [
+            tuple(r) for r in get_tx_chains(test_db, "import.coinbase", address)
+        ]
+        assert sorted(streamed) == sorted(imported)
+        assert checkpoint.load() == 0
+
+        # Pretend an earlier run saved the first 10 rows (the converted from/to pair is rows 8 and 9)
+        test_db.execute("DELETE FROM tx_chain")
+        checkpoint.save(10)
+        with open(export) as f:
+            CoinbaseImporter().do_stream_import(
+                f,
+                entity_address_for_imports=address,
+                exchange_account_id="SomeCoinbaseAccountId",
+                checkpoint=checkpoint,
+            )
+        resumed = get_tx_chains(test_db, "import.coinbase", address)
+        assert len(resumed) == 3
+        assert checkpoint.load() == 0
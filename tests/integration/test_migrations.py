@@ -0,0 +1,94 @@
+import shutil
+from copy import copy
+from decimal import Decimal
+from pathlib import Path
+
+import jsonpickle
+import pytest
+
+from perfi.constants.paths import MIGRATIONS_DIR
+from perfi.migrations import get_schema_version, migrate, get_migrations
+from perfi.models import TxLedger
+
+
+def index_names(db):
+    sql = """SELECT name FROM sqlite_master WHERE type = 'index'"""
+    return {r["name"] for r in db.query(sql)}
+
+
+def test_test_db_is_fully_migrated(test_db):
+    latest = get_migrations()[-1][0]
+    assert get_schema_version(test_db) == latest
+    assert "idx_tx_ledger_address" in index_names(test_db)
+    # Already applied migrations are skipped
+    assert migrate(test_db) == []
+
+
+def test_migrations_apply_in_order_once(test_db, tmp_path):
+    migrations_dir = tmp_path / "migrations"
+    migrations_dir.mkdir()
+    version = get_schema_version(test_db)
+    (migrations_dir / f"{version + 2:04}_add_foo_index.sql").write_text(
+        'CREATE INDEX "idx_foo_bar" ON "foo" ("bar");'
+    )
+    (migrations_dir / f"{version + 1:04}_add_foo.sql").write_text(
+        'CREATE TABLE "foo" ("bar" TEXT);'
+    )
+    (migrations_dir / "notes.txt").write_text("not a migration")
+
+    assert migrate(test_db, migrations_dir) == [version + 1, version + 2]
+    assert get_schema_version(test_db) == version + 2
+    assert "idx_foo_bar" in index_names(test_db)
+    assert migrate(test_db, migrations_dir) == []
+
+
+def test_failed_migration_is_not_recorded(test_db, tmp_path):
+    version = get_schema_version(test_db)
+    (tmp_path / f"{version + 1:04}_broken.sql").write_text(
+        'CREATE TABLE "foo" ("bar" TEXT); SELECT * FROM no_such_table;'
+    )
+
+    with pytest.raises(Exception):
+        migrate(test_db, tmp_path)
+
+    assert get_schema_version(test_db) == version
+    assert test_db.query("SELECT name FROM sqlite_master WHERE name = 'foo'") == []
+
+
+def test_lot_history_migration_converts_pickled_tx_ledgers(test_db, tmp_path):
+    t = TxLedger(
+        id="tx1",
+        chain="avalanche",
+        address="0x1",
+        hash="0xh",
+        from_address="0x2",
+        to_address="0x1",
+        asset_tx_id="avax",
+        isfee=0,
+        amount=Decimal("1.5"),
+        timestamp=1,
+        direction="IN",
+        tx_ledger_type="deposit",
+    )
+    adjusted = copy(t)
+    adjusted.amount = Decimal("0.5")
+    sql = """INSERT INTO costbasis_lot (tx_ledger_id, entity, history, flags) VALUES (?, ?, ?, ?)"""
+    test_db.execute(
+        sql, ["lot1", "e", jsonpickle.encode([t, adjusted]), jsonpickle.encode([])]
+    )
+    test_db.execute(sql, ["lot2", "e", '[["tx1","2"]]', None])
+
+    version = get_schema_version(test_db)
+    shutil.copy(
+        Path(MIGRATIONS_DIR) / "0002_costbasis_lot_history_refs.py",
+        tmp_path / f"{version + 1:04}_costbasis_lot_history_refs.py",
+    )
+    assert migrate(test_db, tmp_path) == [version + 1]
+
+    rows = test_db.query(
+        "SELECT history, flags FROM costbasis_lot ORDER BY tx_ledger_id"
+    )
+    assert [tuple(r) for r in rows] == [
+        ('[["tx1","1.5"],["tx1","0.5"]]', None),
+        ('[["tx1","2"]]', None),
+    ]
@@ -0,0 +1,89 @@
+import os
+import time
+
+import pytest
+
+import perfi.price as price_module
+from perfi.price import CoinPrice, PriceFeed, _add_price_to_db
+from perfi.price_bundle import (
+    PriceBundleError,
+    export_price_bundle,
+    import_price_bundle,
+)
+
+# conftest stubs PriceFeed.get for every test, so keep a reference to the real one
+price_feed_get = PriceFeed.get
+
+DAY = 86400
+JAN_1_2022 = 1640995200
+
+
+def test_price_bundle_round_trip_and_offline_lookups(test_db, tmp_path, monkeypatch):
+    for i, price in enumerate([46000.5, 47000.25, 46500.0]):
+        _add_price_to_db(
+            test_db, CoinPrice("coingecko", "bitcoin", JAN_1_2022 + i * DAY, price)
+        )
+    _add_price_to_db(test_db, CoinPrice("coingecko", "ethereum", JAN_1_2022, 3700.0))
+    test_db.execute_many(
+        "INSERT INTO fx_rates (currency, day, rate) VALUES (?, ?, ?)",
+        [("SGD", "2022-01-03", "1.5340"), ("USD", "2022-01-03", "1.1300")],
+    )
+
+    bundle = tmp_path / "prices.bundle"
+    counts = export_price_bundle(
+        test_db, bundle, coin_ids=["bitcoin"], end=JAN_1_2022 + DAY
+    )
+    assert counts["prices"] == 2
+
+    test_db.execute("DELETE FROM prices")
+    test_db.execute("DELETE FROM fx_rates")
+    assert import_price_bundle(test_db, bundle) == counts
+    rows = test_db.query("SELECT coin_id, epoch, price FROM prices ORDER BY epoch")
+    assert [tuple(r) for r in rows] == [
+        ("bitcoin", JAN_1_2022, 46000.5),
+        ("bitcoin", JAN_1_2022 + DAY, 47000.25),
+    ]
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("offline price feed went to the network")
+
+    monkeypatch.setattr(price_module, "get_coingecko_price_for_day", no_network)
+    offline_feed = PriceFeed(offline=True)
+    coin_price = price_feed_get(offline_feed, "bitcoin", JAN_1_2022 + DAY + 3600)
+    assert coin_price.price == 47000.25
+    assert price_feed_get(offline_feed, "ethereum", JAN_1_2022) is None
+
+    bundle.write_bytes(b"not a bundle")
+    with pytest.raises(PriceBundleError):
+        import_price_bundle(test_db, bundle)
+
+
+def test_price_bundle_fx_days_are_utc(test_db, tmp_path):
+    test_db.execute_many(
+        "INSERT INTO fx_rates (currency, day, rate) VALUES (?, ?, ?)",
+        [("SGD", "2022-01-03", "1.5340"), ("SGD", "2022-01-04", "1.5300")],
+    )
+    bundle = tmp_path / "prices.bundle"
+    # Midnight UTC is still the previous day in Los Angeles
+    tz = os.environ.get("TZ")
+    os.environ["TZ"] = "America/Los_Angeles"
+    time.tzset()
+    try:
+        export_price_bundle(
+            test_db,
+            bundle,
+            start=JAN_1_2022 + 3 * DAY,
+            end=JAN_1_2022 + 3 * DAY,
+        )
+    finally:
+        if tz is None:
+            del os.environ["TZ"]
+        else:
+            os.environ["TZ"] = tz
+        time.tzset()
+
+    test_db.execute("DELETE FROM fx_rates")
+    import_price_bundle(test_db, bundle)
+    assert [r["day"] for r in test_db.query("SELECT day FROM fx_rates")] == [
+        "2022-01-04"
+    ]
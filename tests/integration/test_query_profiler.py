@@ -0,0 +1,57 @@
+from perfi import query_profiler
+from perfi.query_profiler import (
+    normalize_sql,
+    load_profile,
+    load_profiles,
+    profile_path,
+    profile_paths,
+)
+
+
+def test_normalize_sql():
+    a = normalize_sql("SELECT * FROM tx_ledger WHERE id IN (?, ?, ?) AND amount > 5")
+    b = normalize_sql(
+        """SELECT *
+                         FROM tx_ledger
+                         WHERE id IN (?, ?) AND amount > 10"""
+    )
+    assert a == b == "SELECT * FROM tx_ledger WHERE id IN (?...) AND amount > ?"
+    assert normalize_sql("SELECT * FROM entity WHERE name = 'peepo'") == (
+        "SELECT * FROM entity WHERE name = ?"
+    )
+
+
+def test_profiling_aggregates_and_captures_full_scans(test_db, tmp_path):
+    test_db.enable_profiling(slow_ms=0, save_at_exit=False)
+    for name in ["a", "b", "c"]:
+        test_db.execute("INSERT INTO entity (name) VALUES (?)", name)
+        test_db.query("SELECT * FROM entity WHERE note = ?", name)
+    test_db.query("SELECT * FROM entity WHERE id = ?", [1])
+
+    top = {s.sql: s for s in test_db.profiler.top()}
+    scan = top["SELECT * FROM entity WHERE note = ?"]
+    assert scan.calls == 3
+    assert scan.slow_calls == 3
+    assert scan.full_scans == ["entity"]
+    assert top["INSERT INTO entity (name) VALUES (?)"].calls == 3
+    # Primary key lookups aren't flagged
+    assert top["SELECT * FROM entity WHERE id = ?"].full_scans == []
+
+    path = tmp_path / "profile.json"
+    test_db.profiler.save(str(path))
+    assert {s.sql for s in load_profile(str(path))} == set(top)
+
+
+def test_each_process_saves_its_own_profile(test_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(query_profiler, "LOG_DIR", str(tmp_path))
+    test_db.enable_profiling(slow_ms=0, save_at_exit=False)
+    test_db.query("SELECT * FROM entity WHERE note = ?", "a")
+    test_db.profiler.save(profile_path(test_db.db_name, 1))
+    test_db.query("SELECT * FROM entity WHERE note = ?", "b")
+    test_db.profiler.save(profile_path(test_db.db_name, 2))
+
+    paths = profile_paths(test_db.db_name)
+    assert len(paths) == 2
+    (scan,) = load_profiles(paths)
+    assert scan.calls == 3
+    assert scan.full_scans == ["entity"]
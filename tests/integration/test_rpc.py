@@ -0,0 +1,77 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import perfi.rpc
+from perfi.constants.paths import CACHEDB_SCHEMA_PATH
+from perfi.db import DB
+from perfi.rpc import RPCClient, RPCError, RPC_BATCH_SIZE
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, body):
+        self.body = body
+        self.text = str(body)
+
+    def json(self):
+        return self.body
+
+
+class FakeNode:
+    """Answers batches out of order, like nodes are allowed to"""
+
+    def __init__(self):
+        self.batches = []
+
+    def post(self, url, json=None, timeout=None):
+        self.batches.append(json)
+        responses = []
+        for call in reversed(json):
+            hash = call["params"][0]
+            if hash == "0xbad":
+                responses.append(dict(id=call["id"], error=dict(message="nope")))
+            elif call["method"].endswith("Receipt"):
+                result = dict(gasUsed="0x10", hash=hash)
+                responses.append(dict(id=call["id"], result=result))
+            else:
+                responses.append(dict(id=call["id"], result=dict(hash=hash)))
+        return FakeResponse(responses)
+
+
+@pytest.fixture
+def node(monkeypatch):
+    cache_db = DB(":memory:", same_thread=False)
+    cache_db.create_db(CACHEDB_SCHEMA_PATH)
+    fake_node = FakeNode()
+    fake_cache = SimpleNamespace(
+        db=cache_db, db_lock=threading.Lock(), _client=lambda: fake_node
+    )
+    monkeypatch.setattr(perfi.rpc, "cache", fake_cache)
+    return fake_node
+
+
+def test_lookup_batches_and_stores(node):
+    client = RPCClient("boba", url="http://node.test")
+    hashes = [f"0x{i:064x}" for i in range(RPC_BATCH_SIZE + 10)]
+
+    found = client.lookup(hashes, tx=False)
+    assert [len(b) for b in node.batches] == [RPC_BATCH_SIZE, 10]
+    assert all(found[h]["receipt"]["hash"] == h for h in hashes)
+
+    # Stored receipts aren't fetched again, only the txs we didn't have yet
+    found = client.lookup(hashes[:3] + [f" {hashes[3]} "])
+    assert len(node.batches) == 3
+    assert {c["method"] for c in node.batches[-1]} == {"eth_getTransactionByHash"}
+    assert found[hashes[3]]["tx"] == dict(hash=hashes[3])
+    assert client.get_receipt(hashes[0])["gasUsed"] == "0x10"
+    assert len(node.batches) == 3
+
+
+def test_lookup_errors(node):
+    client = RPCClient("harmony", url="http://node.test")
+    with pytest.raises(RPCError):
+        client.lookup(["0xbad"])
+    assert node.batches[0][0]["method"] == "hmyv2_getTransactionByHash"
@@ -1,10 +1,33 @@
+from decimal import Decimal
+
 import jsonpickle
 import pytest
 from pprint import pprint
 from tests.helpers import *
 from perfi.transaction.chain_to_ledger import update_entity_transactions
 from perfi.transaction.ledger_to_logical import TransactionLogicalGrouper
-from perfi.models import TxLogical, CostbasisLot, CostbasisDisposal, CostbasisIncome
+from perfi.models import (
+    TxLogical,
+    TxLedger,
+    TxLedgerRow,
+    TxLedgerStore,
+    CostbasisLot,
+    CostbasisDisposal,
+    CostbasisIncome,
+    Flag,
+    TX_LOGICAL_FLAG,
+    add_flag,
+    flag_index,
+    has_flag,
+    load_flags,
+    replace_flags,
+)
+from perfi.tx_stream import (
+    TX_LOGICAL_FLAG_BITS,
+    entity_tx_stream,
+    flag_names,
+    flags_bitmask,
+)
 
 
 chain = "avalanche"
@@ -64,3 +87,135 @@ class TestTxTyping:
 
         assert wrap.tx_logical_type == "wrap"
         assert unwrap.tx_logical_type == "unwrap"
+
+
+class TestTxLedgerRows:
+    def test_loaded_ledgers_are_rows_that_match_the_models(self, test_db, event_store):
+        make.tx(ins=["1 AVAX"], timestamp=1, from_adddress="A Friend")
+        map_assets()
+        update_entity_transactions(entity_name)
+        TransactionLogicalGrouper(entity_name, event_store).update_entity_transactions()
+
+        txl = get_tx_logicals(test_db, address)[0]
+        row = txl.ins[0]
+        assert isinstance(row, TxLedgerRow)
+
+        model = TxLedgerStore(test_db).find_by_primary_key(row.id)[0]
+        assert isinstance(model, TxLedger)
+        assert row == model.copy(update={"tx_logical_id": None})
+        assert row.to_model().amount == model.amount == Decimal(1)
+        assert row.auto_description() == model.auto_description()
+
+    def test_identical_transfers_get_distinct_stable_ids(self, test_db):
+        make.tx(ins=["1 AVAX", "1 AVAX"], timestamp=1, from_address="A Friend")
+        map_assets()
+
+        def ledger_ids():
+            update_entity_transactions(entity_name)
+            sql = """SELECT id, amount FROM tx_ledger WHERE address = ? ORDER BY id"""
+            return [tuple(r) for r in test_db.query(sql, [address])]
+
+        ids = ledger_ids()
+        assert len(ids) == 2
+        assert ids[0][0] != ids[1][0]
+        assert ids == ledger_ids()
+
+
+class TestEntityTxStream:
+    def test_stream_follows_grouping_and_flags(self, test_db, event_store):
+        make.tx(ins=["1 AVAX"], timestamp=1, from_adddress="A Friend")
+        make.tx(
+            ins=[f"1 WAVAX|{WAVAX}"], outs=["1 AVAX"], timestamp=2, to_adddress=WAVAX
+        )
+        map_assets()
+        update_entity_transactions(entity_name)
+        TransactionLogicalGrouper(entity_name, event_store).update_entity_transactions()
+
+        # Grouping leaves nothing pending
+        pending = "SELECT tx_logical_id FROM entity_tx_stream_pending"
+        assert test_db.query(pending) == []
+
+        txls = get_tx_logicals(test_db, address)
+        rows = entity_tx_stream(entity_name)
+        assert [(r["tx_logical_id"], r["tx_ledger_id"]) for r in rows] == [
+            (txl.id, led.id)
+            for txl in txls
+            for led in sorted(txl.tx_ledgers, key=lambda t: (t.timestamp, t.id))
+        ]
+        wrap = [r for r in rows if r["tx_logical_id"] == txls[1].id]
+        assert {r["tx_logical_type"] for r in wrap} == {"wrap"}
+        assert {r["symbol"] for r in wrap} == {"AVAX", "WAVAX"}
+        assert [r["flags"] for r in rows] == [0] * len(rows)
+        assert [r["tx_logical_id"] for r in entity_tx_stream(entity_name, 2, 3)] == [
+            txls[1].id
+        ] * len(wrap)
+
+        # Flags (and any other change) are picked up on the next read
+        add_flag(
+            "TxLogical", txls[0].id, Flag(source="manual", name="hidden_from_8949")
+        )
+        add_flag("TxLogical", txls[0].id, Flag(source="perfi", name="unknown_send"))
+        # Only the flagged tx_logical is rebuilt
+        assert [r[0] for r in test_db.query(pending)] == [txls[0].id]
+        first = entity_tx_stream(entity_name, 1, 2)
+        assert flag_names(first[0]["flags"]) == ["unknown_send", "hidden_from_8949"]
+        assert entity_tx_stream("__OTHER_ENTITY__") == []
+
+    def test_flag_bits_are_stable(self):
+        # Stored in entity_tx_stream.flags, so reordering TX_LOGICAL_FLAG mustn't change them
+        assert TX_LOGICAL_FLAG_BITS == {
+            "unknown_send": 1,
+            "zero_price": 2,
+            "auto_reconciled": 4,
+            "ignored_from_costbasis": 8,
+            "hidden_from_8949": 16,
+        }
+        assert set(TX_LOGICAL_FLAG_BITS) == {f.value for f in TX_LOGICAL_FLAG}
+        assert flags_bitmask(["hidden_from_8949", "zero_price"]) == 18
+
+
+class TestFlagIndex:
+    def test_flags_are_bulk_loaded_and_kept_current(self, test_db, monkeypatch):
+        for id in ["l1", "l2", "l3"]:
+            test_db.execute(
+                "INSERT INTO tx_logical (id, count, address) VALUES (?, 0, ?)",
+                [id, address],
+            )
+        add_flag(
+            "TxLogical", "l1", Flag(source="manual", name="ignored_from_costbasis")
+        )
+        add_flag("TxLogical", "l3", Flag(source="perfi", name="unknown_send"))
+        add_flag("CostbasisLot", "other", Flag(source="perfi", name="zero_price"))
+
+        queries = []
+        query = test_db.query
+        monkeypatch.setattr(
+            test_db,
+            "query",
+            lambda sql, params=(): queries.append(sql) or query(sql, params),
+        )
+
+        targets = [
+            ("TxLogical", "SELECT id FROM tx_logical WHERE address = ?", [address])
+        ]
+        with flag_index.loaded(targets):
+            loaded_queries = len(queries)
+            assert has_flag("TxLogical", "l1", "ignored_from_costbasis")
+            assert not has_flag("TxLogical", "l2", "ignored_from_costbasis")
+            assert [f.name for f in load_flags("TxLogical", "l3")] == ["unknown_send"]
+            assert len(queries) == loaded_queries
+
+            # Writes go to the DB and the index
+            add_flag("TxLogical", "l2", Flag(source="perfi", name="unknown_send"))
+            replace_flags("TxLogical", "l1", [])
+            assert has_flag("TxLogical", "l2", "unknown_send")
+            assert load_flags("TxLogical", "l1") == []
+
+            # Targets outside the loaded set are read from the DB once
+            assert has_flag("CostbasisLot", "other", "zero_price")
+            assert has_flag("CostbasisLot", "other", "zero_price")
+            assert len(queries) == loaded_queries + 1
+
+        assert not flag_index.active
+        assert load_flags("TxLogical", "l1") == []
+        assert [f.name for f in load_flags("TxLogical", "l2")] == ["unknown_send"]